@@ -0,0 +1,89 @@
+"""
+Write throughput and Athena scan size of the ConnectorFile output formats, on synthetic Jira-like rows.
+The scan size is the bytes Athena reads for `SELECT key, summary FROM issues WHERE status = 'Done'`: the whole
+file for CSV (compressed or not), only the key and summary column chunks of the status=Done files for Parquet.
+
+    python -m benchmarks.bench_columnar_output --rows 1000000
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import pyarrow.parquet as pq
+
+from src.lib.connectors.connector_file import ConnectorFile
+
+FIELDNAMES = ['id', 'key', 'url', 'description', 'status', 'summary']
+STATUSES = ('To Do', 'In Progress', 'Done', 'Blocked')
+
+
+def make_rows(count):
+    return [(str(10000 + i), 'TEST-{}'.format(i), 'http://jira.local/rest/api/2/issue/{}'.format(10000 + i),
+             'Description of issue {} with some repeated text '.format(i) * 4, STATUSES[i % len(STATUSES)],
+             'Issue {}'.format(i)) for i in range(count)]
+
+
+def parquet_scan_bytes(files, columns, partition=None):
+    """
+    Compressed size of the given column chunks, in the files of the partition directory if one is given
+    """
+    scanned = 0
+    for path in files:
+        if partition is not None and partition not in path:
+            continue
+        metadata = pq.ParquetFile(path).metadata
+        for group in range(metadata.num_row_groups):
+            row_group = metadata.row_group(group)
+            for index in range(row_group.num_columns):
+                column = row_group.column(index)
+                if column.path_in_schema in columns:
+                    scanned += column.total_compressed_size
+    return scanned
+
+
+def report(label, rows, seconds, size, scanned):
+    print('{:<28} {:>7.2f}s {:>10.0f} rows/s {:>9.1f} MB on disk {:>9.1f} MB scanned'.format(
+        label, seconds, rows / seconds, size / 1024.0 ** 2, scanned / 1024.0 ** 2))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=1000000)
+    args = parser.parse_args()
+
+    rows = make_rows(args.rows)
+    workdir = tempfile.mkdtemp()
+    connector = ConnectorFile(working_dir=workdir)
+    try:
+        dict_rows = [dict(zip(FIELDNAMES, row)) for row in rows]
+        for label, file_name, compression in (('csv (DictWriter)', 'issues.csv', None),
+                                              ('csv gzip', 'issues.csv.gz', 'gzip')):
+            start = time.perf_counter()
+            path = connector.save_dict_to_csvfile(dict_rows, file_name, FIELDNAMES, compression=compression)
+            elapsed = time.perf_counter() - start
+            report(label, args.rows, elapsed, os.path.getsize(path), os.path.getsize(path))
+        del dict_rows
+
+        for codec in ('snappy', 'zstd', 'gzip'):
+            for partition_cols in (None, ['status']):
+                dir_name = 'parquet_{}_{}'.format(codec, 'status' if partition_cols else 'flat')
+                start = time.perf_counter()
+                files = connector.save_rows_to_parquet(rows, dir_name, FIELDNAMES, partition_cols=partition_cols,
+                                                       compression=codec)
+                elapsed = time.perf_counter() - start
+                size = sum(os.path.getsize(path) for path in files)
+                if partition_cols:
+                    scanned = parquet_scan_bytes(files, ('key', 'summary'), partition='status=Done/')
+                else:
+                    # Without partitions the filter column is read too, from every file
+                    scanned = parquet_scan_bytes(files, ('key', 'summary', 'status'))
+                report('parquet {} {}'.format(codec, 'by status' if partition_cols else 'flat'), args.rows, elapsed,
+                       size, scanned)
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == '__main__':
+    main()
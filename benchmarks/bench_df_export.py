@@ -0,0 +1,81 @@
+"""
+DataFrame export: the iterrows/DictWriter path of the original save_df_to_csvfile against the chunked,
+vectorized ConnectorFile.save_df, for CSV (plain and gzip), JSON lines and Parquet.
+The iterrows path runs on at most --iterrows-rows rows and its time is scaled up to the frame size.
+
+    python -m benchmarks.bench_df_export --rows 1000000 10000000
+"""
+import argparse
+import csv
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from src.lib.connectors.connector_file import ConnectorFile
+
+FORMATS = (('csv', 'frame.csv', None), ('csv gzip', 'frame.csv.gz', 'gzip'), ('jsonl', 'frame.jsonl', None),
+           ('parquet snappy', 'frame.parquet', 'snappy'), ('parquet zstd', 'frame.zstd.parquet', 'zstd'))
+
+
+def make_frame(rows):
+    rng = np.random.default_rng(0)
+    return pd.DataFrame({
+        'id': np.arange(rows, dtype=np.int64),
+        'key': pd.Series(np.arange(rows)).map('TEST-{}'.format),
+        'status': pd.Categorical.from_codes(rng.integers(0, 4, rows), ['To Do', 'In Progress', 'Done', 'Blocked']),
+        'story_points': rng.random(rows) * 13,
+        'created': pd.Timestamp('2020-01-01') + pd.to_timedelta(rng.integers(0, 10 ** 8, rows), unit='s'),
+    })
+
+
+def iterrows_to_csv(data, file_path):
+    # The save_df_to_csvfile implementation this replaces
+    with open(file_path, 'w+', encoding="utf-8") as fp:
+        writer = csv.DictWriter(fp, fieldnames=list(data.columns))
+        writer.writeheader()
+        for c_index, c_row in data.iterrows():
+            writer.writerow(c_row.to_dict())
+
+
+def report(rows, label, seconds, size, note=''):
+    print('{:>9} rows  {:<18} {:>8.2f}s {:>11.0f} rows/s {:>8.1f} MB {}'.format(
+        rows, label, seconds, rows / seconds, size / 1024.0 ** 2, note))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000000, 10000000])
+    parser.add_argument('--iterrows-rows', type=int, default=200000)
+    parser.add_argument('--chunk-rows', type=int, default=100000)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    connector = ConnectorFile(working_dir=workdir)
+    try:
+        for rows in args.rows:
+            data = make_frame(rows)
+
+            sample = data.iloc[:args.iterrows_rows]
+            path = os.path.join(workdir, 'iterrows.csv')
+            start = time.perf_counter()
+            iterrows_to_csv(sample, path)
+            elapsed = (time.perf_counter() - start) * rows / len(sample)
+            report(rows, 'csv iterrows', elapsed, os.path.getsize(path) * rows / len(sample),
+                   '(scaled from {} rows)'.format(len(sample)) if len(sample) < rows else '')
+
+            for label, file_name, compression in FORMATS:
+                start = time.perf_counter()
+                path = connector.save_df(data, file_name, compression=compression, chunk_rows=args.chunk_rows)
+                report(rows, label, time.perf_counter() - start, os.path.getsize(path))
+                os.remove(path)
+            del data
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+"""
+Import time of the connectors and pipelines modules, each measured with python -X importtime in a fresh
+interpreter (best of --repeat runs, after one run warming the bytecode caches). Reports the cumulative import time
+of every module, the SDKs it pulls in and its heaviest imports, optionally as JSON compared with an earlier run:
+a module slower by more than --tolerance, or importing an SDK it did not import before, is a regression.
+
+    python -m benchmarks.bench_import_time --output imports.json
+    python -m benchmarks.bench_import_time --baseline imports.json --fail-on-regression
+    python -m benchmarks.bench_import_time --modules src.lib.connectors.connector_aws_s3 --top 20
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+MODULES = ('src.lib.connectors',
+           'src.lib.connectors.connector_aws_s3',
+           'src.lib.connectors.connector_aws_s3_async',
+           'src.lib.connectors.connector_aws_athenas',
+           'src.lib.connectors.connector_jira',
+           'src.lib.connectors.connector_file',
+           'src.lib.pipelines',
+           'src.lib.pipelines.runner',
+           'src.lib.pipelines.local_all_jira_issues_to_s3',
+           'src.lib.pipelines.incremental_jira_issues_to_s3')
+# Packages that should only be imported when a connector first needs them
+HEAVY = ('boto3', 'botocore', 's3transfer', 'aiobotocore', 'atlassian', 'requests', 'urllib3', 'pyarrow', 'pandas',
+         'numpy', 'asyncio', 'multiprocessing')
+
+
+def import_times(module):
+    """
+    :return: List of (name, depth, self us, cumulative us) tuples, one per module imported by `import module`
+    """
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(map(os.path.abspath, sys.path)))
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import ' + module], env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    if result.returncode:
+        raise RuntimeError('Importing {} failed:\n{}'.format(module, result.stderr))
+    times = []
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        own, cumulative, name = line[len('import time:'):].split('|')
+        times.append((name.strip(), len(name) - len(name.lstrip()), int(own), int(cumulative)))
+    return times
+
+
+def total_us(times, module):
+    # The module and its parent packages, not the interpreter startup imports (site, encodings...)
+    depth = min(depth for _, depth, _, _ in times)
+    return sum(cumulative for name, level, _, cumulative in times
+               if level == depth and (name == module or module.startswith(name + '.')))
+
+
+def measure(module, repeat, top):
+    import_times(module)
+    best = min((import_times(module) for _ in range(repeat)), key=lambda times: total_us(times, module))
+    names = {name for name, _, _, _ in best}
+    return {'ms': total_us(best, module) / 1000.0,
+            'modules': len(best),
+            'heavy': [package for package in HEAVY if package in names],
+            'top': [(name, own / 1000.0) for name, _, own, _ in sorted(best, key=lambda t: -t[2])[:top]]}
+
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    for module, result in results.items():
+        previous = baseline.get(module)
+        if previous is None:
+            continue
+        change = result['ms'] / previous['ms'] - 1 if previous['ms'] else 0
+        if change > tolerance:
+            regressions.append('{}: {:.1f} -> {:.1f} ms ({:+.0%})'.format(module, previous['ms'], result['ms'],
+                                                                         change))
+        added = sorted(set(result['heavy']) - set(previous['heavy']))
+        if added:
+            regressions.append('{}: now imports {}'.format(module, ', '.join(added)))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--modules', nargs='+', default=list(MODULES))
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--top', type=int, default=3, help='Heaviest imports listed per module, by own time')
+    parser.add_argument('--output', help='JSON file to write the results to')
+    parser.add_argument('--baseline', help='Results file of an earlier run to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Relative slowdown reported as a regression')
+    parser.add_argument('--fail-on-regression', action='store_true')
+    args = parser.parse_args()
+
+    results = {module: measure(module, args.repeat, args.top) for module in args.modules}
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as fp:
+            baseline = json.load(fp)['modules']
+
+    print('{:<50} {:>9} {:>8} {:>9}  {}'.format('module', 'ms', 'imports', 'vs base', 'SDKs imported'))
+    for module, result in results.items():
+        previous = baseline.get(module, {}).get('ms')
+        change = '{:+.0%}'.format(result['ms'] / previous - 1) if previous else ''
+        print('{:<50} {:>9.1f} {:>8} {:>9}  {}'.format(module, result['ms'], result['modules'], change,
+                                                        ', '.join(result['heavy']) or '-'))
+        for name, own in result['top']:
+            print('    {:<46} {:>9.1f}'.format(name, own))
+
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump({'python': sys.version.split()[0], 'modules': results}, fp, indent=2, sort_keys=True)
+        print('Results written to {}'.format(args.output))
+    regressions = compare(results, baseline, args.tolerance)
+    for regression in regressions:
+        print('REGRESSION {}'.format(regression))
+    if regressions and args.fail_on_regression:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
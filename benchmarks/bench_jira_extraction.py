@@ -0,0 +1,39 @@
+"""
+Throughput of ConnectorJIRA.iter_issues against the local Jira search stand-in: one page at a time versus
+parallel pages, with and without the field projection the pipeline uses.
+
+    python -m benchmarks.bench_jira_extraction --issues 20000 --latency-ms 80
+"""
+import argparse
+import time
+
+from src.lib.benchmarks.stand_ins import FakeJiraServer
+from src.lib.connectors.connector_jira import ConnectorJIRA
+from src.lib.pipelines.local_all_jira_issues_to_s3 import ISSUE_FIELDS
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--issues', type=int, default=20000)
+    parser.add_argument('--latency-ms', type=float, default=80)
+    parser.add_argument('--page-size', type=int, default=100)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 4, 8])
+    args = parser.parse_args()
+
+    with FakeJiraServer(issues=args.issues, latency=args.latency_ms / 1000.0,
+                        max_results_cap=args.page_size) as server:
+        connector = ConnectorJIRA(endpoint_url=server.url, username='bench', password='bench')
+        for fields in ('*all', ISSUE_FIELDS):
+            for workers in args.workers:
+                server.requests = 0
+                start = time.perf_counter()
+                count = sum(1 for _ in connector.iter_issues('project = BENCH ORDER BY key', fields=fields,
+                                                             page_size=args.page_size, max_workers=workers))
+                elapsed = time.perf_counter() - start
+                print('{:<10} workers={:<3} {:>7} issues {:>5} requests {:>7.2f}s {:>9.0f} issues/s'.format(
+                    'all' if fields == '*all' else 'projected', workers, count, server.requests, elapsed,
+                    count / elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+"""
+Peak memory and wall time of run_all_issues_to_s3, through a local file versus streaming into a multipart upload.
+Jira is the local search stand-in and S3 a local moto server, both in this process; every run happens in a fresh
+child process so its peak RSS is its own.
+
+    python -m src.lib.benchmarks.bench_jira_pipeline --issues 20000 50000
+"""
+import argparse
+import json
+import logging
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+MODES = {'local file': {'local_file': True},
+         'stream csv': {'output_format': 'csv'},
+         'stream jsonl': {'output_format': 'jsonl'}}
+
+
+def peak_rss_kb():
+    # VmHWM is the peak of this process image; ru_maxrss would also carry the parent's peak over fork/exec
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def child(mode, s3_endpoint, jira_endpoint, static_folder):
+    from setup import configs
+    configs.update(S3_ENDPOINT=s3_endpoint, S3_BUCKET='bench-pipeline', JIRA_ENDPOINT=jira_endpoint,
+                   STATIC_FOLDER=static_folder)
+    from src.lib.pipelines import local_all_jira_issues_to_s3
+
+    baseline = peak_rss_kb()
+    start = time.perf_counter()
+    local_all_jira_issues_to_s3.run_all_issues_to_s3(**MODES[mode])
+    elapsed = time.perf_counter() - start
+    peak = peak_rss_kb()
+    sys.stderr.write(json.dumps({'seconds': elapsed, 'baseline_kb': baseline, 'peak_kb': peak}) + '\n')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--issues', type=int, nargs='+', default=[20000])
+    parser.add_argument('--latency-ms', type=float, default=0)
+    parser.add_argument('--port', type=int, default=5056)
+    parser.add_argument('--child', nargs=4, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(*args.child)
+        return
+
+    import boto3
+    from moto.server import ThreadedMotoServer
+    from src.lib.benchmarks.stand_ins import FakeJiraServer
+    from src.lib.pipelines.local_all_jira_issues_to_s3 import UPLOAD_BUCKET
+
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = ThreadedMotoServer(port=args.port, verbose=False)
+    server.start()
+    s3_endpoint = 'http://localhost:{}'.format(args.port)
+    s3 = boto3.client('s3', endpoint_url=s3_endpoint, aws_access_key_id='foo', aws_secret_access_key='bar')
+    for bucket in ('bench-pipeline', UPLOAD_BUCKET):
+        s3.create_bucket(Bucket=bucket)
+
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(map(os.path.abspath, sys.path)))
+    # The children run this module under the package path it was started with
+    module = __spec__.name if __spec__ is not None else 'src.lib.benchmarks.bench_jira_pipeline'
+    try:
+        with tempfile.TemporaryDirectory() as workdir:
+            # The local file mode writes to ../../../STATIC_FOLDER
+            cwd = os.path.join(workdir, 'a', 'b', 'c')
+            os.makedirs(cwd)
+            os.makedirs(os.path.join(workdir, 'static'))
+            for issues in args.issues:
+                with FakeJiraServer(issues=issues, latency=args.latency_ms / 1000.0) as jira:
+                    for mode in MODES:
+                        result = subprocess.run([sys.executable, '-m', module, '--child', mode, s3_endpoint, jira.url,
+                                                 'static'],
+                                                cwd=cwd, env=env,
+                                                stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+                        if result.returncode:
+                            raise RuntimeError(result.stderr)
+                        stats = json.loads(result.stderr.strip().splitlines()[-1])
+                        print('{:>7} issues {:<13} {:>7.2f}s  peak RSS {:>7.1f} MB ({:+.1f} MB over imports)'.format(
+                            issues, mode, stats['seconds'], stats['peak_kb'] / 1024.0,
+                            (stats['peak_kb'] - stats['baseline_kb']) / 1024.0))
+    finally:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+"""
+Cost per call, seen by the caller, of the old print-based Logger.info against the queued Logger at an enabled level
+(text and JSON), a disabled level, and of a metrics observation. Log output goes to a file, /dev/null by default;
+--write-latency-us adds a delay to every write call, like a terminal or a pipe whose reader lags.
+
+    python -m benchmarks.bench_logging --calls 200000 --write-latency-us 20
+"""
+import argparse
+import os
+import sys
+import time
+
+
+class SlowStream:
+
+    def __init__(self, stream, latency):
+        self.stream = stream
+        self.latency = latency
+
+    def write(self, text):
+        if self.latency:
+            time.sleep(self.latency)
+        return self.stream.write(text)
+
+    def flush(self):
+        self.stream.flush()
+
+
+def timed(label, calls, function):
+    start = time.perf_counter()
+    for i in range(calls):
+        function(i)
+    elapsed = time.perf_counter() - start
+    sys.stderr.write('{:<28} {:>8.2f} us/call\n'.format(label, elapsed / calls * 1e6))
+    return elapsed
+
+
+def main():
+    from src.lib.logs.logger import Logger
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--calls', type=int, default=200000)
+    parser.add_argument('--output', default=os.devnull)
+    parser.add_argument('--write-latency-us', type=float, default=0)
+    args = parser.parse_args()
+
+    with open(args.output, 'w') as output:
+        sys.stdout = SlowStream(output, args.write_latency_us / 1e6)
+        try:
+            timed('print (old Logger.info)', args.calls, lambda i: print('key to delete:Uploads/{}'.format(i)))
+            timed('Logger.info text', args.calls, lambda i: Logger.info('key to delete:Uploads/{}', i))
+            start = time.perf_counter()
+            Logger.flush()
+            sys.stderr.write('{:<28} {:>8.2f} s\n'.format('  writer drained after', time.perf_counter() - start))
+            Logger.output_format = 'json'
+            timed('Logger.info json', args.calls, lambda i: Logger.info('key to delete:{}', i, bucket='bucket'))
+            Logger.flush()
+            timed('Logger.debug (disabled)', args.calls, lambda i: Logger.debug('key to delete:{}', i))
+            timed('metrics.observe', args.calls,
+                  lambda i: Logger.metrics.observe('latency_seconds', 0.01, operation='GetObject'))
+        finally:
+            sys.stdout = sys.__stdout__
+
+
+if __name__ == '__main__':
+    main()
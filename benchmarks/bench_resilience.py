@@ -0,0 +1,78 @@
+"""
+ConnectorJIRA extractions against the local Jira search stand-in answering a share of its requests with 429, over a
+plain requests.Session (the connectors before the resilience layer) and over the pooled session, which retries
+them. Then an outage (every request 503): time per failed call while the circuit is closed, and once it is open.
+
+    python -m benchmarks.bench_resilience --issues 5000 --fault-rate 0.05 --latency-ms 20
+"""
+import argparse
+import time
+
+import requests
+from atlassian import Jira
+
+from src.lib.benchmarks.stand_ins import FakeJiraServer
+from src.lib.connectors import resilience
+from src.lib.connectors.connector_jira import ConnectorJIRA
+from src.lib.logs.logger import Logger
+
+
+def extract(connector, page_size, workers):
+    start = time.perf_counter()
+    try:
+        count = sum(1 for _ in connector.iter_issues('project = BENCH ORDER BY key', page_size=page_size,
+                                                     max_workers=workers))
+        error = None
+    except Exception as ex:
+        count, error = 0, type(ex).__name__
+    return count, error, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--issues', type=int, default=5000)
+    parser.add_argument('--latency-ms', type=float, default=20)
+    parser.add_argument('--fault-rate', type=float, default=0.05)
+    parser.add_argument('--page-size', type=int, default=100)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--outage-calls', type=int, default=40)
+    args = parser.parse_args()
+
+    with FakeJiraServer(issues=args.issues, latency=args.latency_ms / 1000.0, max_results_cap=args.page_size,
+                        fault_rate=args.fault_rate, retry_after=0) as server:
+        plain = ConnectorJIRA(endpoint_url=server.url, username='bench', password='bench')
+        plain._client = Jira(url=server.url, username='bench', password='bench', session=requests.Session())
+        resilient = ConnectorJIRA(endpoint_url=server.url, username='bench', password='bench')
+        for label, connector in (('plain session', plain), ('resilience', resilient)):
+            complete = 0
+            for run in range(args.runs):
+                server.requests = server.faults = 0
+                count, error, elapsed = extract(connector, args.page_size, args.workers)
+                complete += count == args.issues
+                print('{:<14} run {} {:>6} issues {:>4} requests {:>3} faults {:>6.2f}s {}'.format(
+                    label, run, count, server.requests, server.faults, elapsed, error or ''))
+            print('{:<14} {}/{} complete extractions'.format(label, complete, args.runs))
+
+    resilience.reset()
+    Logger.set_level('ERROR')
+    with FakeJiraServer(issues=10, fault_rate=1.0, fault_status=503) as server:
+        connector = ConnectorJIRA(endpoint_url=server.url, username='bench', password='bench')
+        timings = {'closed': [], 'open': []}
+        for _ in range(args.outage_calls):
+            state = resilience.for_endpoint('jira', server.url.split('//', 1)[1]).breaker.state
+            start = time.perf_counter()
+            try:
+                connector.count_issues('project = BENCH')
+            except Exception:
+                pass
+            timings['open' if state == 'open' else 'closed'].append(time.perf_counter() - start)
+        for state, values in timings.items():
+            if values:
+                print('outage, circuit {:<6} {:>3} calls {:>9.2f} ms/call'.format(
+                    state, len(values), sum(values) / len(values) * 1000))
+        print('outage requests reaching the server: {}'.format(server.requests))
+
+
+if __name__ == '__main__':
+    main()
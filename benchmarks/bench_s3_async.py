@@ -0,0 +1,72 @@
+"""
+Compare AsyncConnectorS3 with the sync ConnectorS3 (driven by a thread pool) on many small reads and writes,
+against a local moto server standing in for S3.
+
+    python -m benchmarks.bench_s3_async --operations 1000 10000 --concurrency 64
+"""
+import argparse
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from moto.server import ThreadedMotoServer
+
+from src.lib.connectors.connector_aws_s3 import ConnectorS3
+from src.lib.connectors.connector_aws_s3_async import AsyncConnectorS3
+
+BUCKET = 'bench-async'
+
+
+def report(label, operations, elapsed):
+    print('{:<24} {:>7} ops {:>8.2f}s {:>9.0f} ops/s'.format(label, operations, elapsed, operations / elapsed))
+
+
+def run_sync(endpoint, operations, concurrency):
+    connector = ConnectorS3(BUCKET, endpoint_url=endpoint)
+    keys = ['sync/{}'.format(i) for i in range(operations)]
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        start = time.perf_counter()
+        list(executor.map(lambda key: connector.put_object('x' * 100, key), keys))
+        report('sync put_object', operations, time.perf_counter() - start)
+        start = time.perf_counter()
+        list(executor.map(connector.get_object, keys))
+        report('sync get_object', operations, time.perf_counter() - start)
+
+
+async def run_async(endpoint, operations, concurrency):
+    keys = ['async/{}'.format(i) for i in range(operations)]
+    async with AsyncConnectorS3(BUCKET, endpoint_url=endpoint, max_concurrency=concurrency,
+                                max_pool_connections=concurrency) as connector:
+        start = time.perf_counter()
+        await asyncio.gather(*(connector.put_object('x' * 100, key) for key in keys))
+        report('async put_object', operations, time.perf_counter() - start)
+        start = time.perf_counter()
+        await asyncio.gather(*(connector.get_object(key) for key in keys))
+        report('async get_object', operations, time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--operations', type=int, nargs='+', default=[1000, 10000])
+    parser.add_argument('--concurrency', type=int, default=64)
+    parser.add_argument('--port', type=int, default=5055)
+    args = parser.parse_args()
+
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+    server = ThreadedMotoServer(port=args.port, verbose=False)
+    server.start()
+    # 'local' in the endpoint makes both connectors use dummy credentials
+    endpoint = 'http://localhost:{}'.format(args.port)
+    try:
+        ConnectorS3(BUCKET, endpoint_url=endpoint).client.create_bucket(Bucket=BUCKET)
+        for operations in args.operations:
+            print('--- {} operations, concurrency {}'.format(operations, args.concurrency))
+            run_sync(endpoint, operations, args.concurrency)
+            asyncio.run(run_async(endpoint, operations, args.concurrency))
+    finally:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
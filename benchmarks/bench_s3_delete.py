@@ -0,0 +1,67 @@
+"""
+Delete a prefix from the local S3 stand-in, with a fixed per-request latency: the former delete_folder (list every
+key, then one delete_object per key) against delete_keys (the listing streamed into delete_objects batches of 1000
+sent concurrently), and a retention sweep selecting half of the keys by age from the same listing.
+
+    python -m benchmarks.bench_s3_delete --keys 20000 --latency-ms 20 --workers 8
+"""
+import argparse
+import datetime
+import time
+
+from src.lib.benchmarks.stand_ins import StubS3Client
+from src.lib.connectors.connector_aws_s3 import ConnectorS3
+
+BUCKET = 'bench-delete'
+
+
+def populate(client, keys):
+    client.latency, latency = 0, client.latency
+    for i in range(keys):
+        client.put_object(Bucket=BUCKET, Key='logs/{:08d}.gz'.format(i), Body=b'x' * 100)
+    # Every other object is a year old
+    old = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=365)
+    for key in client.keys[::2]:
+        client.objects[key]['LastModified'] = old
+    client.latency = latency
+
+
+def timed(label, client, function, baseline=None):
+    client.calls.clear()
+    start = time.perf_counter()
+    function()
+    elapsed = time.perf_counter() - start
+    speedup = '{:.1f}x'.format(baseline / elapsed) if baseline else ''
+    print('{:<28} {:>8.2f}s {:>7} requests {:>6}'.format(label, elapsed, sum(client.calls.values()), speedup))
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--keys', type=int, default=20000)
+    parser.add_argument('--latency-ms', type=float, default=20)
+    parser.add_argument('--workers', type=int, default=8)
+    args = parser.parse_args()
+
+    client = StubS3Client(latency=args.latency_ms / 1000.0)
+    connector = ConnectorS3(BUCKET)
+    connector.client = client
+
+    def one_by_one():
+        for key in connector.list_objects('logs/'):
+            connector.delete_object(key)
+
+    populate(client, args.keys)
+    baseline = timed('list + delete_object per key', client, one_by_one)
+    populate(client, args.keys)
+    timed('delete_keys batches', client,
+          lambda: connector.delete_keys(connector.iter_objects('logs/', fields=('Key', 'Size')),
+                                        max_workers=args.workers), baseline)
+    populate(client, args.keys)
+    timed('sweep_retention 180 days', client,
+          lambda: connector.sweep_retention('logs/', 180, max_workers=args.workers), baseline)
+    print('{} keys left'.format(len(client.keys)))
+
+
+if __name__ == '__main__':
+    main()
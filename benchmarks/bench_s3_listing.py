@@ -0,0 +1,57 @@
+"""
+Compare the sequential list_objects_v2 paginator (ConnectorS3.iter_objects) with the sharded parallel lister
+(ConnectorS3.iter_objects_parallel) against the local S3 stand-in, with a fixed per-request latency.
+
+    python -m benchmarks.bench_s3_listing --keys 100000 --latency-ms 100 --workers 8
+"""
+import argparse
+import hashlib
+import time
+
+from src.lib.benchmarks.stand_ins import StubS3Client
+from src.lib.connectors.connector_aws_s3 import ConnectorS3
+
+BUCKET = 'bench-listing'
+
+
+def populate(client, prefix, keys, folders):
+    for i in range(keys):
+        name = hashlib.md5(str(i).encode('utf-8')).hexdigest()
+        client.put_object(Bucket=BUCKET, Key='{}folder_{:03d}/{}.csv'.format(prefix, i % folders, name))
+        client.put_object(Bucket=BUCKET, Key='{}flat/{}.csv'.format(prefix, name))
+
+
+def timed(label, records, baseline=None):
+    start = time.perf_counter()
+    count = sum(1 for _ in records)
+    elapsed = time.perf_counter() - start
+    speedup = '{:.1f}x'.format(baseline / elapsed) if baseline else ''
+    print('{:<36} {:>8} keys {:>8.2f}s {:>10.0f} keys/s {:>6}'.format(label, count, elapsed, count / elapsed, speedup))
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--keys', type=int, default=100000)
+    parser.add_argument('--folders', type=int, default=16)
+    parser.add_argument('--latency-ms', type=float, default=100)
+    parser.add_argument('--workers', type=int, default=8)
+    args = parser.parse_args()
+
+    client = StubS3Client()
+    populate(client, 'data/', args.keys, args.folders)
+    client.latency = args.latency_ms / 1000.0
+    connector = ConnectorS3(BUCKET)
+    connector.client = client
+
+    # 'data/folder_*' shards on the delimiter, 'data/flat/' has no sub-prefixes and falls back to the alphabet
+    for prefix in ('data/', 'data/flat/'):
+        sequential = timed('sequential {}'.format(prefix), connector.iter_objects(prefix))
+        for ordered in (False, True):
+            label = 'parallel {} {}'.format(prefix, 'ordered' if ordered else 'unordered')
+            timed(label, connector.iter_objects_parallel(prefix, ordered=ordered, max_workers=args.workers),
+                  sequential)
+
+
+if __name__ == '__main__':
+    main()
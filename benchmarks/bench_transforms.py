@@ -0,0 +1,65 @@
+"""
+Throughput of the pipeline transform stage on a CPU-heavy issue transform (description cleaning and hashing):
+in-process against TransformStage worker pools, for a few chunk sizes. Speed-ups are bounded by the cores of
+the machine, printed first.
+
+    python -m benchmarks.bench_transforms --issues 20000 --workers 0 2 4 --chunk-sizes 50 500
+"""
+import argparse
+import hashlib
+import os
+import re
+import time
+
+from src.lib.benchmarks.stand_ins import make_issue
+from src.lib.pipelines.local_all_jira_issues_to_s3 import issue_to_row
+from src.lib.pipelines.transforms import TransformStage
+
+_MARKUP = re.compile(r'[{}\[\]*_|#]+|h[1-6]\. ')
+_WORDS = re.compile(r'\w+')
+
+
+def clean_issue(issue, rounds=200):
+    """
+    issue_to_row plus description cleaning: markup stripped, words normalised and a fingerprint computed
+    """
+    row = issue_to_row(issue)
+    words = _WORDS.findall(_MARKUP.sub(' ', row['description']).lower())
+    row['description'] = ' '.join(words)
+    digest = row['description'].encode('utf-8')
+    for _ in range(rounds):
+        digest = hashlib.sha256(digest).digest()
+    row['fingerprint'] = digest.hex()
+    return row
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--issues', type=int, default=20000)
+    parser.add_argument('--workers', type=int, nargs='+', default=[0, 2, 4])
+    parser.add_argument('--chunk-sizes', type=int, nargs='+', default=[50, 500])
+    args = parser.parse_args()
+
+    print('{} CPUs'.format(os.cpu_count()))
+    issues = [make_issue(i) for i in range(args.issues)]
+    expected = None
+    for workers in args.workers:
+        for chunk_size in (args.chunk_sizes if workers else args.chunk_sizes[:1]):
+            for ordered in ((True, False) if workers else (True,)):
+                stage = TransformStage(clean_issue, workers=workers, chunk_size=chunk_size, ordered=ordered)
+                start = time.perf_counter()
+                rows = list(stage(issues))
+                elapsed = time.perf_counter() - start
+                keys = [row['key'] for row in rows]
+                if expected is None:
+                    expected = keys
+                in_order = keys == expected
+                assert in_order or not ordered
+                print('{:<12} chunk {:>5} {:<9} {:>7.2f}s {:>9.0f} issues/s {}'.format(
+                    '{} workers'.format(workers) if workers else 'in-process', chunk_size if workers else '-',
+                    'ordered' if ordered else 'unordered', elapsed, len(rows) / elapsed,
+                    'in order' if in_order else 'reordered'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,484 @@
+"""
+Local, offline stand-ins for the services the connectors talk to. They implement just enough of the
+client APIs for the benchmarks and the suite, with a configurable per-request latency that models the network
+round trip, and count the calls they get per API operation.
+The fault injectors make real clients and the fake Jira fail a share of their requests, seeded so runs repeat.
+"""
+import bisect
+import datetime
+import hashlib
+import io
+import random
+import threading
+import time
+
+
+class StubPaginator:
+
+    def __init__(self, method):
+        self.method = method
+
+    def paginate(self, PaginationConfig=None, **kwargs):
+        page_size = (PaginationConfig or {}).get('PageSize')
+        if page_size:
+            kwargs['MaxKeys'] = page_size
+        while True:
+            page = self.method(**kwargs)
+            yield page
+            if not page.get('IsTruncated'):
+                return
+            kwargs['ContinuationToken'] = page['NextContinuationToken']
+
+
+class _StubClient:
+
+    def _call(self, operation):
+        with self._lock:
+            self.calls[operation] = self.calls.get(operation, 0) + 1
+        if self.latency:
+            time.sleep(self.latency)
+
+
+class StubS3Client(_StubClient):
+    """
+    In-memory S3 client for a single process. Keys are kept sorted so listings cost O(page) like the real service
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.objects = {}
+        self.keys = []
+        self.uploads = {}
+        self.calls = {}
+        self._lock = threading.Lock()
+
+    def get_paginator(self, operation_name):
+        return StubPaginator(getattr(self, operation_name))
+
+    def put_object(self, Bucket, Key, Body=b'', Metadata=None, **kwargs):
+        self._call('PutObject')
+        body = Body.encode('utf-8') if isinstance(Body, str) else bytes(Body)
+        return {'ETag': self._store(Key, body, Metadata)}
+
+    def _store(self, key, body, metadata, etag=None):
+        etag = etag or '"{}"'.format(hashlib.md5(body).hexdigest())
+        with self._lock:
+            if key not in self.objects:
+                bisect.insort(self.keys, key)
+            self.objects[key] = {'Body': body, 'Metadata': dict(metadata or {}), 'ETag': etag,
+                                 'LastModified': datetime.datetime.now(datetime.timezone.utc)}
+        return etag
+
+    def _get(self, key, operation):
+        obj = self.objects.get(key)
+        if obj is None:
+            from botocore.exceptions import ClientError
+            raise ClientError({'Error': {'Code': 'NoSuchKey', 'Message': 'The specified key does not exist.'},
+                               'ResponseMetadata': {'HTTPStatusCode': 404}}, operation)
+        return obj
+
+    def get_object(self, Bucket, Key, Range=None, **kwargs):
+        self._call('GetObject')
+        obj = self._get(Key, 'GetObject')
+        body = obj['Body']
+        response = {'ETag': obj['ETag'], 'LastModified': obj['LastModified'], 'Metadata': obj['Metadata']}
+        if Range:
+            start, _, end = Range[len('bytes='):].partition('-')
+            if not start:
+                start, end = len(body) - int(end), ''
+            start, end = int(start), min(int(end) + 1 if end else len(body), len(body))
+            response['ContentRange'] = 'bytes {}-{}/{}'.format(start, end - 1, len(body))
+            body = body[start:end]
+        response.update(Body=_StubBody(body), ContentLength=len(body))
+        return response
+
+    def head_object(self, Bucket, Key, **kwargs):
+        self._call('HeadObject')
+        obj = self._get(Key, 'HeadObject')
+        return {'ContentLength': len(obj['Body']), 'ETag': obj['ETag'], 'LastModified': obj['LastModified'],
+                'Metadata': obj['Metadata']}
+
+    def copy_object(self, CopySource, Bucket, Key, **kwargs):
+        self._call('CopyObject')
+        obj = self._get(CopySource['Key'], 'CopyObject')
+        return {'CopyObjectResult': {'ETag': self._store(Key, obj['Body'], obj['Metadata'], obj['ETag'])}}
+
+    def create_multipart_upload(self, Bucket, Key, Metadata=None, **kwargs):
+        self._call('CreateMultipartUpload')
+        upload_id = hashlib.md5('{}{}'.format(Key, time.perf_counter()).encode('utf-8')).hexdigest()
+        with self._lock:
+            self.uploads[upload_id] = (Key, Metadata, {})
+        return {'UploadId': upload_id}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body, **kwargs):
+        self._call('UploadPart')
+        body = bytes(Body)
+        self.uploads[UploadId][2][PartNumber] = body
+        return {'ETag': '"{}"'.format(hashlib.md5(body).hexdigest())}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload, **kwargs):
+        self._call('CompleteMultipartUpload')
+        with self._lock:
+            key, metadata, parts = self.uploads.pop(UploadId)
+        numbers = [part['PartNumber'] for part in MultipartUpload['Parts']]
+        digests = b''.join(hashlib.md5(parts[number]).digest() for number in numbers)
+        etag = '"{}-{}"'.format(hashlib.md5(digests).hexdigest(), len(numbers))
+        return {'ETag': self._store(key, b''.join(parts[number] for number in numbers), metadata, etag)}
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId, **kwargs):
+        self._call('AbortMultipartUpload')
+        with self._lock:
+            self.uploads.pop(UploadId, None)
+        return {}
+
+    def delete_object(self, Bucket, Key, **kwargs):
+        self._call('DeleteObject')
+        with self._lock:
+            self._remove(Key)
+        return {}
+
+    def delete_objects(self, Bucket, Delete, **kwargs):
+        self._call('DeleteObjects')
+        with self._lock:
+            for obj in Delete['Objects']:
+                self._remove(obj['Key'])
+        return {} if Delete.get('Quiet') else {'Deleted': [{'Key': obj['Key']} for obj in Delete['Objects']]}
+
+    def _remove(self, key):
+        if self.objects.pop(key, None) is not None:
+            del self.keys[bisect.bisect_left(self.keys, key)]
+
+    def list_objects_v2(self, Bucket, Prefix='', Delimiter=None, StartAfter=None, ContinuationToken=None,
+                        MaxKeys=1000, **kwargs):
+        self._call('ListObjectsV2')
+        start = ContinuationToken or StartAfter or ''
+        with self._lock:
+            index = bisect.bisect_right(self.keys, start) if start else bisect.bisect_left(self.keys, Prefix)
+            contents, prefixes = [], []
+            while index < len(self.keys) and len(contents) + len(prefixes) < MaxKeys:
+                key = self.keys[index]
+                if not key.startswith(Prefix):
+                    break
+                cut = key.find(Delimiter, len(Prefix)) if Delimiter else -1
+                if cut >= 0:
+                    common = key[:cut + len(Delimiter)]
+                    prefixes.append({'Prefix': common})
+                    # Skip every key rolled up into this common prefix
+                    index = bisect.bisect_left(self.keys, common[:-1] + chr(ord(common[-1]) + 1))
+                    continue
+                obj = self.objects[key]
+                contents.append({'Key': key, 'Size': len(obj['Body']), 'ETag': obj['ETag'],
+                                 'LastModified': obj['LastModified'], 'StorageClass': 'STANDARD'})
+                index += 1
+            truncated = index < len(self.keys) and self.keys[index].startswith(Prefix)
+        page = {'IsTruncated': truncated, 'KeyCount': len(contents) + len(prefixes)}
+        if contents:
+            page['Contents'] = contents
+        if prefixes:
+            page['CommonPrefixes'] = prefixes
+        if truncated:
+            page['NextContinuationToken'] = self.keys[index - 1]
+        return page
+
+
+class _StubBody(io.BytesIO):
+    """
+    The parts of botocore's StreamingBody the connectors use
+    """
+
+    def iter_chunks(self, chunk_size=1024):
+        return iter(lambda: self.read(chunk_size), b'')
+
+
+class StubAthenaClient(_StubClient):
+    """
+    In-memory Athena client: every query runs for query_seconds, then succeeds with rows generated rows of
+    (id bigint, name varchar, updated timestamp), served in get_query_results pages of 1000 like the real service
+    """
+
+    def __init__(self, latency=0.0, query_seconds=1.0, rows=1000, output_location='s3://bench-athena/results'):
+        self.latency = latency
+        self.query_seconds = query_seconds
+        self.rows = rows
+        self.output_location = output_location
+        self.queries = {}
+        self.calls = {}
+        self._lock = threading.Lock()
+
+    def start_query_execution(self, QueryString, **kwargs):
+        self._call('StartQueryExecution')
+        with self._lock:
+            query_execution_id = 'query-{:08d}'.format(len(self.queries))
+            self.queries[query_execution_id] = {'query': QueryString, 'started_at': time.monotonic(),
+                                                'state': None}
+        return {'QueryExecutionId': query_execution_id}
+
+    def _execution(self, query_execution_id):
+        query = self.queries[query_execution_id]
+        state = query['state'] or ('SUCCEEDED' if time.monotonic() - query['started_at'] >= self.query_seconds
+                                   else 'RUNNING')
+        return {'QueryExecutionId': query_execution_id, 'Query': query['query'], 'Status': {'State': state},
+                'ResultConfiguration': {'OutputLocation': '{}/{}.csv'.format(self.output_location,
+                                                                             query_execution_id)}}
+
+    def get_query_execution(self, QueryExecutionId):
+        self._call('GetQueryExecution')
+        return {'QueryExecution': self._execution(QueryExecutionId)}
+
+    def batch_get_query_execution(self, QueryExecutionIds):
+        self._call('BatchGetQueryExecution')
+        return {'QueryExecutions': [self._execution(i) for i in QueryExecutionIds]}
+
+    def stop_query_execution(self, QueryExecutionId):
+        self._call('StopQueryExecution')
+        self.queries[QueryExecutionId]['state'] = 'CANCELLED'
+        return {}
+
+    def get_paginator(self, operation_name):
+        return _AthenaResultsPaginator(self)
+
+    def get_query_results(self, QueryExecutionId, NextToken=None, MaxResults=1000):
+        self._call('GetQueryResults')
+        start = int(NextToken or 0)
+        # The header row counts as the first row of the first page
+        rows = [['id', 'name', 'updated']] if start == 0 else []
+        end = min(self.rows, start + MaxResults - len(rows))
+        rows += [[str(i), 'name {}'.format(i), '2020-01-01 00:00:{:02d}.000'.format(i % 60)] for i in range(start, end)]
+        page = {'ResultSet': {'Rows': [{'Data': [{'VarCharValue': value} for value in row]} for row in rows],
+                              'ResultSetMetadata': {'ColumnInfo': [{'Name': 'id', 'Type': 'bigint'},
+                                                                   {'Name': 'name', 'Type': 'varchar'},
+                                                                   {'Name': 'updated', 'Type': 'timestamp'}]}}}
+        if end < self.rows:
+            page['NextToken'] = str(end)
+        return page
+
+
+class _AthenaResultsPaginator:
+
+    def __init__(self, client):
+        self.client = client
+
+    def paginate(self, QueryExecutionId):
+        token = None
+        while True:
+            page = self.client.get_query_results(QueryExecutionId=QueryExecutionId, NextToken=token)
+            yield page
+            token = page.get('NextToken')
+            if token is None:
+                return
+
+
+class AWSFaultInjector:
+    """
+    Fails a share of the HTTP requests of botocore clients before they leave the process: throttling (S3 SlowDown
+    503 or a ThrottlingException), service unavailable (500 InternalError) or a dropped connection. The clients
+    see the same responses and errors as from the real service, retries and rate limiting included.
+
+        faults = AWSFaultInjector(rate=0.2).attach(conn_s3.client)
+    """
+
+    KINDS = ('throttle', 'unavailable', 'connection')
+
+    def __init__(self, rate=0.1, kind='throttle', seed=0, operations=None):
+        """
+        :param rate: Number: Share of the requests failing, from 0 to 1
+        :param kind: String: One of KINDS
+        :param operations: Set of Strings: Only fail these operations (e.g. {'GetObject'}), all if None
+        """
+        if kind not in self.KINDS:
+            raise ValueError('Unknown fault kind {}, use one of {}'.format(kind, self.KINDS))
+        self.rate = rate
+        self.kind = kind
+        self.operations = operations
+        self.requests = 0
+        self.faults = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def attach(self, client):
+        """
+        :param client: A botocore or aiobotocore client
+        :return: The injector
+        """
+        from botocore.awsrequest import AWSResponse
+        protocol = client.meta.service_model.protocol
+        response_class = AWSResponse
+        if type(client).__module__.startswith('aiobotocore'):
+            from aiobotocore.awsrequest import AioAWSResponse as response_class
+
+        def before_send(request, event_name, **kwargs):
+            # event_name is before-send.<service>.<operation>
+            return self._fault(request, protocol, event_name.rsplit('.', 1)[-1], response_class)
+
+        # First, so the fault wins over any other handler answering in place of the network (e.g. moto)
+        client.meta.events.register_first('before-send', before_send,
+                                          unique_id='fault-injector-{}'.format(id(self)))
+        return self
+
+    def _fault(self, request, protocol, operation, response_class):
+        if self.operations is not None and operation not in self.operations:
+            return None
+        with self._lock:
+            self.requests += 1
+            if self._random.random() >= self.rate:
+                return None
+            self.faults += 1
+        from botocore.exceptions import ConnectionClosedError
+        if self.kind == 'connection':
+            raise ConnectionClosedError(endpoint_url=request.url)
+        status, code = (503, 'SlowDown') if self.kind == 'throttle' else (500, 'InternalError')
+        if protocol in ('json', 'rest-json'):
+            status = 400 if self.kind == 'throttle' else 500
+            code = 'ThrottlingException' if self.kind == 'throttle' else 'InternalServerException'
+            body = '{{"__type": "{}", "message": "Injected fault"}}'.format(code).encode('utf-8')
+            headers = {'Content-Type': 'application/x-amz-json-1.1', 'x-amzn-ErrorType': code}
+        else:
+            body = '<Error><Code>{}</Code><Message>Injected fault</Message></Error>'.format(code).encode('utf-8')
+            headers = {'Content-Type': 'application/xml'}
+        return response_class(request.url, status, headers, _Raw(body))
+
+
+class _Raw:
+
+    def __init__(self, body):
+        self.body = body
+
+    def stream(self, **kwargs):
+        yield self.body
+
+    async def read(self):
+        return self.body
+
+
+class FakeJiraServer:
+    """
+    Local HTTP stand-in for the Jira search endpoint (/rest/api/2/search), serving generated issues with
+    startAt/maxResults paging, field projection, a server-side maxResults cap and a per-request latency.
+    fault_rate makes a share of the requests answer fault_status instead (429 with a Retry-After, 503...).
+    Runs on a background thread, use it as a context manager and point ConnectorJIRA at .url
+    """
+
+    def __init__(self, issues=1000, latency=0.0, max_results_cap=100, port=0, issue_factory=None, fault_rate=0.0,
+                 fault_status=429, retry_after=None, seed=0):
+        self.issues = [(issue_factory or make_issue)(i) for i in range(issues)]
+        self.latency = latency
+        self.max_results_cap = max_results_cap
+        self.fault_rate = fault_rate
+        self.fault_status = fault_status
+        self.retry_after = retry_after
+        self.requests = 0
+        self.faults = 0
+        self._random = random.Random(seed)
+        self.port = port
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self):
+        return 'http://localhost:{}'.format(self._server.server_address[1])
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+    def start(self):
+        from http.server import ThreadingHTTPServer
+        self._server = ThreadingHTTPServer(('localhost', self.port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def search(self, jql, start_at, max_results, fields):
+        issues = self.filter(jql)
+        if max_results is None or max_results > self.max_results_cap:
+            max_results = self.max_results_cap
+        page = issues[start_at:start_at + max_results]
+        if fields and fields != ['*all']:
+            page = [dict(issue, fields={name: issue['fields'].get(name) for name in fields}) for issue in page]
+        return {'startAt': start_at, 'maxResults': max_results, 'total': len(issues), 'issues': page}
+
+    def filter(self, jql):
+        """
+        The issues matching the few JQL clauses the connectors generate: `updated >= "yyyy/MM/dd HH:mm"`,
+        `key in (...)` and `ORDER BY updated`; anything else matches every issue, in creation order
+        """
+        import re
+        issues = self.issues
+        since = re.search(r'updated >= "([^"]+)"', jql)
+        if since:
+            since = datetime.datetime.strptime(since.group(1), '%Y/%m/%d %H:%M')
+            issues = [i for i in issues if datetime.datetime.strptime(i['fields']['updated'][:16], '%Y-%m-%dT%H:%M')
+                      >= since]
+        keys = re.search(r'key in \(([^)]*)\)', jql)
+        if keys:
+            keys = {key.strip() for key in keys.group(1).split(',')}
+            issues = [i for i in issues if i['key'] in keys]
+        if 'ORDER BY updated' in jql:
+            issues = sorted(issues, key=lambda i: (i['fields']['updated'], int(i['key'].split('-')[1])))
+        return issues
+
+    def _handler(self):
+        import json
+        from http.server import BaseHTTPRequestHandler
+        from urllib.parse import urlparse, parse_qs
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                if not url.path.endswith('/search'):
+                    self.send_error(404)
+                    return
+                query = parse_qs(url.query)
+                with fake._lock:
+                    fake.requests += 1
+                    fault = fake.fault_rate and fake._random.random() < fake.fault_rate
+                    if fault:
+                        fake.faults += 1
+                if fake.latency:
+                    time.sleep(fake.latency)
+                if fault:
+                    body = json.dumps({'errorMessages': ['Injected fault']}).encode('utf-8')
+                    self.send_response(fake.fault_status)
+                    if fake.retry_after is not None:
+                        self.send_header('Retry-After', str(fake.retry_after))
+                    self.send_header('Content-Type', 'application/json')
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                    return
+                body = json.dumps(fake.search(query.get('jql', [''])[0],
+                                              int(query.get('startAt', ['0'])[0]),
+                                              int(query['maxResults'][0]) if 'maxResults' in query else None,
+                                              query.get('fields', ['*all'])[0].split(','))).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+def make_issue(i):
+    updated = datetime.datetime(2020, 1, 1) + datetime.timedelta(minutes=7 * i)
+    return {'id': str(10000 + i), 'key': 'TEST-{}'.format(i + 1),
+            'self': 'http://jira.local/rest/api/2/issue/{}'.format(10000 + i),
+            'fields': {'summary': 'Issue {}'.format(i), 'description': 'Description of issue {} '.format(i) * 20,
+                       'status': {'name': ('To Do', 'In Progress', 'Done')[i % 3]},
+                       'updated': updated.strftime('%Y-%m-%dT%H:%M:%S.000+0000'),
+                       'priority': {'name': 'Medium'}, 'labels': ['label-{}'.format(i % 7)],
+                       'comment': {'comments': [{'body': 'Comment {}'.format(c) * 10} for c in range(5)]}}}
@@ -0,0 +1,393 @@
+"""
+Offline benchmark suite of the connectors and the pipeline. Every scenario runs in a fresh child process against
+the local stand-ins (S3 and Athena clients in memory, Jira over local HTTP) with a configurable latency and data
+volume, and reports its throughput, the latency percentiles of its operations, its peak RSS and the API calls it
+made. The results are written as JSON; with --baseline they are compared with an earlier results file, and any
+metric worse by more than --tolerance is flagged as a regression.
+
+    python -m src.lib.benchmarks.suite --output before.json
+    python -m src.lib.benchmarks.suite --baseline before.json --output after.json --fail-on-regression
+    python -m src.lib.benchmarks.suite --scenarios s3_get jira_extract --s3-latency-ms 10
+"""
+import argparse
+import contextlib
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+from src.lib.benchmarks.bench_jira_pipeline import peak_rss_kb
+
+SCENARIOS = {}
+BUCKET = 'bench-suite'
+# Higher is better for throughput, lower for everything else
+COMPARED_METRICS = (('throughput', 1), ('latency_ms.p50', -1), ('latency_ms.p99', -1), ('peak_rss_mb', -1),
+                    ('api_calls_total', -1))
+
+
+def scenario(unit):
+    """
+    Register a scenario: a function (params, recorder) -> Dict with 'operations' and optionally 'bytes' and
+    'api_calls', timing its measured part with recorder.measure() or recorder.call()
+    :param unit: String: What the operations count (keys, objects, rows...)
+    """
+    def register(function):
+        SCENARIOS[function.__name__] = (function, unit)
+        return function
+    return register
+
+
+class Recorder:
+    """
+    Wall time of the measured part of a scenario, and the latency of its individual operations
+    """
+
+    def __init__(self):
+        self.seconds = 0.0
+        self.latencies = []
+
+    @contextlib.contextmanager
+    def measure(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds += time.perf_counter() - start
+
+    def call(self, function, *args, **kwargs):
+        """
+        Call function as one measured operation
+        """
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.seconds += elapsed
+            self.latencies.append(elapsed)
+
+
+def percentiles(values):
+    """
+    :param values: List of Numbers: Latencies in seconds
+    :return: Dict: count, mean, p50, p90, p99 and max in milliseconds (nearest rank), None without values
+    """
+    if not values:
+        return None
+    values = sorted(values)
+
+    def rank(quantile):
+        return values[min(len(values) - 1, max(0, int(round(quantile * len(values))) - 1))] * 1000
+
+    return {'count': len(values), 'mean': sum(values) / len(values) * 1000, 'p50': rank(0.5), 'p90': rank(0.9),
+            'p99': rank(0.99), 'max': values[-1] * 1000}
+
+
+def s3_stand_in(params, keys=0, folders=1, size=0):
+    from src.lib.benchmarks.stand_ins import StubS3Client
+    from src.lib.connectors.connector_aws_s3 import ConnectorS3
+
+    client = StubS3Client()
+    body = b'x' * size
+    for i in range(keys):
+        client.put_object(Bucket=BUCKET, Key='data/folder_{:03d}/{:08d}.csv'.format(i % folders, i), Body=body)
+    client.calls.clear()
+    client.latency = params['s3_latency_ms'] / 1000.0
+    return client, ConnectorS3(BUCKET, client=client)
+
+
+@scenario('keys')
+def s3_list(params, recorder):
+    client, connector = s3_stand_in(params, params['keys'])
+    with recorder.measure():
+        count = sum(1 for _ in connector.iter_objects('data/'))
+    return {'operations': count, 'api_calls': client.calls}
+
+
+@scenario('keys')
+def s3_list_parallel(params, recorder):
+    client, connector = s3_stand_in(params, params['keys'], folders=16)
+    with recorder.measure():
+        count = sum(1 for _ in connector.iter_objects_parallel('data/', max_workers=params['workers']))
+    return {'operations': count, 'api_calls': client.calls}
+
+
+@scenario('objects')
+def s3_put(params, recorder):
+    client, connector = s3_stand_in(params)
+    body = os.urandom(params['object_kb'] * 1024)
+    for i in range(params['objects']):
+        recorder.call(connector.put_object, body, 'put/{:08d}.bin'.format(i))
+    return {'operations': params['objects'], 'bytes': len(body) * params['objects'], 'api_calls': client.calls}
+
+
+@scenario('objects')
+def s3_get(params, recorder):
+    client, connector = s3_stand_in(params, params['objects'], size=params['object_kb'] * 1024)
+    total = 0
+    for key in list(client.keys):
+        total += len(recorder.call(connector.get_object, key))
+    return {'operations': params['objects'], 'bytes': total, 'api_calls': client.calls}
+
+
+@scenario('MB')
+def s3_put_stream(params, recorder):
+    client, connector = s3_stand_in(params)
+    chunk = os.urandom(1024 ** 2)
+    recorder.call(connector.put_object_stream, (chunk for _ in range(params['stream_mb'])), 'stream/object.bin')
+    return {'operations': params['stream_mb'], 'bytes': params['stream_mb'] * len(chunk), 'api_calls': client.calls}
+
+
+@scenario('objects')
+def s3_copy(params, recorder):
+    client, connector = s3_stand_in(params, params['objects'], size=params['object_kb'] * 1024)
+    pairs = [(key, 'copy/' + key) for key in list(client.keys)]
+    with recorder.measure():
+        report = connector.copy_objects(pairs, max_workers=params['workers'])
+    return {'operations': len(report['copied']), 'api_calls': client.calls}
+
+
+@scenario('keys')
+def s3_delete(params, recorder):
+    client, connector = s3_stand_in(params, params['keys'], size=100)
+    with recorder.measure():
+        report = connector.delete_keys(connector.iter_objects('data/', fields=('Key', 'Size')),
+                                       max_workers=params['workers'])
+    return {'operations': report['deleted'], 'bytes': report['bytes_freed'], 'api_calls': client.calls}
+
+
+@scenario('rows')
+def s3_select(params, recorder):
+    # The stand-in has no S3 Select: this measures the local filter select_rows falls back to
+    client, connector = s3_stand_in(params)
+    lines = ['id,key,status,summary'] + ['{0},TEST-{0},{1},Issue {0}'.format(i, ('Done', 'Open')[i % 2])
+                                         for i in range(params['file_rows'])]
+    body = '\n'.join(lines).encode('utf-8')
+    client.put_object(Bucket=BUCKET, Key='select/issues.csv', Body=body)
+    client.calls.clear()
+    with recorder.measure():
+        matching = sum(1 for _ in connector.select_rows('select/issues.csv', columns=['key'],
+                                                        where=[('status', '=', 'Open'), ('id', '>=', 0)]))
+    return {'operations': params['file_rows'], 'bytes': len(body), 'matching': matching, 'api_calls': client.calls}
+
+
+def athena_stand_in(params):
+    from src.lib.benchmarks.stand_ins import StubAthenaClient
+    from src.lib.connectors.connector_aws_athenas import ConnectorAthenas
+
+    client = StubAthenaClient(latency=params['athena_latency_ms'] / 1000.0, query_seconds=params['query_seconds'],
+                              rows=params['result_rows'])
+    return client, ConnectorAthenas(client=client)
+
+
+@scenario('queries')
+def athena_poll(params, recorder):
+    client, connector = athena_stand_in(params)
+    queries = ['SELECT {} FROM issues'.format(i) for i in range(params['queries'])]
+    with recorder.measure():
+        outcomes = list(connector.run_queries(queries, 'bench', 's3://bench-athena/results', timeout=600))
+    return {'operations': sum(outcome.state == 'SUCCEEDED' for outcome in outcomes), 'api_calls': client.calls}
+
+
+@scenario('rows')
+def athena_results(params, recorder):
+    client, connector = athena_stand_in(params)
+    client.query_seconds = 0
+    with recorder.measure():
+        query_execution_id = connector.execute_query('SELECT * FROM issues', 'bench', 's3://bench-athena/results')
+        count = sum(1 for _ in connector.iter_query_results(query_execution_id))
+    return {'operations': count, 'api_calls': client.calls}
+
+
+@scenario('issues')
+def jira_extract(params, recorder):
+    from src.lib.benchmarks.stand_ins import FakeJiraServer
+    from src.lib.connectors.connector_jira import ConnectorJIRA
+
+    with FakeJiraServer(issues=params['issues'], latency=params['jira_latency_ms'] / 1000.0) as server:
+        connector = ConnectorJIRA(endpoint_url=server.url, username='bench', password='bench')
+        with recorder.measure():
+            count = sum(1 for _ in connector.iter_issues('project = BENCH ORDER BY key'))
+        return {'operations': count, 'api_calls': {'search': server.requests}}
+
+
+@scenario('rows')
+def file_csv(params, recorder):
+    from src.lib.connectors.connector_file import ConnectorFile
+
+    rows = [{'id': i, 'key': 'TEST-{}'.format(i), 'summary': 'Issue {}'.format(i), 'status': 'Done'}
+            for i in range(params['file_rows'])]
+    with tempfile.TemporaryDirectory() as directory:
+        connector = ConnectorFile(working_dir=directory)
+        recorder.call(connector.save_dict_to_csvfile, rows, 'issues.csv', fieldnames=list(rows[0]))
+        count = recorder.call(lambda: sum(1 for _ in connector.read_csv('issues.csv').iter_dicts()))
+        size = os.path.getsize(os.path.join(directory, 'issues.csv'))
+    return {'operations': len(rows) + count, 'bytes': size * 2}
+
+
+@scenario('issues')
+def pipeline(params, recorder):
+    from src.lib.benchmarks.stand_ins import FakeJiraServer, StubS3Client
+    from src.lib.connectors import client_pool
+    from src.lib.pipelines import local_all_jira_issues_to_s3
+    from src.lib.connectors.settings import override, setting
+    from src.lib.pipelines.runner import LocalCheckpoints
+
+    client = StubS3Client(latency=params['s3_latency_ms'] / 1000.0)
+    # Every ConnectorS3 of the pipeline gets the stand-in from the pool
+    client_pool.set_client('s3', client, endpoint_url=setting('S3_ENDPOINT'))
+    with FakeJiraServer(issues=params['issues'], latency=params['jira_latency_ms'] / 1000.0) as server, \
+            tempfile.TemporaryDirectory() as directory:
+        with override(JIRA_ENDPOINT=server.url), recorder.measure():
+            local_all_jira_issues_to_s3.run_all_issues_to_s3(checkpoints=LocalCheckpoints(directory),
+                                                             run_id='bench')
+        api_calls = dict(client.calls, search=server.requests)
+    return {'operations': params['issues'], 'bytes': sum(len(obj['Body']) for obj in client.objects.values()),
+            'api_calls': api_calls}
+
+
+def child(name, params):
+    from src.lib.logs.logger import Logger
+
+    Logger.set_level('WARNING')
+    function, unit = SCENARIOS[name]
+    recorder = Recorder()
+    baseline_kb = peak_rss_kb()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        result = function(params, recorder)
+        Logger.flush()
+    peak_kb = peak_rss_kb()
+    api_calls = result.get('api_calls') or {}
+    result.update(unit=unit, seconds=recorder.seconds,
+                  throughput=result['operations'] / recorder.seconds if recorder.seconds else None,
+                  mb_per_s=result['bytes'] / 1024 ** 2 / recorder.seconds if result.get('bytes') and recorder.seconds
+                  else None,
+                  latency_ms=percentiles(recorder.latencies), peak_rss_mb=peak_kb / 1024.0,
+                  rss_over_imports_mb=(peak_kb - baseline_kb) / 1024.0, api_calls=api_calls,
+                  api_calls_total=sum(api_calls.values()))
+    sys.stderr.write(json.dumps(result) + '\n')
+
+
+def run_scenario(name, params):
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(map(os.path.abspath, sys.path)))
+    # The child runs this module under the package path it was started with, the one its imports resolve against
+    module = __spec__.name if __spec__ is not None else 'src.lib.benchmarks.suite'
+    result = subprocess.run([sys.executable, '-m', module, '--child', name, json.dumps(params)], env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    if result.returncode:
+        raise RuntimeError('Scenario {} failed:\n{}'.format(name, result.stderr))
+    return json.loads(result.stderr.strip().splitlines()[-1])
+
+
+def metric(result, path):
+    for name in path.split('.'):
+        result = (result or {}).get(name)
+    return result
+
+
+def compare(results, baseline, tolerance):
+    """
+    :return: List of Strings: The regressions, 'scenario metric: baseline -> value (change)'
+    """
+    regressions = []
+    for name, result in results.items():
+        previous = baseline.get(name)
+        if previous is None:
+            continue
+        for path, direction in COMPARED_METRICS:
+            value, before = metric(result, path), metric(previous, path)
+            if not value or not before:
+                continue
+            change = (value - before) / before
+            if change * direction < -tolerance:
+                regressions.append('{} {}: {:.4g} -> {:.4g} ({:+.0%})'.format(name, path, before, value, change))
+    return regressions
+
+
+def print_results(results, baseline):
+    print('{:<18} {:>14} {:>10} {:>9} {:>9} {:>9} {:>8} {:>10}'.format(
+        'scenario', 'throughput/s', 'unit', 'p50 ms', 'p99 ms', 'RSS MB', 'calls', 'vs base'))
+    for name, result in results.items():
+        latency = result['latency_ms'] or {}
+        previous = baseline.get(name, {}).get('throughput')
+        change = '{:+.0%}'.format(result['throughput'] / previous - 1) if previous and result['throughput'] else ''
+        print('{:<18} {:>14.1f} {:>10} {:>9} {:>9} {:>9.1f} {:>8} {:>10}'.format(
+            name, result['throughput'] or 0, result['unit'],
+            '{:.2f}'.format(latency['p50']) if latency else '-', '{:.2f}'.format(latency['p99']) if latency else '-',
+            result['peak_rss_mb'], result['api_calls_total'], change))
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                              stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--scenarios', nargs='+', choices=sorted(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument('--output', default='benchmark-results-{}.json'.format(
+        datetime.datetime.now().strftime('%Y%m%dT%H%M%S')))
+    parser.add_argument('--baseline', help='Results file of an earlier run to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='Relative change reported as a regression')
+    parser.add_argument('--fail-on-regression', action='store_true')
+    parser.add_argument('--repeat', type=int, default=1, help='Runs per scenario, the median one is kept')
+    parser.add_argument('--s3-latency-ms', type=float, default=2)
+    parser.add_argument('--athena-latency-ms', type=float, default=2)
+    parser.add_argument('--jira-latency-ms', type=float, default=5)
+    parser.add_argument('--keys', type=int, default=20000)
+    parser.add_argument('--objects', type=int, default=500)
+    parser.add_argument('--object-kb', type=int, default=64)
+    parser.add_argument('--stream-mb', type=int, default=64)
+    parser.add_argument('--queries', type=int, default=20)
+    parser.add_argument('--query-seconds', type=float, default=0.5)
+    parser.add_argument('--result-rows', type=int, default=20000)
+    parser.add_argument('--issues', type=int, default=5000)
+    parser.add_argument('--file-rows', type=int, default=100000)
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--child', nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(args.child[0], json.loads(args.child[1]))
+        return
+
+    params = {name: value for name, value in vars(args).items()
+              if name not in ('scenarios', 'output', 'baseline', 'tolerance', 'fail_on_regression', 'repeat',
+                              'child')}
+    results = {}
+    for name in args.scenarios:
+        runs = sorted((run_scenario(name, params) for _ in range(args.repeat)), key=lambda run: run['seconds'])
+        results[name] = runs[len(runs) // 2]
+        sys.stderr.write('{} done in {:.2f}s\n'.format(name, results[name]['seconds']))
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as fp:
+            previous = json.load(fp)
+        baseline = previous['scenarios']
+        changed = sorted(name for name in params if previous['params'].get(name) != params[name])
+        if changed:
+            print('WARNING the baseline ran with other parameters: {}'.format(', '.join(changed)))
+    document = {'created_at': datetime.datetime.now(datetime.timezone.utc).isoformat(), 'git_commit': git_commit(),
+                'python': platform.python_version(), 'platform': platform.platform(), 'cpu_count': os.cpu_count(),
+                'params': params, 'scenarios': results}
+    with open(args.output, 'w') as fp:
+        json.dump(document, fp, indent=2, sort_keys=True)
+
+    print_results(results, baseline)
+    print('Results written to {}'.format(args.output))
+    regressions = compare(results, baseline, args.tolerance)
+    for regression in regressions:
+        print('REGRESSION {}'.format(regression))
+    if regressions and args.fail_on_regression:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
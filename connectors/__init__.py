@@ -0,0 +1,42 @@
+"""
+Connectors to S3, Athena, Jira and local files. The package API is loaded lazily: importing the package, or a
+connector from it, only imports the module of that connector, and the SDKs (boto3, aiobotocore, atlassian,
+requests, pyarrow) are imported by the connectors when they first need them.
+
+    from src.lib.connectors import ConnectorS3
+"""
+import importlib
+
+# Public name -> module of the package defining it
+_EXPORTS = {
+    'ConnectorS3': 'connector_aws_s3',
+    'AsyncConnectorS3': 'connector_aws_s3_async',
+    'ConnectorAthenas': 'connector_aws_athenas',
+    'AthenaResultCache': 'connector_aws_athenas',
+    'AthenaQueryError': 'connector_aws_athenas',
+    'ConnectorJIRA': 'connector_jira',
+    'ConnectorFile': 'connector_file',
+    'CsvReader': 'csv_reader',
+    'S3MetadataCache': 's3_metadata_cache',
+    'SelectQuery': 's3_select',
+    'TransferMetrics': 's3_transfer',
+    'CircuitOpenError': 'resilience',
+    'setting': 'settings',
+    'override': 'settings',
+}
+
+__all__ = sorted(_EXPORTS)
+
+
+def __getattr__(name):
+    module = _EXPORTS.get(name)
+    if module is None:
+        raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+    value = getattr(importlib.import_module('.' + module, __name__), name)
+    # Cached on the package, later lookups do not come back here
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
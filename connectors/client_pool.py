@@ -0,0 +1,214 @@
+import os
+import re
+import threading
+import time
+from urllib.parse import urlsplit
+
+from src.lib.connectors import resilience
+from src.lib.connectors.settings import setting
+from src.lib.logs.logger import Logger
+
+# Retries are done by the endpoint's Resilience, botocore makes a single attempt
+NO_BOTOCORE_RETRIES = {'mode': 'standard', 'total_max_attempts': 1}
+
+_lock = threading.RLock()
+_session = None
+_clients = {}
+_http_sessions = {}
+_local = threading.local()
+
+
+def get_client(service, region_name=None, endpoint_url=None, aws_access_key_id=None, aws_secret_access_key=None,
+               aws_session_token=None, max_pool_connections=None):
+    """
+    Process-wide boto3 client for (service, region, endpoint, credentials), created on first use and shared by
+    every connector asking for the same key. boto3 clients are thread-safe, so one client and its connection pool
+    serve all threads. Calls go through the Resilience of the service endpoint: rate limited, retried when
+    throttled or transient, failing fast while the endpoint is down (see resilience)
+    :param max_pool_connections: Integer: Connection pool size, at least AWS_MAX_POOL_CONNECTIONS. Only the first
+        call for a key sizes the pool
+    :return: A boto3 client
+    """
+    key = ('client', service, region_name, endpoint_url, aws_access_key_id, aws_secret_access_key, aws_session_token)
+    with _lock:
+        _check_pid()
+        client = _clients.get(key)
+        if client is None:
+            config = _client_config(max(max_pool_connections or 0, setting('AWS_MAX_POOL_CONNECTIONS')))
+            client = _get_session().client(service, region_name=region_name, endpoint_url=endpoint_url,
+                                           aws_access_key_id=aws_access_key_id,
+                                           aws_secret_access_key=aws_secret_access_key,
+                                           aws_session_token=aws_session_token, config=config)
+            instrument_client(client)
+            resilience.for_endpoint(service, client.meta.endpoint_url).attach(client)
+            _clients[key] = client
+        return client
+
+
+def set_client(service, client, region_name=None, endpoint_url=None, aws_access_key_id=None,
+               aws_secret_access_key=None, aws_session_token=None):
+    """
+    Pool a ready-made client under the key get_client would create it for, so every connector asking for that key
+    gets it: a local stand-in for benchmarks, a stubbed client for tests. It is used as is, not instrumented
+    :return: The client
+    """
+    key = ('client', service, region_name, endpoint_url, aws_access_key_id, aws_secret_access_key, aws_session_token)
+    with _lock:
+        _check_pid()
+        _clients[key] = client
+    return client
+
+
+def get_resource(service, region_name=None, endpoint_url=None, aws_access_key_id=None, aws_secret_access_key=None,
+                 aws_session_token=None):
+    """
+    boto3 resource for (service, region, endpoint, credentials). Resources are not thread-safe, so one is kept per
+    thread, created on first use
+    :return: A boto3 resource
+    """
+    key = ('resource', service, region_name, endpoint_url, aws_access_key_id, aws_secret_access_key,
+           aws_session_token)
+    with _lock:
+        _check_pid()
+        resources = getattr(_local, 'resources', None)
+        if resources is None:
+            resources = _local.resources = {}
+        resource = resources.get(key)
+        if resource is None:
+            resource = _get_session().resource(service, region_name=region_name, endpoint_url=endpoint_url,
+                                               aws_access_key_id=aws_access_key_id,
+                                               aws_secret_access_key=aws_secret_access_key,
+                                               aws_session_token=aws_session_token,
+                                               config=_client_config(setting('AWS_MAX_POOL_CONNECTIONS')))
+            instrument_client(resource.meta.client)
+            resilience.for_endpoint(service, resource.meta.client.meta.endpoint_url).attach(resource.meta.client)
+            resources[key] = resource
+        return resource
+
+
+def get_http_session(base_url, username=None, pool_connections=None, service='http'):
+    """
+    Process-wide requests.Session for a (base url, user), with a connection pool sized for concurrent callers.
+    Requests go through the Resilience of (service, base url), see resilient_http.ResilientHTTPAdapter
+    :param service: String: The RESILIENCE_RATE_LIMITS entry of the endpoint
+    :param pool_connections: Integer: Connections kept open per host, HTTP_POOL_CONNECTIONS if None
+    :return: requests.Session
+    """
+    import requests
+    from src.lib.connectors.resilient_http import ResilientHTTPAdapter
+
+    key = (base_url, username)
+    with _lock:
+        _check_pid()
+        session = _http_sessions.get(key)
+        if session is None:
+            session = requests.Session()
+            pool_connections = pool_connections or setting('HTTP_POOL_CONNECTIONS')
+            adapter = ResilientHTTPAdapter(resilience.for_endpoint(service, urlsplit(base_url).netloc),
+                                           pool_connections=pool_connections, pool_maxsize=pool_connections)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            session.hooks['response'].append(_record_http_response)
+            _http_sessions[key] = session
+        return session
+
+
+def instrument_client(client):
+    """
+    Count and time every API call of a botocore client in Logger.metrics, per service and operation:
+    aws_api_calls_total{service, operation, status} and aws_api_call_seconds{service, operation}. The time
+    includes botocore's own retries. Pooled clients are instrumented already
+    :return: The client
+    """
+    events = client.meta.events
+    events.register('before-call', _before_call)
+    events.register('after-call', _after_call)
+    events.register('after-call-error', _after_call_error)
+    return client
+
+
+def _before_call(context, **kwargs):
+    context['metrics_started_at'] = time.perf_counter()
+
+
+def _after_call(http_response, context, event_name, **kwargs):
+    _record_call(event_name, context, str(http_response.status_code))
+
+
+def _after_call_error(exception, context, event_name, **kwargs):
+    _record_call(event_name, context, type(exception).__name__)
+
+
+def _record_call(event_name, context, status):
+    # event_name is <event>.<service>.<operation>
+    _, service, operation = event_name.split('.', 2)
+    Logger.metrics.count('aws_api_calls_total', service=service, operation=operation, status=status)
+    started_at = context.get('metrics_started_at')
+    if started_at is not None:
+        Logger.metrics.observe('aws_api_call_seconds', time.perf_counter() - started_at, service=service,
+                               operation=operation)
+
+
+# Path segments holding ids or keys (issue/10001, issue/TEST-12), folded so the metrics keep a few label values
+_ID_SEGMENT = re.compile(r'/(\d{3,}|[A-Za-z][A-Za-z0-9_]*-\d+)(?=/|$)')
+
+
+def _record_http_response(response, *args, **kwargs):
+    url = urlsplit(response.request.url)
+    labels = {'host': url.netloc, 'method': response.request.method, 'path': _ID_SEGMENT.sub('/{id}', url.path)}
+    Logger.metrics.count('http_requests_total', status=str(response.status_code), **labels)
+    Logger.metrics.observe('http_request_seconds', response.elapsed.total_seconds(), **labels)
+
+
+def reset():
+    """
+    Drop every pooled client and session, they get recreated on next use
+    """
+    with _lock:
+        for session in _http_sessions.values():
+            session.close()
+        _reset_state()
+
+
+def _get_session():
+    global _session
+    # boto3.Session is not thread-safe to create clients from concurrently, callers hold _lock
+    if _session is None:
+        # Imported on the first client: boto3 takes a large share of the import time of the connectors
+        import boto3.session
+
+        _session = boto3.session.Session()
+    return _session
+
+
+def _client_config(max_pool_connections):
+    from botocore.config import Config
+
+    return Config(max_pool_connections=max_pool_connections, retries=NO_BOTOCORE_RETRIES)
+
+
+def _reset_state():
+    global _session, _pid
+    _session = None
+    _clients.clear()
+    _http_sessions.clear()
+    _local.__dict__.clear()
+    _pid = os.getpid()
+
+
+def _check_pid():
+    # Fallback for fork paths that bypass os.register_at_fork: never reuse a parent's sockets
+    if _pid != os.getpid():
+        _reset_state()
+
+
+def _after_fork_in_child():
+    # The child must not share the parent's connections, nor inherit a lock held by another thread at fork time
+    global _lock
+    _lock = threading.RLock()
+    _reset_state()
+
+
+_pid = os.getpid()
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
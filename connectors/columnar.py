@@ -0,0 +1,372 @@
+"""
+Arrow/Parquet helpers shared by ConnectorFile and the pipelines. pyarrow is optional: it is imported on first use
+and only the Parquet paths need it.
+"""
+import bz2
+import gzip
+import io
+import lzma
+import os
+import zlib
+
+# Codecs accepted by the Parquet writer, and by the text (CSV, JSON lines) writers with their file extension
+PARQUET_CODECS = ('snappy', 'gzip', 'zstd', 'brotli', 'lz4', 'none')
+TEXT_CODECS = {'gzip': '.gz', 'bz2': '.bz2', 'xz': '.xz'}
+PARQUET_BATCH_ROWS = 65536
+DATAFRAME_CHUNK_ROWS = 100000
+# A Parquet file of a partition is closed and a new one started past this size
+PARQUET_MAX_FILE_BYTES = 128 * 1024 ** 2
+# Directory name Hive and Athena use for a NULL partition value
+HIVE_DEFAULT_PARTITION = '__HIVE_DEFAULT_PARTITION__'
+_HIVE_ESCAPED = set('"#%\'*/:=?\\\x7f{[]^')
+
+# Athena name of the Arrow types, parametrized types are handled in athena_type
+_ATHENA_TYPES = {
+    'int8': 'tinyint', 'int16': 'smallint', 'int32': 'int', 'int64': 'bigint',
+    'uint8': 'smallint', 'uint16': 'int', 'uint32': 'bigint', 'uint64': 'bigint',
+    'float': 'float', 'halffloat': 'float', 'double': 'double',
+    'bool': 'boolean', 'string': 'string', 'large_string': 'string',
+    'binary': 'binary', 'large_binary': 'binary', 'date32[day]': 'date', 'date64[ms]': 'date',
+}
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.compute
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError("Parquet output needs pyarrow: pip install pyarrow")
+    return pyarrow
+
+
+def open_text(file_path, mode='w', compression=None):
+    """
+    Open a text file, compressed on the fly with gzip, bz2 or xz
+    :param compression: String: One of TEXT_CODECS, None for plain text
+    :return: A text file object
+    """
+    if compression is None:
+        return open(file_path, mode, encoding='utf-8', newline='')
+    openers = {'gzip': gzip.open, 'bz2': bz2.open, 'xz': lzma.open}
+    if compression not in openers:
+        raise ValueError("Unknown compression {}, use one of {}".format(compression, list(TEXT_CODECS)))
+    return openers[compression](file_path, mode + 't', encoding='utf-8', newline='')
+
+
+def compress_chunks(chunks, compression):
+    """
+    Compress a stream of text or bytes chunks on the fly
+    :param compression: String: 'gzip', 'bz2' or 'xz', None to pass the chunks through
+    :return: Generator of Bytes
+    """
+    if compression is None:
+        yield from chunks
+        return
+    compressors = {'gzip': lambda: zlib.compressobj(wbits=31), 'bz2': bz2.BZ2Compressor, 'xz': lzma.LZMACompressor}
+    if compression not in compressors:
+        raise ValueError("Unknown compression {}, use one of {}".format(compression, list(compressors)))
+    compressor = compressors[compression]()
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8') if isinstance(chunk, str) else chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def output_format_of(file_name):
+    """
+    :return: String: 'csv', 'jsonl' or 'parquet' following the extension of a file name, ignoring .gz/.bz2/.xz
+    """
+    name = file_name.lower()
+    for extension in TEXT_CODECS.values():
+        if name.endswith(extension):
+            name = name[:-len(extension)]
+    for output_format, extensions in (('csv', ('.csv',)), ('jsonl', ('.jsonl', '.json', '.ndjson')),
+                                      ('parquet', ('.parquet', '.pq'))):
+        if name.endswith(extensions):
+            return output_format
+    raise ValueError("Can not tell the output format of {}".format(file_name))
+
+
+def compression_of(file_name):
+    """
+    :return: String: 'gzip', 'bz2' or 'xz' following the extension of a file name, None if not compressed
+    """
+    name = file_name.lower()
+    for compression, extension in TEXT_CODECS.items():
+        if name.endswith(extension):
+            return compression
+    return None
+
+
+def dataframe_chunks(data, output_format, compression=None, chunk_rows=DATAFRAME_CHUNK_ROWS):
+    """
+    Serialize a pandas DataFrame chunk_rows rows at a time with the vectorized writers (to_csv, to_json,
+    Arrow), so only one chunk is ever encoded in memory
+    :param data: pandas.DataFrame: The frame to write, its index is left out
+    :param output_format: String: 'csv', 'jsonl' or 'parquet'
+    :param compression: String: 'gzip', 'bz2' or 'xz' for CSV/JSON lines, a Parquet codec ('snappy' if None)
+    :param chunk_rows: Integer: Rows serialized at a time
+    :return: Generator of Bytes (or Strings for uncompressed text)
+    """
+    starts = range(0, max(len(data), 1), chunk_rows)
+    if output_format == 'csv':
+        chunks = (data.iloc[start:start + chunk_rows].to_csv(index=False, header=start == 0) for start in starts)
+    elif output_format == 'jsonl':
+        chunks = (_json_lines(data.iloc[start:start + chunk_rows]) for start in starts if len(data))
+    elif output_format == 'parquet':
+        return _parquet_chunks(data, compression or 'snappy', chunk_rows)
+    else:
+        raise ValueError("Unknown output format {}, use 'csv', 'jsonl' or 'parquet'".format(output_format))
+    return compress_chunks(chunks, compression)
+
+
+def _json_lines(chunk):
+    text = chunk.to_json(orient='records', lines=True, date_format='iso')
+    return text if text.endswith('\n') else text + '\n'
+
+
+def _parquet_chunks(data, compression, chunk_rows):
+    pa = _pyarrow()
+    sink = _DrainBuffer()
+    schema = pa.Schema.from_pandas(data, preserve_index=False)
+    writer = pa.parquet.ParquetWriter(sink, schema, compression=compression)
+    try:
+        for start in range(0, len(data), chunk_rows):
+            writer.write_table(pa.Table.from_pandas(data.iloc[start:start + chunk_rows], schema=schema,
+                                                    preserve_index=False))
+            # A Parquet file is written front to back, what is buffered so far can go out already
+            yield sink.drain()
+    finally:
+        writer.close()
+    yield sink.drain()
+
+
+class _DrainBuffer(io.RawIOBase):
+    """
+    Write-only sink whose content can be taken out as it is written, while tell() keeps counting from the start
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._buffer = bytearray()
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._buffer += data
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self):
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        return data
+
+
+def iter_parquet_rows(fp, columns=None, batch_rows=PARQUET_BATCH_ROWS):
+    """
+    Stream the rows of a Parquet file, batch_rows rows decoded at a time
+    :param fp: Seekable binary file object
+    :param columns: List of Strings: The columns to read, the others are skipped on disk, all if None
+    :return: Generator of Dicts
+    """
+    pa = _pyarrow()
+    for batch in pa.parquet.ParquetFile(fp).iter_batches(batch_size=batch_rows, columns=columns):
+        yield from batch.to_pylist()
+
+
+def record_batches(rows, fieldnames, batch_rows=PARQUET_BATCH_ROWS, schema=None):
+    """
+    Turn rows into Arrow record batches, transposing batch_rows rows at a time into columns
+    :param rows: Iterable of tuples/lists in fieldnames order, or of column batches (Dicts: name -> list of values)
+    :param fieldnames: List of Strings: The column names
+    :param batch_rows: Integer: Rows per record batch, for row input
+    :param schema: pyarrow.Schema: Types of the columns, inferred from the first batch if None
+    :return: Generator of pyarrow.RecordBatch
+    """
+    pa = _pyarrow()
+    batch = []
+    for row in rows:
+        if isinstance(row, dict):
+            arrays = [row[name] for name in fieldnames]
+        else:
+            batch.append(row)
+            if len(batch) < batch_rows:
+                continue
+            arrays = list(zip(*batch))
+            batch = []
+        record_batch = _to_record_batch(pa, arrays, fieldnames, schema)
+        schema = record_batch.schema
+        yield record_batch
+    if batch:
+        yield _to_record_batch(pa, list(zip(*batch)), fieldnames, schema)
+
+
+def string_schema(fieldnames):
+    """
+    :return: pyarrow.Schema: fieldnames as nullable string columns
+    """
+    pa = _pyarrow()
+    return pa.schema([(name, pa.string()) for name in fieldnames])
+
+
+def _to_record_batch(pa, arrays, fieldnames, schema):
+    if schema is None:
+        return pa.RecordBatch.from_arrays([pa.array(array) for array in arrays], names=fieldnames)
+    return pa.RecordBatch.from_arrays([pa.array(array, type=field.type) for array, field in zip(arrays, schema)],
+                                      schema=schema)
+
+
+def hive_path(partition_cols, values):
+    """
+    :return: String: The Hive style directory of a partition, e.g. 'status=Done/year=2020/'
+    """
+    return ''.join('{}={}/'.format(column, HIVE_DEFAULT_PARTITION if value is None else _hive_escape(str(value)))
+                   for column, value in zip(partition_cols, values))
+
+
+def _hive_escape(value):
+    # Same characters as Hive's FileUtils.escapePathName, which Athena unescapes when loading partitions
+    return ''.join('%{:02X}'.format(ord(char)) if char in _HIVE_ESCAPED or ord(char) < 32 else char
+                   for char in value)
+
+
+class PartitionedParquetWriter:
+    """
+    Write record batches as Parquet files, split into Hive style partitions (column=value/ directories) on the
+    values of partition_cols, which are left out of the files as Athena and Spark read them from the path.
+    Every partition keeps one open file, rolled over past max_file_bytes, named part-00000.parquet, part-00001...
+    Files are opened through open_sink(relative_path), so they can go to local disk or to S3:
+
+        with PartitionedParquetWriter(local_sink('out'), partition_cols=['status']) as writer:
+            for batch in record_batches(rows, fieldnames):
+                writer.write(batch)
+    """
+
+    def __init__(self, open_sink, partition_cols=None, compression='snappy', max_file_bytes=PARQUET_MAX_FILE_BYTES):
+        """
+        :param open_sink: Callable: Relative file path -> binary file object; closing it finishes the file
+        :param partition_cols: List of Strings: The partition columns, None for unpartitioned files
+        :param compression: String: Parquet codec, one of PARQUET_CODECS
+        :param max_file_bytes: Integer: Size after which a partition file is closed and the next one started
+        """
+        if compression not in PARQUET_CODECS:
+            raise ValueError("Unknown compression {}, use one of {}".format(compression, PARQUET_CODECS))
+        self.open_sink = open_sink
+        self.partition_cols = list(partition_cols or [])
+        self.compression = compression
+        self.max_file_bytes = max_file_bytes
+        self.files = []
+        self.rows = 0
+        self._writers = {}
+        self._sequence = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def write(self, batch):
+        """
+        :param batch: pyarrow.RecordBatch or pyarrow.Table
+        """
+        pa = _pyarrow()
+        table = pa.Table.from_batches([batch]) if isinstance(batch, pa.RecordBatch) else batch
+        self.rows += table.num_rows
+        if not self.partition_cols:
+            self._write_partition((), table)
+            return
+        compute = pa.compute
+        data = table.drop_columns(self.partition_cols)
+        # One vectorized filter per distinct partition of the batch, partition columns have few values
+        partitions = table.select(self.partition_cols).group_by(self.partition_cols).aggregate([])
+        for key in partitions.to_pylist():
+            mask = None
+            for column in self.partition_cols:
+                value = key[column]
+                condition = (compute.is_null(table[column]) if value is None
+                             else compute.equal(table[column], value))
+                mask = condition if mask is None else compute.and_(mask, condition)
+            self._write_partition(tuple(key[column] for column in self.partition_cols), data.filter(mask))
+
+    def close(self):
+        for writer, sink in self._writers.values():
+            writer.close()
+            sink.close()
+        self._writers = {}
+
+    def _write_partition(self, values, table):
+        pa = _pyarrow()
+        entry = self._writers.get(values)
+        if entry is None:
+            sequence = self._sequence.get(values, 0)
+            self._sequence[values] = sequence + 1
+            path = '{}part-{:05d}.parquet'.format(hive_path(self.partition_cols, values), sequence)
+            sink = self.open_sink(path)
+            entry = self._writers[values] = (pa.parquet.ParquetWriter(sink, table.schema,
+                                                                      compression=self.compression), sink)
+            self.files.append(path)
+        writer, sink = entry
+        writer.write_table(table)
+        if sink.tell() >= self.max_file_bytes:
+            writer.close()
+            sink.close()
+            del self._writers[values]
+
+
+def local_sink(root):
+    """
+    open_sink for PartitionedParquetWriter writing under a local directory
+    """
+    def open_sink(path):
+        file_path = os.path.join(root, path)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        return open(file_path, 'wb')
+    return open_sink
+
+
+def s3_sink(conn_s3, prefix, part_size=None):
+    """
+    open_sink for PartitionedParquetWriter writing under an S3 prefix. Files are uploaded as they are written, an
+    open file holds one part in memory, see ConnectorS3.open_writer
+    :param part_size: Integer: Part size of the uploads, S3_TRANSFER_PART_SIZE if None
+    """
+    transfer_config = {'part_size': part_size} if part_size else None
+    return lambda path: conn_s3.open_writer('{}/{}'.format(prefix.rstrip('/'), path), transfer_config=transfer_config)
+
+
+def athena_type(arrow_type):
+    """
+    :param arrow_type: pyarrow.DataType
+    :return: String: The Athena (Hive DDL) type of an Arrow type
+    """
+    pa = _pyarrow()
+    if pa.types.is_timestamp(arrow_type):
+        return 'timestamp'
+    if pa.types.is_decimal(arrow_type):
+        return 'decimal({},{})'.format(arrow_type.precision, arrow_type.scale)
+    if pa.types.is_list(arrow_type) or pa.types.is_large_list(arrow_type):
+        return 'array<{}>'.format(athena_type(arrow_type.value_type))
+    if pa.types.is_struct(arrow_type):
+        return 'struct<{}>'.format(','.join('{}:{}'.format(field.name, athena_type(field.type))
+                                            for field in arrow_type))
+    if pa.types.is_map(arrow_type):
+        return 'map<{},{}>'.format(athena_type(arrow_type.key_type), athena_type(arrow_type.item_type))
+    return _ATHENA_TYPES.get(str(arrow_type), 'string')
+
+
+def athena_columns(schema, exclude=()):
+    """
+    :param schema: pyarrow.Schema
+    :param exclude: List of Strings: Columns to leave out, e.g. the partition columns
+    :return: List of (name, Athena type) tuples
+    """
+    return [(field.name, athena_type(field.type)) for field in schema if field.name not in exclude]
@@ -1,70 +1,370 @@
+import collections
+import csv
 import datetime
+import decimal
+import io
+import random
+import threading
 import time
-import json
 
-import boto3
 import urllib.parse
 
-from src.lib.logs.logger import Logger
+from src.lib.connectors import client_pool
+from src.lib.connectors.connector_aws_s3 import ConnectorS3
+from src.lib.connectors.settings import setting
 
-from setup import configs
+POLL_INITIAL_DELAY = 0.2
+# batch_get_query_execution accepts at most 50 ids per call
+BATCH_GET_SIZE = 50
+
+QueryOutcome = collections.namedtuple('QueryOutcome',
+                                      ('index', 'query', 'query_execution_id', 'state', 'reason', 'cached'))
 
 
 class ConnectorAthenas:
-    def __init__(self, endpoint_url=configs.get('ATHENA_ENDPOINT', 'https://aws.amazon.com/athena')):
-        params = {}
-        try:
-            params['region_name'] = 'eu-west-1'
-            #session = boto3.Session(profile_name='EUBI.Users')
-            self.client = boto3.client('athena', **params)
-        except ValueError:
-            raise
+    def __init__(self, endpoint_url=None, client=None):
+        """
+        The client comes from the process-wide client_pool on first use
+        :param endpoint_url: String: The Athena endpoint, ATHENA_ENDPOINT if None
+        :param client: An Athena client to use instead of the pooled one
+        """
+        self.endpoint_url = endpoint_url or setting('ATHENA_ENDPOINT')
+        self.params = {'region_name': 'eu-west-1'}
+        self._client = client
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = client_pool.get_client('athena', **self.params)
+        return self._client
+
+    @client.setter
+    def client(self, client):
+        self._client = client
 
     def run_script(self, ddl_script_path, s3_output, database, wait_for_done=False):
+        """
+        Run the SQL script stored in a file
+        :param ddl_script_path: String: Path of the SQL file
+        :param s3_output: String: s3:// location Athena writes the results to
+        :param database: String: The database the query runs in
+        :param wait_for_done: Boolean: Wait for the query and return its results
+        :return: Dict: None if not waiting, else a get_query_results response holding the rows of every result page
+        """
+        with open(ddl_script_path, 'r') as fp:
+            ddl_script = fp.read()
 
-        results=None
+        query_execution_id = self.start_query(ddl_script, database, s3_output)
 
-        try:
-            with open(ddl_script_path, 'r') as fp:
-                ddl_script = fp.read()
+        # In case we want to wait for query to finish
+        if not wait_for_done:
+            return None
+        self.wait_for_query(query_execution_id)
+        results = None
+        for page in self.client.get_paginator('get_query_results').paginate(QueryExecutionId=query_execution_id):
+            if results is None:
+                results = page
+            else:
+                results['ResultSet']['Rows'].extend(page['ResultSet']['Rows'])
+        return results
 
-            query_start = self.client.start_query_execution(
-                QueryString=ddl_script,
-                QueryExecutionContext={
-                    'Database': database
-                },
-                ResultConfiguration={
-                    'OutputLocation': s3_output,
-                }
-            )
+    def register_table(self, table, columns, location, database, s3_output, partition_columns=None,
+                       data_format='parquet', timeout=None):
+        """
+        Create an external table over files on S3 and load its partitions, see create_table_ddl
+        :return: String: The QueryExecutionId of the last query
+        """
+        ddl = create_table_ddl(table, columns, location, partition_columns=partition_columns, data_format=data_format)
+        query_execution_id = self.execute_query(ddl, database, s3_output, timeout=timeout)
+        if partition_columns:
+            # Hive style directories (column=value/) are all picked up by one repair
+            query_execution_id = self.execute_query('MSCK REPAIR TABLE `{}`'.format(table), database, s3_output,
+                                                    timeout=timeout)
+        return query_execution_id
 
-            QueryExecutionId = query_start['QueryExecutionId']
+    def start_query(self, query, database, s3_output):
+        """
+        Submit a query without waiting for it
+        :return: String: The QueryExecutionId
+        """
+        query_start = self.client.start_query_execution(
+            QueryString=query,
+            QueryExecutionContext={
+                'Database': database
+            },
+            ResultConfiguration={
+                'OutputLocation': s3_output,
+            }
+        )
+        return query_start['QueryExecutionId']
 
-            # In case we want to wait for query to finish
-            if wait_for_done:
-                TIME_OUT = configs.get('QUERY_TIME_OUT')
-                start_time = datetime.datetime.now()
+    def execute_query(self, query, database, s3_output, timeout=None):
+        """
+        Submit a query and wait until it succeeded
+        :return: String: The QueryExecutionId, to read the results with iter_query_results or read_query_results_csv
+        """
+        query_execution_id = self.start_query(query, database, s3_output)
+        self.wait_for_query(query_execution_id, timeout=timeout)
+        return query_execution_id
 
-                status = self.client.get_query_execution(QueryExecutionId = QueryExecutionId)
-                status_str = status['QueryExecution']['Status']['State']
+    def wait_for_query(self, query_execution_id, timeout=None):
+        """
+        Poll a query with exponential backoff and jitter until it reaches a final state.
+        A query still running after the timeout is cancelled with stop_query_execution
+        :param query_execution_id: String: The QueryExecutionId
+        :param timeout: Number: Seconds to wait, QUERY_TIME_OUT if None
+        :return: Dict: The QueryExecution of the succeeded query
+        :raises TimeoutError: The query ran out of time and was cancelled
+        :raises AthenaQueryError: The query failed or was cancelled
+        """
+        timeout = timeout if timeout is not None else setting('QUERY_TIME_OUT')
+        deadline = time.monotonic() + timeout
+        delay = POLL_INITIAL_DELAY
+        while True:
+            execution = self.client.get_query_execution(QueryExecutionId=query_execution_id)['QueryExecution']
+            state = execution['Status']['State']
+            if state == 'SUCCEEDED':
+                return execution
+            if state in ('FAILED', 'CANCELLED'):
+                raise AthenaQueryError(query_execution_id, state, execution['Status'].get('StateChangeReason'))
 
-                end_time = datetime.datetime.now()
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                self.client.stop_query_execution(QueryExecutionId=query_execution_id)
+                raise TimeoutError("Query {} still {} after {}s, cancelled".format(query_execution_id, state, timeout))
+            # Full jitter keeps many waiting pipelines from polling in lockstep
+            time.sleep(min(random.uniform(0, delay), remaining))
+            delay = min(delay * 2, setting('QUERY_POLL_MAX_DELAY'))
 
-                difference = (end_time - start_time).total_seconds()
+    def run_queries(self, queries, database, s3_output, max_concurrency=None, timeout=None, cache=None):
+        """
+        Run many queries at once. Up to max_concurrency queries are in flight and all of them are tracked by a
+        single batch_get_query_execution poll loop. Failed queries are reported, not raised
+        :param queries: Iterable of Strings: The SQL queries
+        :param database: String: The database the queries run in
+        :param s3_output: String: s3:// location Athena writes the results to
+        :param max_concurrency: Integer: Queries running at once, ATHENA_MAX_CONCURRENT_QUERIES if None
+        :param timeout: Number: Seconds each query may run before it is cancelled, QUERY_TIME_OUT if None
+        :param cache: AthenaResultCache: Reuse the results of identical read-only queries run within its TTL
+        :return: Generator of QueryOutcome, in the order the queries finish
+        """
+        max_concurrency = max_concurrency or setting('ATHENA_MAX_CONCURRENT_QUERIES')
+        timeout = timeout if timeout is not None else setting('QUERY_TIME_OUT')
+        pending = enumerate(queries)
+        running = {}
+        exhausted = False
+        delay = POLL_INITIAL_DELAY
+        while True:
+            while not exhausted and len(running) < max_concurrency:
+                submitted = next(pending, None)
+                if submitted is None:
+                    exhausted = True
+                    break
+                index, query = submitted
+                cached = cache.get(query, database, s3_output) if cache is not None else None
+                if cached is not None:
+                    yield QueryOutcome(index, query, cached, 'SUCCEEDED', None, True)
+                    continue
+                query_execution_id = self.start_query(query, database, s3_output)
+                running[query_execution_id] = (index, query, time.monotonic() + timeout)
+            if not running:
+                return
 
-                while status_str in ['QUEUED', 'RUNNING'] or difference > TIME_OUT:
-                    status = self.client.get_query_execution(QueryExecutionId = QueryExecutionId)
-                    status_str = status['QueryExecution']['Status']['State']
+            time.sleep(random.uniform(0, delay))
+            finished = False
+            ids = list(running)
+            for start in range(0, len(ids), BATCH_GET_SIZE):
+                response = self.client.batch_get_query_execution(QueryExecutionIds=ids[start:start + BATCH_GET_SIZE])
+                for execution in response.get('QueryExecutions', []):
+                    query_execution_id = execution['QueryExecutionId']
+                    index, query, deadline = running[query_execution_id]
+                    state = execution['Status']['State']
+                    reason = execution['Status'].get('StateChangeReason')
+                    if state in ('QUEUED', 'RUNNING'):
+                        if time.monotonic() < deadline:
+                            continue
+                        self.client.stop_query_execution(QueryExecutionId=query_execution_id)
+                        state, reason = 'CANCELLED', 'Timed out after {}s'.format(timeout)
+                    del running[query_execution_id]
+                    finished = True
+                    if state == 'SUCCEEDED' and cache is not None:
+                        cache.put(query, database, s3_output, query_execution_id)
+                    yield QueryOutcome(index, query, query_execution_id, state, reason, False)
+            # Poll fast again once something finished and new queries get submitted
+            delay = POLL_INITIAL_DELAY if finished else min(delay * 2, setting('QUERY_POLL_MAX_DELAY'))
 
-                    end_time = datetime.datetime.now()
-                    difference = (end_time - start_time).total_seconds()
+    def run_scripts(self, script_paths, s3_output, database, max_concurrency=None, timeout=None, cache=None):
+        """
+        Run the SQL scripts stored in files concurrently, see run_queries
+        :return: Generator of QueryOutcome, whose index is the position of the script in script_paths
+        """
+        def read_scripts():
+            for script_path in script_paths:
+                with open(script_path, 'r') as fp:
+                    yield fp.read()
 
-                results = self.client.get_query_results(QueryExecutionId = QueryExecutionId)
+        return self.run_queries(read_scripts(), database, s3_output, max_concurrency=max_concurrency,
+                                timeout=timeout, cache=cache)
 
-        except Exception as ex:
-            raise ex
+    def iter_query_results(self, query_execution_id, typed=True):
+        """
+        Stream every result row of a succeeded query, page by page through get_query_results
+        :param query_execution_id: String: The QueryExecutionId
+        :param typed: Boolean: Convert values to Python types following the column types, else keep strings
+        :return: Generator of Dicts: column name -> value, None for NULL
+        """
+        columns = None
+        converters = None
+        for page in self.client.get_paginator('get_query_results').paginate(QueryExecutionId=query_execution_id):
+            rows = page['ResultSet']['Rows']
+            if columns is None:
+                column_info = page['ResultSet']['ResultSetMetadata']['ColumnInfo']
+                columns = [column['Name'] for column in column_info]
+                converters = [_converter(column['Type'] if typed else 'varchar') for column in column_info]
+                # SELECT results repeat the column names as their first row
+                if rows and [datum.get('VarCharValue') for datum in rows[0]['Data']] == columns:
+                    rows = rows[1:]
+            for row in rows:
+                yield {column: convert(datum.get('VarCharValue'))
+                       for column, convert, datum in zip(columns, converters, row['Data'])}
 
-        return results
+    def read_query_results_csv(self, query_execution_id, typed=True):
+        """
+        Stream the result rows of a succeeded query straight from the CSV file Athena wrote to S3, in one GET
+        instead of one get_query_results call per 1000 rows
+        :param query_execution_id: String: The QueryExecutionId
+        :param typed: Boolean: Convert values to Python types following the column types, else keep strings
+        :return: Generator of Dicts: column name -> value, None for empty values
+        """
+        execution = self.client.get_query_execution(QueryExecutionId=query_execution_id)['QueryExecution']
+        location = urllib.parse.urlparse(execution['ResultConfiguration']['OutputLocation'])
+        column_info = None
+        if typed:
+            column_info = self.client.get_query_results(QueryExecutionId=query_execution_id, MaxResults=1)[
+                'ResultSet']['ResultSetMetadata']['ColumnInfo']
+        conn_s3 = ConnectorS3(bucket=location.netloc)
+        with io.TextIOWrapper(conn_s3.open_object(location.path.lstrip('/')), encoding='utf-8', newline='') as fp:
+            reader = csv.reader(fp)
+            columns = next(reader, None)
+            if columns is None:
+                return
+            types = {column['Name']: column['Type'] for column in column_info or ()}
+            converters = [_converter(types.get(column, 'varchar')) for column in columns]
+            for row in reader:
+                yield {column: convert(value if value != '' else None)
+                       for column, convert, value in zip(columns, converters, row)}
+
+
+class AthenaResultCache:
+    """
+    Remembers the QueryExecutionId of succeeded read-only queries (SELECT/WITH), keyed on the normalized SQL, the
+    database and the output location, so an identical query within the TTL reads the previous results instead of
+    scanning the data again. DDL and DML always run.
+    """
+
+    def __init__(self, ttl=None):
+        """
+        :param ttl: Number: Seconds a result stays reusable, ATHENA_RESULT_CACHE_TTL if None
+        """
+        self.ttl = ttl if ttl is not None else setting('ATHENA_RESULT_CACHE_TTL')
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def normalize(query):
+        return ' '.join(query.split()).rstrip(';').strip()
+
+    def get(self, query, database, s3_output):
+        """
+        :return: String: The QueryExecutionId holding the results, None on a miss
+        """
+        key = (self.normalize(query), database, s3_output)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] < time.monotonic():
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return entry[0]
+
+    def put(self, query, database, s3_output, query_execution_id):
+        normalized = self.normalize(query)
+        if normalized.split(' ', 1)[0].upper() not in ('SELECT', 'WITH'):
+            return
+        with self._lock:
+            self._entries[(normalized, database, s3_output)] = (query_execution_id, time.monotonic() + self.ttl)
+
+
+class AthenaQueryError(Exception):
+    """
+    An Athena query ended in the FAILED or CANCELLED state
+    """
+
+    def __init__(self, query_execution_id, state, reason=None):
+        super().__init__("Query {} {}: {}".format(query_execution_id, state, reason))
+        self.query_execution_id = query_execution_id
+        self.state = state
+        self.reason = reason
+
+
+def create_table_ddl(table, columns, location, partition_columns=None, data_format='parquet'):
+    """
+    CREATE EXTERNAL TABLE statement over the files written under an S3 location, e.g. by ConnectorFile or the
+    pipelines. Save it as a .sql file for run_script, or run it with ConnectorAthenas.register_table.
+    Compressed CSV and JSON lines files (.gz, .bz2) are read as is, Parquet files carry their own codec
+    :param table: String: The table name
+    :param columns: List of (name, Athena type) tuples, e.g. from columnar.athena_columns
+    :param location: String: s3:// prefix holding the files
+    :param partition_columns: List of (name, Athena type) tuples: The Hive style partition columns, in path order
+    :param data_format: String: 'parquet', 'csv' (with a header line) or 'jsonl'
+    :return: String: The DDL
+    """
+    def column_list(pairs):
+        return ',\n'.join('  `{}` {}'.format(name, athena_type) for name, athena_type in pairs)
+
+    if data_format not in _TABLE_FORMATS:
+        raise ValueError("Unknown data format {}, use one of {}".format(data_format, list(_TABLE_FORMATS)))
+    ddl = 'CREATE EXTERNAL TABLE IF NOT EXISTS `{}` (\n{}\n)\n'.format(table, column_list(columns))
+    if partition_columns:
+        ddl += 'PARTITIONED BY (\n{}\n)\n'.format(column_list(partition_columns))
+    ddl += _TABLE_FORMATS[data_format]
+    ddl += "\nLOCATION '{}/'".format(location.rstrip('/'))
+    if data_format == 'csv':
+        ddl += "\nTBLPROPERTIES ('skip.header.line.count'='1')"
+    return ddl
+
+
+_TABLE_FORMATS = {
+    'parquet': 'STORED AS PARQUET',
+    'csv': "ROW FORMAT SERDE 'org.apache.hadoop.hive.serde2.OpenCSVSerde'\n"
+           "WITH SERDEPROPERTIES ('separatorChar'=',', 'quoteChar'='\"', 'escapeChar'='\\\\')\n"
+           "STORED AS TEXTFILE",
+    'jsonl': "ROW FORMAT SERDE 'org.openx.data.jsonserde.JsonSerDe'\nSTORED AS TEXTFILE",
+}
+
+
+def _parse_timestamp(value):
+    return datetime.datetime.strptime(value, '%Y-%m-%d %H:%M:%S.%f' if '.' in value else '%Y-%m-%d %H:%M:%S')
+
+
+_CONVERTERS = {
+    'tinyint': int, 'smallint': int, 'integer': int, 'int': int, 'bigint': int,
+    'float': float, 'real': float, 'double': float,
+    'decimal': decimal.Decimal,
+    'boolean': lambda value: value.lower() == 'true',
+    'date': datetime.date.fromisoformat,
+    'timestamp': _parse_timestamp,
+}
+
+
+def _converter(athena_type):
+    convert = _CONVERTERS.get(athena_type.lower(), str)
+    return lambda value: None if value is None else convert(value)
 
 
 if __name__ == '__main__':
@@ -1,65 +1,668 @@
+import collections
 import datetime
+import functools
+import io
+import itertools
 import json
-import urllib.parse
-import boto3
+import mmap
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from botocore.exceptions import ClientError
+from src.lib.connectors import client_pool, resilience
+from src.lib.connectors.columnar import compression_of, dataframe_chunks, output_format_of, DATAFRAME_CHUNK_ROWS
+from src.lib.connectors.csv_reader import CsvReader
+from src.lib.connectors.s3_content_hash import CONTENT_HASH_METADATA, content_matches, hash_bytes, hash_file
+from src.lib.connectors.s3_metadata_cache import ObjectMetadata
+from src.lib.connectors.s3_object_reader import S3ObjectReader
+from src.lib.connectors.s3_select import (SelectQuery, input_serialization, is_aws_endpoint, is_select_unsupported,
+                                          iter_object_rows, iter_select_records)
+from src.lib.connectors.s3_transfer import MultipartUploader, MultipartWriter, build_transfer_config
+from src.lib.connectors.settings import setting
 from src.lib.logs.logger import Logger
-from setup import configs
 
+# copy_object refuses sources above 5 GB, those have to go through upload_part_copy
+MAX_COPY_OBJECT_SIZE = 5 * 1024 ** 3
+MULTIPART_COPY_PART_SIZE = 512 * 1024 ** 2
+# delete_objects accepts at most 1000 keys per request
+DELETE_BATCH_SIZE = 1000
+# Fields of a list_objects_v2 entry that iter_objects can project
+S3_OBJECT_FIELDS = ('Key', 'Size', 'LastModified', 'ETag', 'StorageClass')
+DEFAULT_OBJECT_FIELDS = ('Key', 'Size', 'LastModified', 'ETag')
+STREAM_CHUNK_SIZE = 1024 ** 2
+DOWNLOAD_PART_SIZE = 8 * 1024 ** 2
+# Split points used when a prefix has no sub-prefixes to shard the listing on
+SHARD_ALPHABET = '0123456789abcdefghijklmnopqrstuvwxyz'
+# Characters that can continue a JSON number, iter_json holds a number until another character follows it
+_NUMBER_CHARS = '0123456789.eE+-'
 
-class ConnectorS3:
-    def __init__(self, bucket, endpoint_url=configs.get('S3_ENDPOINT', 'https://s3.amazonaws.com')):
 
+@functools.lru_cache(maxsize=None)
+def _object_record(fields):
+    return collections.namedtuple('S3Object', fields)
+
+
+def _as_utc(timestamp):
+    # S3 timestamps are UTC, naive ones (from older callers or caches) are taken as such
+    return timestamp.replace(tzinfo=datetime.timezone.utc) if timestamp.tzinfo is None else timestamp
+
+
+def _age_cutoff(max_age):
+    """
+    :param max_age: Number of days, timedelta or datetime cutoff (naive means UTC)
+    :return: datetime: The tz-aware cutoff
+    """
+    if isinstance(max_age, datetime.datetime):
+        return _as_utc(max_age)
+    if not isinstance(max_age, datetime.timedelta):
+        max_age = datetime.timedelta(days=max_age)
+    return datetime.datetime.now(datetime.timezone.utc) - max_age
+
+
+def _batched(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+class ConnectorS3:
+    def __init__(self, bucket, endpoint_url=None, metadata_cache=None, client=None):
+        """
+        Nothing is created here: the client and resource come from the process-wide client_pool on first use
+        :param bucket: String: The bucket this connector works on
+        :param endpoint_url: String: The S3 endpoint, S3_ENDPOINT if None
+        :param metadata_cache: S3MetadataCache: Opt-in cache for object metadata and listings, None to disable
+        :param client: An S3 client to use instead of the pooled one
+        """
         self.bucket = bucket
+        self.metadata_cache = metadata_cache
         self.bucket_base = 's3a://{}/'.format(self.bucket)
-        params = {'endpoint_url': endpoint_url}
+        endpoint_url = endpoint_url or setting('S3_ENDPOINT')
+        self.params = {'endpoint_url': endpoint_url}
         if 'local' in endpoint_url:
-            params['aws_access_key_id'] = 'foo'
-            params['aws_secret_access_key'] = 'bar'
-        try:
-            # session = boto3.Session(profile_name='EUBI.Users')
-            self.client = boto3.client('s3', **params)
+            self.params['aws_access_key_id'] = 'foo'
+            self.params['aws_secret_access_key'] = 'bar'
+        self._client = client
+        self._resource = None
+        # Unknown until the first select_rows, False once the endpoint turned out not to implement S3 Select
+        self._select_supported = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            # Size the pool for the widest fan-out this connector runs
+            pool_size = max(setting('S3_COPY_MAX_WORKERS'), setting('S3_LIST_MAX_WORKERS'),
+                            setting('S3_DOWNLOAD_MAX_WORKERS'), setting('S3_TRANSFER_MAX_CONCURRENCY'))
+            try:
+                self._client = client_pool.get_client('s3', max_pool_connections=pool_size, **self.params)
+            except ValueError:
+                # Use defaults for invalid endpoints
+                self._client = client_pool.get_client('s3', max_pool_connections=pool_size)
+        return self._client
 
-            # self.client = boto3.client('s3', **params)
-            self.resource = boto3.resource('s3', **params)
+    @client.setter
+    def client(self, client):
+        self._client = client
+
+    @property
+    def resource(self):
+        # Not cached on the instance: resources are per thread in the pool
+        try:
+            return client_pool.get_resource('s3', **self.params)
         except ValueError:
-            # Use defaults for invalid endpoints
-            self.client = boto3.client('s3')
-            self.resource = boto3.resource('s3')
+            return client_pool.get_resource('s3')
 
     def get_object(self, key):
         """
         Get content of a file on S3 without using Spark
         :param key: String: The S3 key of the file
         :return: String: A string holding the file contents, None if key not found
+        :raises ClientError: Any other error, once the retries are exhausted
         """
         try:
-            return self.client.get_object(Bucket=self.bucket, Key=key)['Body'].read().decode('utf-8')
-        except:
-            return None
+            response = self.client.get_object(Bucket=self.bucket, Key=key)
+        except ClientError as ex:
+            if resilience.is_not_found(ex):
+                return None
+            raise
+        self._validate_cached(key, response)
+        return response['Body'].read().decode('utf-8')
+
+    def open_object(self, key, buffer_size=STREAM_CHUNK_SIZE):
+        """
+        Open an S3 object as a seekable binary file object. Reads stream from one GET, readinto a caller-provided
+        bytearray/memoryview at least buffer_size long copies straight into it
+        :param key: String: The S3 key of the file
+        :param buffer_size: Integer: Read-ahead buffer size, 0 for the raw unbuffered S3ObjectReader
+        :return: io.BufferedReader or S3ObjectReader
+        """
+        reader = S3ObjectReader(self.client, self.bucket, key, on_response=lambda r: self._validate_cached(key, r))
+        return io.BufferedReader(reader, buffer_size) if buffer_size else reader
+
+    def open_writer(self, key, metadata=None, transfer_config=None, metrics=None):
+        """
+        Open an S3 object for writing as a binary file object, uploaded while it is written: each part_size bytes go
+        out as a part of a multipart upload, so only one part is held in memory. Closing finishes the upload
+        :param key: String: The key under which to put the data
+        :param metadata: Dict: metadata to pass to the object
+        :param transfer_config: Dict: part_size and max_bandwidth overrides
+        :param metrics: TransferMetrics: Receives per-part progress, latencies and retries
+        :return: MultipartWriter
+        """
+        extra_args = {'ACL': 'bucket-owner-full-control'}
+        if metadata:
+            extra_args['Metadata'] = metadata
+        uploader = MultipartUploader(self.client, self.bucket, key, metrics=metrics, extra_args=extra_args,
+                                     **(transfer_config or {}))
+        return MultipartWriter(uploader, on_close=lambda: self._invalidate_cached(key))
+
+    def read_csv(self, key, **kwargs):
+        """
+        Streaming reader over a CSV file on S3, with the same interface as ConnectorFile.read_csv. Every pass
+        (count_rows, iter_rows, iter_column_batches...) streams the object once, without loading it
+        :param key: String: The S3 key of the file
+        :param kwargs: CsvReader arguments (encoding, fieldnames, delimiter...)
+        :return: CsvReader
+        """
+        return CsvReader.from_s3(self, key, **kwargs)
+
+    def select_rows(self, key, columns=None, where=None, limit=None, input_format=None, compression=None,
+                    delimiter=',', pushdown='auto'):
+        """
+        Query a CSV, JSON lines or Parquet file on S3 through S3 Select: the projection and the filter run in S3
+        and only the matching rows are transferred. Where the endpoint does not implement Select or can not run the
+        query, and for xz files, the object is streamed and filtered here instead, giving the same rows:
+
+            conn_s3.select_rows('Uploads/issues.csv', columns=['key', 'summary'], where={'status': 'Done'})
+        :param key: String: The S3 key of the file
+        :param columns: List of Strings: The columns to return, all if None
+        :param where: Dict column -> value, or List of (column, operator, value) tuples that must all hold, see
+            SelectQuery. CSV fields compared with a number or a boolean are cast to its type
+        :param limit: Integer: Rows at most, all if None
+        :param input_format: String: 'csv', 'jsonl' or 'parquet', following the key extension if None
+        :param compression: String: 'gzip', 'bz2' or 'xz', following the key extension if None
+        :param delimiter: String: The CSV field delimiter, the first line of a CSV file is its header
+        :param pushdown: 'auto' to use S3 Select where it works, True to require it (its errors are raised), False
+            to always filter locally
+        :return: Generator of Dicts, CSV values are strings
+        :raises ValueError: pushdown is True and S3 Select can not read the object
+        """
+        # Arguments are checked here, the query runs on the first next()
+        if pushdown not in ('auto', True, False):
+            raise ValueError("Unknown pushdown {!r}, use 'auto', True or False".format(pushdown))
+        query = SelectQuery(columns, where, limit)
+        input_format = input_format or output_format_of(key)
+        compression = compression or compression_of(key)
+        serialization = input_serialization(input_format, compression, delimiter)
+        if pushdown is True and serialization is None:
+            raise ValueError("S3 Select can not read {} files compressed with {}".format(input_format, compression))
+        return self._select_rows(key, query, input_format, compression, delimiter, serialization, pushdown)
+
+    def _select_rows(self, key, query, input_format, compression, delimiter, serialization, pushdown):
+        if pushdown is True or (pushdown and serialization is not None and self._select_supported is not False):
+            response = self._select_object(key, query.expression(input_format), serialization,
+                                           fallback=pushdown == 'auto')
+            if response is not None:
+                yield from query.project(iter_select_records(response['Payload'], on_stats=self._count_selected))
+                return
+        rows = iter_object_rows(self, key, input_format, compression, delimiter, columns=query.read_columns)
+        yield from query.apply(rows, input_format)
+
+    def get_object_range(self, key, start, end=None):
+        """
+        Get a byte range of a file on S3
+        :param key: String: The S3 key of the file
+        :param start: Integer: First byte offset, negative for the last -start bytes
+        :param end: Integer: Last byte offset (inclusive), None for the end of the object
+        :return: Bytes
+        """
+        response = self.client.get_object(Bucket=self.bucket, Key=key, Range=self._byte_range(start, end))
+        return response['Body'].read()
+
+    def iter_object_chunks(self, key, chunk_size=STREAM_CHUNK_SIZE, start=None, end=None):
+        """
+        Stream a file on S3 (or a byte range of it) in chunks
+        :param key: String: The S3 key of the file
+        :param chunk_size: Integer: Size of the chunks in bytes
+        :param start: Integer: First byte offset, None for the whole object
+        :param end: Integer: Last byte offset (inclusive), None for the end of the object
+        :return: Generator of Bytes
+        """
+        kwargs = {'Bucket': self.bucket, 'Key': key}
+        if start is not None:
+            kwargs['Range'] = self._byte_range(start, end)
+        response = self.client.get_object(**kwargs)
+        self._validate_cached(key, response)
+        body = response['Body']
+        try:
+            yield from body.iter_chunks(chunk_size)
+        finally:
+            body.close()
 
-    def put_object(self, object, key, metadata=None):
+    def iter_object_lines(self, key, encoding='utf-8', chunk_size=STREAM_CHUNK_SIZE):
         """
-        Put data as a file on S3
-        :param object: String: A String containing the data to write
+        Stream the lines of a text file on S3
+        :param key: String: The S3 key of the file
+        :param encoding: String: The text encoding, None to yield the raw bytes lines
+        :param chunk_size: Integer: Size of the chunks read from S3 in bytes
+        :return: Generator of Strings (or Bytes) without line endings
+        """
+        with self.open_object(key, buffer_size=chunk_size) as fp:
+            for line in fp:
+                line = line.rstrip(b'\r\n')
+                yield line.decode(encoding) if encoding else line
+
+    def download_parallel(self, key, filename, part_size=DOWNLOAD_PART_SIZE, max_workers=None):
+        """
+        Download a file from S3 with concurrent ranged GETs, each written straight into a memory-mapped local file
+        :param key: String: the key on S3
+        :param filename: String: The filename on local
+        :param part_size: Integer: Size of each ranged GET in bytes
+        :param max_workers: Integer: Number of concurrent GETs, S3_DOWNLOAD_MAX_WORKERS if None
+        :return: the local filename
+        """
+        size = self._object_metadata(key, need_metadata=False).size
+        with open(filename, 'wb+') as fp:
+            fp.truncate(size)
+            if not size:
+                return filename
+            with mmap.mmap(fp.fileno(), size) as mapped:
+                def fetch(start):
+                    end = min(start + part_size, size) - 1
+                    response = self.client.get_object(Bucket=self.bucket, Key=key, Range=self._byte_range(start, end))
+                    view = memoryview(mapped)[start:end + 1]
+                    try:
+                        offset = 0
+                        while offset < len(view):
+                            read = response['Body'].readinto(view[offset:])
+                            if not read:
+                                raise IOError("Short read on {} at byte {}".format(key, start + offset))
+                            offset += read
+                    finally:
+                        view.release()
+                        response['Body'].close()
+
+                with ThreadPoolExecutor(max_workers=max_workers or setting('S3_DOWNLOAD_MAX_WORKERS')) as executor:
+                    # list() re-raises the first failed part
+                    list(executor.map(fetch, range(0, size, part_size)))
+                mapped.flush()
+        return filename
+
+    @staticmethod
+    def _byte_range(start, end=None):
+        if start < 0:
+            return 'bytes={}'.format(start)
+        return 'bytes={}-{}'.format(start, '' if end is None else end)
+
+    def put_object(self, object, key, metadata=None, metrics=None, dedup=False):
+        """
+        Put data as a file on S3. Payloads larger than one transfer part, file objects and generators are sent as a
+        concurrent multipart upload, see put_object_stream
+        :param object: String/Bytes/file object/iterable of chunks: The data to write
         :param key: String: The key under which to put the data
         :param metadata: String: metadata to pass to the object
+        :param metrics: TransferMetrics: Receives the progress of the upload
+        :param dedup: Boolean: Skip the upload if the object already holds the same content (one HEAD), see
+            s3_content_hash. Only for String/Bytes data; the metadata of an unchanged object is left as is
+        :return: Boolean: False if the upload was skipped
         """
-        if not metadata:
-            self.client.put_object(Bucket=self.bucket, Key=key, Body=object, ACL='bucket-owner-full-control')
+        if isinstance(object, str):
+            # Sized and hashed as the bytes sent
+            object = object.encode('utf-8')
+        is_buffer = isinstance(object, (bytes, bytearray, memoryview))
+        if dedup:
+            if not is_buffer:
+                raise ValueError("dedup needs the whole content up front, pass a String or Bytes")
+            # MultipartUploader sends payloads fitting in one part with a single put_object
+            content_hash = hash_bytes(object, multipart_threshold=setting('S3_TRANSFER_PART_SIZE') + 1)
+            if self._content_unchanged(self.bucket, key, content_hash):
+                return False
+            metadata = dict(metadata or {}, **{CONTENT_HASH_METADATA: content_hash})
+        if is_buffer and len(object) <= setting('S3_TRANSFER_PART_SIZE') and metrics is None:
+            if not metadata:
+                self.client.put_object(Bucket=self.bucket, Key=key, Body=object, ACL='bucket-owner-full-control')
+            else:
+                self.client.put_object(Bucket=self.bucket, Key=key, Body=object, Metadata=metadata, ACL='bucket-owner-full-control')
+            self._invalidate_cached(key)
         else:
-            self.client.put_object(Bucket=self.bucket, Key=key, Body=object, Metadata=metadata, ACL='bucket-owner-full-control')
+            self.put_object_stream(object, key, metadata=metadata, metrics=metrics)
+        return True
+
+    def put_object_stream(self, source, key, metadata=None, transfer_config=None, metrics=None):
+        """
+        Upload an in-memory buffer, a file object or a generator of chunks as a concurrent multipart upload
+        without going through a temporary file. Only max_concurrency parts are buffered at a time
+        :param source: String/Bytes/file object/iterable of String or Bytes chunks: The data to write
+        :param key: String: The key under which to put the data
+        :param metadata: Dict: metadata to pass to the object
+        :param transfer_config: Dict: part_size, max_concurrency and max_bandwidth overrides
+        :param metrics: TransferMetrics: Receives per-part progress, latencies and retries
+        """
+        extra_args = {'ACL': 'bucket-owner-full-control'}
+        if metadata:
+            extra_args['Metadata'] = metadata
+        try:
+            return MultipartUploader(self.client, self.bucket, key, metrics=metrics, extra_args=extra_args,
+                                     **(transfer_config or {})).upload(source)
+        finally:
+            self._invalidate_cached(key)
+
+    def put_dataframe(self, data, key, output_format=None, compression=None, chunk_rows=DATAFRAME_CHUNK_ROWS,
+                      metadata=None, metrics=None):
+        """
+        Write a pandas DataFrame to S3 as CSV, JSON lines or Parquet. Chunks of chunk_rows rows are serialized with
+        the vectorized writers, compressed if asked, and streamed into a multipart upload without a local file
+        :param data: pandas.DataFrame: The frame to write, its index is left out
+        :param key: String: The key under which to put the data
+        :param output_format: String: 'csv', 'jsonl' or 'parquet', from the key extension if None
+        :param compression: String: 'gzip', 'bz2' or 'xz' for CSV/JSON lines, a Parquet codec ('snappy' if None)
+        :param chunk_rows: Integer: Rows serialized at a time
+        :param metadata: Dict: metadata to pass to the object
+        :param metrics: TransferMetrics: Receives per-part progress, latencies and retries
+        """
+        chunks = dataframe_chunks(data, output_format or output_format_of(key), compression=compression,
+                                  chunk_rows=chunk_rows)
+        return self.put_object_stream(chunks, key, metadata=metadata, metrics=metrics)
 
-    def upload_file(self, file_name, bucket, destination_name):
+    def upload_file(self, file_name, bucket, destination_name, transfer_config=None, metrics=None, dedup=False):
         """
                 Upload file to S3
                 :param file_name: String:
                 :param bucket: String:
                 :param destination_name: String:
+                :param transfer_config: Dict: part_size, max_concurrency, max_bandwidth and multipart_threshold overrides
+                :param metrics: TransferMetrics: Receives the progress of the upload
+                :param dedup: Boolean: Hash the file and skip the upload if the object already holds the same content
+                    (one HEAD), see s3_content_hash
+                :return: Boolean: False if the upload was skipped
                 """
+        config = build_transfer_config(**(transfer_config or {}))
+        content_hash = None
+        if dedup:
+            content_hash = hash_file(file_name, config.multipart_chunksize, config.multipart_threshold)
+            if self._content_unchanged(bucket, destination_name, content_hash):
+                return False
+        self._upload_file(file_name, bucket, destination_name, config, metrics, content_hash)
+        return True
+
+    def _upload_file(self, file_name, bucket, destination_name, config, metrics=None, content_hash=None):
+        extra_args = {'Metadata': {CONTENT_HASH_METADATA: content_hash}} if content_hash else None
         try:
-            not self.client.upload_file(file_name, bucket, destination_name)
-        except Exception as ex:
-            raise ex
+            self.client.upload_file(file_name, bucket, destination_name, ExtraArgs=extra_args, Config=config,
+                                    Callback=metrics)
+        finally:
+            self._invalidate_cached(destination_name, bucket)
+        if metrics is not None:
+            metrics.finish()
+
+    def _content_unchanged(self, bucket, key, content_hash):
+        """
+        :return: Boolean: The object exists and holds the content of content_hash, by its ETag or its metadata
+        """
+        try:
+            if bucket == self.bucket:
+                cached = self._object_metadata(key)
+                etag, metadata = cached.etag, cached.metadata
+            else:
+                response = self.client.head_object(Bucket=bucket, Key=key)
+                etag, metadata = response['ETag'], response.get('Metadata', {})
+        except ClientError as ex:
+            if resilience.is_not_found(ex):
+                return False
+            raise
+        if not content_matches(content_hash, etag, metadata):
+            return False
+        Logger.debug('Skipped upload of unchanged {}', key)
+        Logger.metrics.count('s3_dedup_skipped_total', bucket=bucket)
+        return True
+
+    def sync_directory(self, directory, prefix, delete=False, transfer_config=None, max_workers=None):
+        """
+        Upload the files of a local directory (recursively) under a prefix, skipping the ones S3 already holds.
+        The directory is diffed against one listing of the prefix. Every file is hashed, read once in full: files
+        missing or of another size are uploaded with the hash in their metadata (it has to be known when the upload
+        starts, for later syncs of SSE-KMS objects whose ETag is not an MD5), so a changed file is read twice. Files
+        of the same size are compared with the listed ETag, and only when that differs with the content hash stored
+        in the object metadata (one HEAD). Bytes sent are proportional to the changes, bytes read to the directory
+        :param directory: String: The local directory
+        :param prefix: String: The destination prefix, file paths relative to directory are appended with a /
+        :param delete: Boolean: Also delete the objects under prefix whose file no longer exists
+        :param transfer_config: Dict: part_size, max_concurrency, max_bandwidth and multipart_threshold overrides
+        :param max_workers: Integer: Files compared and uploaded concurrently, S3_COPY_MAX_WORKERS if None
+        :return: Dict: 'uploaded', 'unchanged' and 'deleted' lists of keys, 'failed': {key: error}, 'bytes_uploaded'
+        """
+        config = build_transfer_config(**(transfer_config or {}))
+        prefix = prefix.rstrip('/') + '/' if prefix else ''
+        listed = {record.Key: record for record in self.iter_objects(prefix, fields=('Key', 'Size', 'ETag'))}
+        report = {'uploaded': [], 'unchanged': [], 'deleted': [], 'failed': {}, 'bytes_uploaded': 0}
+        lock = threading.Lock()
+
+        def sync_one(path, key):
+            size = os.path.getsize(path)
+            content_hash = hash_file(path, config.multipart_chunksize, config.multipart_threshold)
+            remote = listed.get(key)
+            if remote is not None and remote.Size == size and (content_matches(content_hash, remote.ETag) or
+                                                               self._content_unchanged(self.bucket, key,
+                                                                                       content_hash)):
+                with lock:
+                    report['unchanged'].append(key)
+                return
+            self._upload_file(path, self.bucket, key, config, content_hash=content_hash)
+            with lock:
+                report['uploaded'].append(key)
+                report['bytes_uploaded'] += size
+
+        local_keys = set()
+        with ThreadPoolExecutor(max_workers=max_workers or setting('S3_COPY_MAX_WORKERS')) as executor:
+            futures = {}
+            for root, _, files in os.walk(directory):
+                for file_name in files:
+                    path = os.path.join(root, file_name)
+                    key = prefix + os.path.relpath(path, directory).replace(os.sep, '/')
+                    local_keys.add(key)
+                    futures[executor.submit(sync_one, path, key)] = key
+            for future, key in futures.items():
+                try:
+                    future.result()
+                except Exception as ex:
+                    report['failed'][key] = str(ex)
+        if delete:
+            stale = sorted(set(listed) - local_keys)
+            for start in range(0, len(stale), DELETE_BATCH_SIZE):
+                self._report_deleted(report, stale[start:start + DELETE_BATCH_SIZE])
+        Logger.info("Synced {} to s3://{}/{}: uploaded {} ({} bytes), unchanged {}, deleted {}, failed {}",
+                    directory, self.bucket, prefix, len(report['uploaded']), report['bytes_uploaded'],
+                    len(report['unchanged']), len(report['deleted']), len(report['failed']))
+        return report
+
+    def iter_objects(self, prefix, suffix='', start_after=None, fields=DEFAULT_OBJECT_FIELDS, page_size=1000):
+        """
+        Stream the objects under a prefix, one list_objects_v2 page at a time
+        :param prefix: String: The prefix to list
+        :param suffix: String: Only yield keys ending with this suffix
+        :param start_after: String: Only yield keys sorting after this key
+        :param fields: Tuple of Strings: The fields of each record, any of S3_OBJECT_FIELDS
+        :param page_size: Integer: Number of keys requested per round trip (max 1000)
+        :return: Generator of namedtuples holding the requested fields, in key order
+        """
+        record = self._object_record(fields)
+        for contents in self._iter_pages(prefix, start_after=start_after, page_size=page_size):
+            for obj in contents:
+                if obj['Key'].endswith(suffix):
+                    yield record._make(obj.get(field) for field in record._fields)
+
+    @staticmethod
+    def _object_record(fields):
+        fields = tuple(fields)
+        unknown = set(fields) - set(S3_OBJECT_FIELDS)
+        if unknown:
+            raise ValueError("Unknown object fields: {}".format(sorted(unknown)))
+        return _object_record(fields)
+
+    def _iter_pages(self, prefix, start_after=None, page_size=1000):
+        kwargs = {'Bucket': self.bucket, 'Prefix': prefix, 'PaginationConfig': {'PageSize': page_size}}
+        if start_after:
+            kwargs['StartAfter'] = start_after
+        for page in self.client.get_paginator('list_objects_v2').paginate(**kwargs):
+            yield page.get('Contents', ())
+
+    def iter_objects_parallel(self, prefix, suffix='', fields=DEFAULT_OBJECT_FIELDS, shard_by='delimiter',
+                              delimiter='/', alphabet=SHARD_ALPHABET, max_workers=None, ordered=False,
+                              queue_pages=4):
+        """
+        Stream the objects under a (very large) prefix by listing disjoint shards of it concurrently.
+        Shards are the sub-prefixes found with the delimiter, the way get_subfolders finds them, descending level
+        by level until there are at least max_workers of them, or key ranges split on the characters of alphabet
+        when there are fewer than two sub-prefixes
+        :param prefix: String: The prefix to list
+        :param suffix: String: Only yield keys ending with this suffix
+        :param fields: Tuple of Strings: The fields of each record, any of S3_OBJECT_FIELDS
+        :param shard_by: String: 'delimiter' or 'alphabet'
+        :param delimiter: String: The delimiter used to discover sub-prefixes
+        :param alphabet: String: The characters the key range after the prefix is split on
+        :param max_workers: Integer: number of concurrent list_objects_v2 calls, S3_LIST_MAX_WORKERS if None
+        :param ordered: Boolean: Yield records in key order (requires 'Key' in fields) instead of as pages land
+        :param queue_pages: Integer: Pages buffered per shard (ordered) or per worker (unordered)
+        :return: Generator of namedtuples holding the requested fields
+        """
+        record = self._object_record(fields)
+        if ordered and 'Key' not in record._fields:
+            raise ValueError("An ordered listing needs 'Key' in fields")
+        if shard_by not in ('delimiter', 'alphabet'):
+            raise ValueError("Unknown shard_by: {}".format(shard_by))
+        max_workers = max_workers or setting('S3_LIST_MAX_WORKERS')
+
+        segments = None
+        if shard_by == 'delimiter':
+            segments = self._delimiter_shards(prefix, delimiter, suffix, record, max_workers)
+        if segments is None:
+            segments = self._alphabet_shards(prefix, alphabet)
+
+        stop = threading.Event()
+        shared = queue.Queue(maxsize=max_workers * queue_pages)
+        queues = [queue.Queue(maxsize=queue_pages) if ordered else shared for _ in segments]
+
+        def put(out, item):
+            while not stop.is_set():
+                try:
+                    out.put(item, timeout=0.1)
+                    return
+                except queue.Full:
+                    continue
+
+        def list_shard(index):
+            out = queues[index]
+            try:
+                shard_prefix, start_after, end_at, records = segments[index]
+                if records is not None:
+                    put(out, records)
+                else:
+                    for page in self._iter_key_range(shard_prefix, start_after, end_at, suffix, record):
+                        if stop.is_set():
+                            return
+                        put(out, page)
+                put(out, None)
+            except Exception as ex:
+                put(out, ex)
+
+        # Shards are submitted in key order and the executor starts them FIFO, so in ordered mode the shard
+        # being drained is always running and the bounded per-shard queues cannot deadlock
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+        try:
+            for index in range(len(segments)):
+                executor.submit(list_shard, index)
+            pending = len(segments)
+            current = 0
+            while pending:
+                item = queues[current].get()
+                if item is None:
+                    pending -= 1
+                    if ordered:
+                        current += 1
+                elif isinstance(item, Exception):
+                    raise item
+                else:
+                    yield from item
+        finally:
+            stop.set()
+            executor.shutdown(wait=True)
+
+    def _delimiter_shards(self, prefix, delimiter, suffix, record, max_workers):
+        """
+        Discover the sub-prefixes of a prefix level by level, the prefixes of a level listed concurrently, until
+        there are at least max_workers of them or no level below. Objects sitting directly under a listed prefix
+        come back with its listing and form page-sized segments. Returns None if there is nothing to fan out on
+        """
+        sub_prefixes, segments = self._list_level(prefix, delimiter, suffix, record, flat_check=True)
+        if sub_prefixes is None:
+            return None
+
+        def list_level(sub_prefix):
+            return self._list_level(sub_prefix, delimiter, suffix, record)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            while 0 < len(sub_prefixes) < max_workers:
+                levels = list(executor.map(list_level, sub_prefixes))
+                sub_prefixes = [sub_prefix for level_prefixes, _ in levels for sub_prefix in level_prefixes]
+                segments.extend(segment for _, level_segments in levels for segment in level_segments)
+        segments.extend((sub_prefix, None, None, None) for sub_prefix in sub_prefixes)
+        # S3 returns keys in UTF-8 binary order, which is the code point order Python sorts strings in
+        return sorted(segments, key=lambda segment: segment[0])
+
+    def _list_level(self, prefix, delimiter, suffix, record, flat_check=False):
+        """
+        List a prefix with the delimiter
+        :param flat_check: Boolean: Give up, returning (None, None), if the first page holds fewer than two
+            sub-prefixes: a flat prefix is split on key ranges instead of being walked here
+        :return: (List of sub-prefixes, List of segments holding the objects directly under the prefix). The
+            objects of a page are cut into runs falling between two sub-prefixes, so segments do not overlap
+        """
+        sub_prefixes = []
+        segments = []
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix, Delimiter=delimiter):
+            page_prefixes = [o['Prefix'] for o in page.get('CommonPrefixes', ())]
+            sub_prefixes.extend(page_prefixes)
+            if flat_check and len(sub_prefixes) < 2:
+                return None, None
+            items = sorted([(obj['Key'], obj) for obj in page.get('Contents', ())]
+                           + [(page_prefix, None) for page_prefix in page_prefixes], key=lambda item: item[0])
+            run = []
+            for key, obj in items + [(None, None)]:
+                if obj is not None:
+                    run.append(obj)
+                    continue
+                records = [record._make(o.get(field) for field in record._fields)
+                           for o in run if o['Key'].endswith(suffix)]
+                if records:
+                    segments.append((run[0]['Key'], None, None, records))
+                run = []
+        return sub_prefixes, segments
+
+    @staticmethod
+    def _alphabet_shards(prefix, alphabet):
+        """
+        Split the keys under a prefix into contiguous ranges (start_after, end_at] on the given characters
+        """
+        bounds = [None] + [prefix + character for character in sorted(set(alphabet))] + [None]
+        return [(prefix, start_after, end_at, None) for start_after, end_at in zip(bounds, bounds[1:])]
+
+    def _iter_key_range(self, prefix, start_after, end_at, suffix, record):
+        for contents in self._iter_pages(prefix, start_after=start_after):
+            page = []
+            for obj in contents:
+                if end_at is not None and obj['Key'] > end_at:
+                    if page:
+                        yield page
+                    return
+                if obj['Key'].endswith(suffix):
+                    page.append(record._make(obj.get(field) for field in record._fields))
+            if page:
+                yield page
 
     def list_objects(self, prefix, limit=None, give_size=False, suffix=''):
         """
@@ -67,62 +670,127 @@ class ConnectorS3:
         :param prefix: String: The name of the layer
         :param limit: Integer: limit the number of files returned by the list objects operation, if None or 0: no limit
         :param give_size: Boolean: Also return the size of the files listed in bytes
-        :param suffix:
+        :param suffix: String: Only list keys ending with this suffix
         :return: List of Strings or (List of Strings, int): A list of keys and if give_size=True, also an integer in bytes
         """
+        if self.metadata_cache is not None and not limit:
+            records = self._cached_listing(prefix, suffix)
+        else:
+            records = self.iter_objects(prefix, suffix=suffix, fields=('Key', 'Size'),
+                                        page_size=min(limit, 1000) if limit else 1000)
+        if limit:
+            records = itertools.islice(records, limit)
         objects = []
         total_size = 0
-        if not limit or limit > 1000:
-            paginator = self.client.get_paginator("list_objects")
-            page_iterator = paginator.paginate(Bucket=self.bucket, EncodingType='url', Prefix=prefix)
-            for page in page_iterator:
-                if "Contents" in page:
-                    for key in page["Contents"]:
-                        if suffix != '':
-                            if key["Key"].endswith(suffix):
-                                objects.append(urllib.parse.unquote(key["Key"]))
-                                total_size += key['Size']
-                        else:
-                            objects.append(key["Key"])
-                            total_size += key['Size']
-        else:
-            response = self.client.list_objects_v2(Bucket=self.bucket, Prefix=prefix)
-            if "Contents" in response:
-                for key in response['Contents']:
-                    if suffix != '':
-                        if key["Key"].endswith(suffix):
-                            objects.append(key["Key"])
-                            total_size += key['Size']
-                    else:
-                        objects.append(key["Key"])
-                        total_size += key['Size']
+        for record in records:
+            objects.append(record.Key)
+            total_size += record.Size
         if give_size:
-            return list(map(lambda key: key.replace('%3D', '='), objects)), total_size
+            return objects, total_size
         else:
-            return list(map(lambda key: key.replace('%3D', '='), objects))
+            return objects
+
+    def _cached_listing(self, prefix, suffix):
+        """
+        The (Key, Size) records under a prefix, from the metadata cache if it holds the listing. A fresh listing is
+        streamed, caching the size, ETag and LastModified of its objects page by page; the listing itself is only
+        kept if it holds at most max_listing_keys objects, so large prefixes are not held in memory
+        """
+        record = _object_record(('Key', 'Size'))
+        entries = self.metadata_cache.get_listing(self.bucket, prefix)
+        if entries is not None:
+            yield from (record(key, size) for key, size in entries if key.endswith(suffix))
+            return
+        listing = []
+        for page in _batched(self.iter_objects(prefix), 1000):
+            self.metadata_cache.put_many(self.bucket, ((r.Key, r.Size, r.ETag, r.LastModified, None) for r in page))
+            if listing is not None:
+                listing.extend((r.Key, r.Size) for r in page)
+                if len(listing) > self.metadata_cache.max_listing_keys:
+                    listing = None
+            yield from (record(r.Key, r.Size) for r in page if r.Key.endswith(suffix))
+        if listing is not None:
+            self.metadata_cache.put_listing(self.bucket, prefix, listing)
+
+    def _object_metadata(self, key, need_metadata=True):
+        """
+        Size, ETag, LastModified and user metadata of an object through the metadata cache, if one is configured
+        :param need_metadata: Boolean: Entries cached from a listing carry no user metadata, only use them if False
+        :return: ObjectMetadata
+        """
+        if self.metadata_cache is not None:
+            cached = self.metadata_cache.get(self.bucket, key)
+            if cached is not None and (cached.metadata is not None or not need_metadata):
+                return cached
+        response = self.client.head_object(Bucket=self.bucket, Key=key)
+        value = ObjectMetadata(response['ContentLength'], response['ETag'], response['LastModified'],
+                               response.get('Metadata', {}))
+        if self.metadata_cache is not None:
+            self.metadata_cache.put(self.bucket, key, *value)
+        return value
+
+    def _select_object(self, key, expression, serialization, fallback=True):
+        """
+        :param fallback: Boolean: Return None rather than raise when the endpoint can not run the query
+        :return: Dict: The select_object_content response, None if the endpoint can not run the query
+        """
+        if not hasattr(self.client, 'select_object_content'):
+            if not fallback:
+                raise ValueError("The S3 client has no S3 Select")
+            self._select_supported = False
+            return None
+        endpoint_url = getattr(getattr(self.client, 'meta', None), 'endpoint_url', self.params['endpoint_url'])
+        try:
+            response = self.client.select_object_content(
+                Bucket=self.bucket, Key=key, ExpressionType='SQL', Expression=expression,
+                InputSerialization=serialization, OutputSerialization={'JSON': {'RecordDelimiter': '\n'}})
+        except Exception as ex:
+            if not fallback or not is_select_unsupported(ex, aws=is_aws_endpoint(endpoint_url)):
+                raise
+            Logger.info("S3 Select is not available on {} ({!r}), filtering locally", endpoint_url, ex)
+            self._select_supported = False
+            return None
+        self._select_supported = True
+        return response
+
+    def _count_selected(self, stats):
+        Logger.metrics.count('s3_select_bytes_scanned_total', stats.get('BytesScanned', 0), bucket=self.bucket)
+        Logger.metrics.count('s3_select_bytes_returned_total', stats.get('BytesReturned', 0), bucket=self.bucket)
+
+    def _validate_cached(self, key, response):
+        if self.metadata_cache is not None and 'ETag' in response:
+            self.metadata_cache.validate(self.bucket, key, response['ETag'])
+
+    def _invalidate_cached(self, key, bucket=None):
+        if self.metadata_cache is not None:
+            self.metadata_cache.invalidate(bucket or self.bucket, key)
+
+    def _invalidate_cached_many(self, keys, bucket=None):
+        if self.metadata_cache is not None:
+            self.metadata_cache.invalidate_many(bucket or self.bucket, keys)
 
     def list_objects_with_timestamp(self, prefix):
-        objects = []
-        paginator = self.client.get_paginator("list_objects")
-        page_iterator = paginator.paginate(Bucket=self.bucket, EncodingType='url', Prefix=prefix)
-        for page in page_iterator:
-            if "Contents" in page:
-                for key in page["Contents"]:
-                    print("Key:{}".format(urllib.parse.unquote(key["Key"])))
-                    objects.append({'Key': urllib.parse.unquote(key["Key"]), "Timestamp": key['LastModified'].replace(tzinfo=None)})
-        return objects
+        """
+        List the keys of all objects in a given layer with their (naive) upload timestamps
+        :param prefix: String: The name of the layer
+        :return: List of Dicts: {'Key': String, 'Timestamp': datetime}
+        """
+        return [{'Key': record.Key, 'Timestamp': record.LastModified.replace(tzinfo=None)}
+                for record in self.iter_objects(prefix, fields=('Key', 'LastModified'))]
 
     def delete_object(self, key):
         """
         Delete the object with the given key from S3
         :param key: String: The key of the object to delete
         """
-        Logger.info("Deleting files:{}".format(key))
+        Logger.debug("Deleting files:{}", key)
         if type(key) == str:
             self.client.delete_object(Bucket=self.bucket, Key=key)
+            self._invalidate_cached(key)
         else:
             delete_dict = {'Objects': list(map(lambda k: {'Key': k}, key))}
             self.client.delete_objects(Bucket=self.bucket, Delete=delete_dict)
+            self._invalidate_cached_many(key)
 
     def get_object_with_timestamp(self, key):
         """
@@ -131,21 +799,25 @@ class ConnectorS3:
         :return: String, Timestamp: A string holding the file contents and a timestamp holding the timestamp of the S3 upload
         """
         response = self.client.get_object(Bucket=self.bucket, Key=key)
-        return response['Body'].read().decode('latin-1').encode('ascii', 'ignore').decode('utf-8'), response[
-            'LastModified']
+        self._validate_cached(key, response)
+        # Dropping the non-ASCII bytes in one decode is what decoding latin-1 and re-encoding to ASCII did
+        return response['Body'].read().decode('ascii', 'ignore'), response['LastModified']
 
     def get_object_with_metadata(self, key):
         """
         Get content of a file on S3
         :param key: String: The S3 key of the file
-        :return: String: A string holding the file contents, None if not exists
+        :return: String, Dict: The file contents and its metadata, None, None if not exists
+        :raises ClientError: Any other error, once the retries are exhausted
         """
         try:
             obj = self.client.get_object(Bucket=self.bucket, Key=key)
-            return obj['Body'].read().decode('latin-1').encode('ascii', 'ignore').decode('utf-8'), obj.get('Metadata',
-                                                                                                           {})
-        except:
-            return None, None
+        except ClientError as ex:
+            if resilience.is_not_found(ex):
+                return None, None
+            raise
+        self._validate_cached(key, obj)
+        return obj['Body'].read().decode('ascii', 'ignore'), obj.get('Metadata', {})
 
     def get_subfolders(self, prefix):
         """
@@ -186,42 +858,145 @@ class ConnectorS3:
 
     def check_key_exists(self, key):
 
-        _bucket = self.resource.Bucket(self.bucket)
-
-        objs = list(_bucket.objects.filter(Prefix=key))
-        if len(objs) > 0:
-            Logger.info(message="Key: {} Exists in S3!".format(key))
+        if self.metadata_cache is not None and self.metadata_cache.get(self.bucket, key) is not None:
+            exists = True
+        else:
+            # One key is enough to prove the prefix exists
+            exists = self.client.list_objects_v2(Bucket=self.bucket, Prefix=key, MaxKeys=1).get('KeyCount', 0) > 0
+        if exists:
+            Logger.debug("Key: {} Exists in S3!", key)
             return True
         else:
-            Logger.info(message="Key: {} Doesn't exist in S3!".format(key))
+            Logger.debug("Key: {} Doesn't exist in S3!", key)
             return False
 
     def get_old_keys(self, key, num_days):
 
-        kwargs = {'Bucket': self.bucket, 'Key': key}
-
-        obj = self.client.head_object(**kwargs)
+        last_modified = self._object_metadata(key, need_metadata=False).last_modified
         files = []
-        if str(obj["LastModified"]) < str(datetime.datetime.now() - datetime.timedelta(days=num_days)):
+        if _as_utc(last_modified) < _age_cutoff(num_days):
             files.append(key)
 
         return files
 
     def delete_objects_in_s3(self, key):
 
-        _bucket = self.resource.Bucket(self.bucket)
+        report = self.delete_keys(self.iter_objects(key, fields=('Key', 'Size')))
+        if self.metadata_cache is not None:
+            self.metadata_cache.invalidate_prefix(self.bucket, key)
+        if report['failed']:
+            Logger.warning("Failed to delete {} keys under {}: {}", len(report['failed']), key, report['failed'])
+        return report
 
-        objs = _bucket.objects.filter(Prefix=key)
-        objs.delete()
+    def iter_old_objects(self, prefix, max_age, suffix='', parallel_listing=False):
+        """
+        Stream the objects under a prefix last modified before a cutoff, from the listing alone (no HEAD per key)
+        :param prefix: String: The prefix to list
+        :param max_age: Number of days, timedelta, or datetime cutoff (naive means UTC): Objects modified before
+            now - max_age, or before the cutoff, are selected
+        :param suffix: String: Only select keys ending with this suffix
+        :param parallel_listing: Boolean: List the prefix in shards concurrently, see iter_objects_parallel
+        :return: Generator of (Key, Size, LastModified) namedtuples
+        """
+        cutoff = _age_cutoff(max_age)
+        fields = ('Key', 'Size', 'LastModified')
+        if parallel_listing:
+            records = self.iter_objects_parallel(prefix, suffix=suffix, fields=fields)
+        else:
+            records = self.iter_objects(prefix, suffix=suffix, fields=fields)
+        return (record for record in records if record.LastModified < cutoff)
+
+    def sweep_retention(self, prefix, max_age, suffix='', dry_run=False, max_workers=None, parallel_listing=False):
+        """
+        Delete the objects under a prefix older than max_age, see iter_old_objects and delete_keys
+        :param dry_run: Boolean: Only count what would be deleted
+        :return: Dict: 'deleted' count, 'bytes_freed', 'failed': {key: error message}, 'dry_run'
+        """
+        cutoff = _age_cutoff(max_age)
+        report = self.delete_keys(self.iter_old_objects(prefix, cutoff, suffix=suffix,
+                                                        parallel_listing=parallel_listing),
+                                  dry_run=dry_run, max_workers=max_workers)
+        Logger.info("Retention of s3://{}/{}{} modified before {}: {} {} objects, {} bytes, failed {}", self.bucket,
+                    prefix, '*' + suffix if suffix else '', cutoff.isoformat(timespec='seconds'),
+                    'would delete' if dry_run else 'deleted', report['deleted'], report['bytes_freed'],
+                    len(report['failed']))
+        return report
+
+    def delete_keys(self, objects, dry_run=False, max_workers=None):
+        """
+        Delete many objects with delete_objects, in batches of 1000 sent concurrently. The objects are consumed
+        as they come, so a streamed listing is deleted while it is being listed
+        :param objects: Iterable of Strings (keys) or of records with Key and Size (e.g. iter_objects), the sizes
+            adding up to bytes_freed
+        :param dry_run: Boolean: Only count the objects and their bytes
+        :param max_workers: Integer: Batches deleted concurrently, S3_DELETE_MAX_WORKERS if None
+        :return: Dict: 'deleted' count, 'bytes_freed', 'failed': {key: error message}, 'dry_run'
+        """
+        max_workers = max_workers or setting('S3_DELETE_MAX_WORKERS')
+        report = {'deleted': 0, 'bytes_freed': 0, 'failed': {}, 'dry_run': dry_run}
+
+        def collect(done):
+            for future in done:
+                sizes = in_flight.pop(future)
+                try:
+                    errors = future.result()
+                except Exception as ex:
+                    errors = {key: str(ex) for key in sizes}
+                report['failed'].update(errors)
+                report['deleted'] += len(sizes) - len(errors)
+                report['bytes_freed'] += sum(size for key, size in sizes.items() if key not in errors)
+
+        in_flight = {}
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for batch in _batched(objects, DELETE_BATCH_SIZE):
+                sizes = {obj: 0 for obj in batch} if isinstance(batch[0], str) else {
+                    obj.Key: getattr(obj, 'Size', None) or 0 for obj in batch}
+                if dry_run:
+                    report['deleted'] += len(sizes)
+                    report['bytes_freed'] += sum(sizes.values())
+                    continue
+                # Keep the number of pending batches bounded so huge listings are not queued up front
+                if len(in_flight) >= max_workers * 2:
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    collect(done)
+                in_flight[executor.submit(self._delete_batch, list(sizes))] = sizes
+            while in_flight:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                collect(done)
+        if not dry_run:
+            Logger.metrics.count('s3_deleted_objects_total', report['deleted'], bucket=self.bucket)
+            Logger.metrics.count('s3_deleted_bytes_total', report['bytes_freed'], bucket=self.bucket)
+        return report
+
+    def _delete_batch(self, keys):
+        """
+        :param keys: List of Strings: DELETE_BATCH_SIZE keys at most
+        :return: Dict: {key: error message} of the keys S3 did not delete
+        """
+        response = self.client.delete_objects(Bucket=self.bucket,
+                                              Delete={'Objects': [{'Key': k} for k in keys], 'Quiet': True})
+        self._invalidate_cached_many(keys)
+        return {e['Key']: e.get('Message', e.get('Code')) for e in response.get('Errors', [])}
+
+    def _report_deleted(self, report, keys):
+        """
+        Delete a batch of keys into a copy or sync report: 'deleted' list of keys, 'failed': {key: error}
+        """
+        errors = self._delete_batch(keys)
+        report['failed'].update(errors)
+        report['deleted'].extend(key for key in keys if key not in errors)
 
     def copy_data_from_source_to_destination(self, source_key, destination_key, delete_source=False):
-        for file in self.list_objects(prefix=source_key):
-            self.client.copy_object(CopySource={'Bucket': self.bucket,
-                                                'Key': file},
-                                    Bucket=self.bucket,
-                                    Key=destination_key + '/' + str(file)[str(file).rfind('date_partition'):])
-        if delete_source:
-            self.delete_objects_in_s3(source_key)
+        """
+        Copy (or move) every object under source_key to destination_key, keeping the date_partition part of the keys
+        :param source_key: String: the source prefix
+        :param destination_key: String: the destination prefix
+        :param delete_source: Boolean: delete the sources that were copied
+        :return: Dict: the copy report, see copy_objects
+        """
+        pairs = ((record.Key, destination_key + '/' + record.Key[record.Key.rfind('date_partition'):], record.Size)
+                 for record in self.iter_objects(source_key, fields=('Key', 'Size')))
+        return self.copy_objects(pairs, delete_source=delete_source)
 
     def list_folders_with_files_count_size(self, folder_to_crawl, file_extension):
         # ------------------------------------------------------------------------------------------#
@@ -242,45 +1017,25 @@ class ConnectorS3:
         folder_path_with_number_of_files = {}
         folder_path_with_files_array = {}
         folder_with_size = {}
-        kwargs = {'Bucket': self.bucket}
-        kwargs['Prefix'] = folder_to_crawl
         counter = 0
-        while True:
-            resp = self.client.list_objects_v2(**kwargs)
-            for obj in resp['Contents']:
-                key = obj['Key']
-                if key.endswith(file_extension):
-                    counter += 1
-                    file_size = obj['Size']
-                    file_name = key[(key.rfind('/') + 1):]
-                    key = key[0:key.rfind('/')]
-                    if key in folder_key_with_multiple_files_flag:
-                        folder_key_with_multiple_files_flag[key] = True
-                        if key not in folders_with_multiple_files:
-                            folders_with_multiple_files.append(key)
-                        numer_of_files = folder_path_with_number_of_files[key]
-                        numer_of_files += 1
-                        folder_path_with_number_of_files[key] = numer_of_files
-
-                        files = folder_path_with_files_array[key]
-                        files.append(file_name)
-                        folder_path_with_files_array[key] = files
-
-                        sum_file_size = folder_with_size[key]
-                        sum_file_size += file_size
-                        folder_with_size[key] = sum_file_size
-                    else:
-                        folder_key_with_multiple_files_flag[key] = False
-                        folder_path_with_number_of_files[key] = 1
-                        files = []
-                        files.append(file_name)
-                        folder_path_with_files_array[key] = files
-                        folder_with_size[key] = file_size
-            try:
-                kwargs['ContinuationToken'] = resp['NextContinuationToken']
-            except KeyError:
-                break
-        Logger.info("Total Number of Files:{}".format(counter))
+        for record in self.iter_objects(folder_to_crawl, suffix=file_extension, fields=('Key', 'Size')):
+            counter += 1
+            split_at = record.Key.rfind('/')
+            key = record.Key[0:split_at]
+            file_name = record.Key[split_at + 1:]
+            if key in folder_key_with_multiple_files_flag:
+                if not folder_key_with_multiple_files_flag[key]:
+                    folder_key_with_multiple_files_flag[key] = True
+                    folders_with_multiple_files.append(key)
+                folder_path_with_number_of_files[key] += 1
+                folder_path_with_files_array[key].append(file_name)
+                folder_with_size[key] += record.Size
+            else:
+                folder_key_with_multiple_files_flag[key] = False
+                folder_path_with_number_of_files[key] = 1
+                folder_path_with_files_array[key] = [file_name]
+                folder_with_size[key] = record.Size
+        Logger.info("Total Number of Files:{}", counter)
         return folder_key_with_multiple_files_flag, folders_with_multiple_files, folder_path_with_number_of_files, folder_with_size, folder_path_with_files_array
 
     # ------------------------------------------------------------------------------------------#
@@ -293,25 +1048,13 @@ class ConnectorS3:
     #   5. Suffix = Copy or move only matching files with suffix
     # ------------------------------------------------------------------------------------------#
     def copy_files_inside_folder(self, source, destination, destination_bucket='', delete_source_after_copy=False,
-                                 suffix=''):
+                                 suffix='', max_workers=None):
 
-        if destination_bucket.strip() == '':
-            destination_bucket = self.bucket
+        pairs = ((record.Key, self._copy_destination_key(destination, record.Key), record.Size)
+                 for record in self.iter_objects(source, suffix=suffix, fields=('Key', 'Size')))
 
-        kwargs = {'Bucket': self.bucket, 'Prefix': source}
-
-        resp = self.client.list_objects_v2(**kwargs)
-        files = []
-        for obj in resp['Contents']:
-            key = obj['Key']
-            if suffix is not '':
-                if key.endswith(suffix):
-                    files.append(key)
-            else:
-                files.append(key)
-
-        self.copy_files(destination, files=files, destination_bucket=destination_bucket,
-                        delete_source_after_copy=delete_source_after_copy)
+        return self.copy_objects(pairs, destination_bucket=destination_bucket, delete_source=delete_source_after_copy,
+                                 max_workers=max_workers)
 
     # ------------------------------------------------------------------------------------------#
     # Copy or move file (passed as an argument) within s3.
@@ -321,21 +1064,114 @@ class ConnectorS3:
     #   3. files = An list of s3 location of file to copy or move.
     #   4. destination_bucket = destination bucket name , if pass as empty then default will be source bucket only.
     #   5. delete_source_after_copy = Flag to move or just copy
+    #   6. max_workers = Number of concurrent copies, S3_COPY_MAX_WORKERS if None
+    # Return -
+    #   1. The copy report, see copy_objects
     # ------------------------------------------------------------------------------------------#
     def copy_files(self, destination, source_folder='', files=None, destination_bucket='',
-                   delete_source_after_copy=False):
+                   delete_source_after_copy=False, max_workers=None):
+
+        source_base = source_folder + "/" if source_folder != '' else ''
+        pairs = [(source_base + file, self._copy_destination_key(destination, file)) for file in files or []]
+        return self.copy_objects(pairs, destination_bucket=destination_bucket,
+                                 delete_source=delete_source_after_copy, max_workers=max_workers)
+
+    @staticmethod
+    def _copy_destination_key(destination, file):
+        return destination + '/' + str(file)[str(file).rfind('/') + 1:]
 
+    def copy_objects(self, pairs, destination_bucket='', delete_source=False, max_workers=None):
+        """
+        Copy (or move) many objects concurrently on a bounded thread pool sharing this connector's client.
+        Objects over 5 GB go through a multipart upload_part_copy and sources are deleted in batches of 1000
+        :param pairs: Iterable of (source_key, destination_key) or (source_key, destination_key, size) tuples
+        :param destination_bucket: String: destination bucket name, the source bucket if blank
+        :param delete_source: Boolean: delete the sources that were copied successfully (move)
+        :param max_workers: Integer: number of concurrent copies, S3_COPY_MAX_WORKERS if None
+        :return: Dict: {'copied': [source keys], 'deleted': [source keys], 'failed': {source key: error message}}
+        """
         if destination_bucket.strip() == '':
             destination_bucket = self.bucket
+        max_workers = max_workers or setting('S3_COPY_MAX_WORKERS')
+
+        report = {'copied': [], 'deleted': [], 'failed': {}}
+        to_delete = []
+
+        def collect(done):
+            for future in done:
+                source_key = in_flight.pop(future)
+                try:
+                    future.result()
+                except Exception as ex:
+                    report['failed'][source_key] = str(ex)
+                    continue
+                report['copied'].append(source_key)
+                if delete_source:
+                    to_delete.append(source_key)
+                    if len(to_delete) >= DELETE_BATCH_SIZE:
+                        self._report_deleted(report, to_delete[:DELETE_BATCH_SIZE])
+                        del to_delete[:DELETE_BATCH_SIZE]
+
+        in_flight = {}
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for pair in pairs:
+                source_key, destination_key = pair[0], pair[1]
+                size = pair[2] if len(pair) > 2 else None
+                # Keep the number of pending copies bounded so huge listings are not queued up front
+                if len(in_flight) >= max_workers * 2:
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    collect(done)
+                future = executor.submit(self._copy_one, source_key, destination_bucket, destination_key, size)
+                in_flight[future] = source_key
+            while in_flight:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                collect(done)
 
-        if files:
-            for file in files:
-                self.client.copy_object(CopySource={'Bucket': self.bucket,
-                                                    'Key': (source_folder + "/" if source_folder != '' else '') + file},
+        for start in range(0, len(to_delete), DELETE_BATCH_SIZE):
+            self._report_deleted(report, to_delete[start:start + DELETE_BATCH_SIZE])
+
+        Logger.info("Copied {} objects, deleted {}, failed {}", len(report['copied']), len(report['deleted']),
+                    len(report['failed']))
+        return report
+
+    def _copy_one(self, source_key, destination_bucket, destination_key, size=None):
+        if size is None or size <= MAX_COPY_OBJECT_SIZE:
+            try:
+                self.client.copy_object(CopySource={'Bucket': self.bucket, 'Key': source_key},
                                         Bucket=destination_bucket,
-                                        Key=destination + '/' + str(file)[str(file).rfind('/') + 1:])
-                if delete_source_after_copy:
-                    self.delete_object((source_folder + "/" if source_folder != '' else '') + file)
+                                        Key=destination_key)
+                self._invalidate_cached(destination_key, destination_bucket)
+                return
+            except ClientError as ex:
+                # Without a known size we only find out the object is too big when copy_object rejects it
+                if size is not None or ex.response.get('Error', {}).get('Code') != 'InvalidRequest':
+                    raise
+        self._multipart_copy(source_key, destination_bucket, destination_key)
+
+    def _multipart_copy(self, source_key, destination_bucket, destination_key):
+        head = self.client.head_object(Bucket=self.bucket, Key=source_key)
+        size = head['ContentLength']
+        create_kwargs = {'Bucket': destination_bucket, 'Key': destination_key, 'Metadata': head.get('Metadata', {})}
+        if 'ContentType' in head:
+            create_kwargs['ContentType'] = head['ContentType']
+        upload_id = self.client.create_multipart_upload(**create_kwargs)['UploadId']
+        try:
+            parts = []
+            for part_number, start in enumerate(range(0, size, MULTIPART_COPY_PART_SIZE), start=1):
+                end = min(start + MULTIPART_COPY_PART_SIZE, size) - 1
+                response = self.client.upload_part_copy(Bucket=destination_bucket,
+                                                        Key=destination_key,
+                                                        CopySource={'Bucket': self.bucket, 'Key': source_key},
+                                                        CopySourceRange='bytes={}-{}'.format(start, end),
+                                                        PartNumber=part_number,
+                                                        UploadId=upload_id)
+                parts.append({'ETag': response['CopyPartResult']['ETag'], 'PartNumber': part_number})
+            self.client.complete_multipart_upload(Bucket=destination_bucket, Key=destination_key, UploadId=upload_id,
+                                                  MultipartUpload={'Parts': parts})
+            self._invalidate_cached(destination_key, destination_bucket)
+        except Exception:
+            self.client.abort_multipart_upload(Bucket=destination_bucket, Key=destination_key, UploadId=upload_id)
+            raise
 
     def read_json(self, key):
         """
@@ -343,15 +1179,56 @@ class ConnectorS3:
         :param key: String: The S3 key of the file
         :return: Dict: A JSON object containing the file contents
         """
-        return json.loads(self.get_object(key))
+        with self.open_object(key) as fp:
+            return json.load(io.TextIOWrapper(fp, encoding='utf-8'))
 
-    def write_json(self, json_obj, key):
+    def iter_json(self, key, chunk_size=STREAM_CHUNK_SIZE):
+        """
+        Incrementally parse a file on S3 holding a sequence of JSON documents (JSON lines or concatenated JSON),
+        holding at most one document plus one chunk of text in memory
+        :param key: String: The S3 key of the file
+        :param chunk_size: Integer: Size of the chunks read from S3 in bytes
+        :return: Generator of the decoded JSON documents
+        """
+        decoder = json.JSONDecoder()
+        with io.TextIOWrapper(self.open_object(key, buffer_size=chunk_size), encoding='utf-8') as fp:
+            text = ''
+            read_size = chunk_size
+            while True:
+                chunk = fp.read(read_size)
+                text = (text + chunk).lstrip()
+                read_size = chunk_size
+                while text:
+                    try:
+                        document, end = decoder.raw_decode(text)
+                    except ValueError:
+                        # Incomplete document, read a bigger chunk next so large documents are not re-copied per chunk
+                        if not chunk:
+                            raise
+                        read_size = max(read_size, len(text))
+                        break
+                    if chunk and text[0] not in '{["' and (end == len(text) or text[end] in _NUMBER_CHARS):
+                        # A number may go on in the next chunk: 12|345 is 12345, not 12 then 345
+                        break
+                    yield document
+                    text = text[end:].lstrip()
+                if not chunk:
+                    return
+
+    def write_json(self, json_obj, key, dedup=False, stream=False):
         """
         Write a json file to S3
         :param json_obj: Dict: A JSON object
         :param key: String: The key under which to save the file
+        :param dedup: Boolean: Skip the upload if the object already holds the same document, see put_object
+        :param stream: Boolean: Encode the document piece by piece into a multipart upload instead of as a whole,
+            for documents too large to hold encoded in memory. The pure Python encoder is much slower, and dedup
+            does not apply
+        :return: Boolean: False if the upload was skipped
         """
-        self.put_object(json.dumps(json_obj), key)
+        if stream:
+            return self.put_object(json.JSONEncoder().iterencode(json_obj), key, dedup=dedup)
+        return self.put_object(json.dumps(json_obj), key, dedup=dedup)
 
     def create_folder(self, folder_name_with_path):
         """
@@ -360,27 +1237,37 @@ class ConnectorS3:
         :return:
         """
         self.client.put_object(Bucket=self.bucket, Key=folder_name_with_path, ACL='bucket-owner-full-control')
+        self._invalidate_cached(folder_name_with_path)
 
     def delete_folder(self, folder_name_with_path):
         """
-        Create a folder
+        Delete every object under a folder
         :param folder_name_with_path:
-        :return:
+        :return: Dict: The delete_keys report
         """
-        if self.check_key_exists(folder_name_with_path):
-            keys = self.list_objects(folder_name_with_path + "/")
-            for key in keys:
-                Logger.info("key to delete:{}".format(key))
-                self.delete_object(key)
+        # The listing is streamed straight into parallel delete_objects batches
+        report = self.delete_keys(self.iter_objects(folder_name_with_path + "/", fields=('Key', 'Size')))
+        if report['failed']:
+            Logger.warning("Failed to delete {} keys under {}: {}", len(report['failed']), folder_name_with_path,
+                           report['failed'])
+        Logger.info("Deleted {} keys under {}, {} bytes", report['deleted'], folder_name_with_path,
+                    report['bytes_freed'])
+        return report
 
-    def download(self, key, filename):
+    def download(self, key, filename, transfer_config=None, metrics=None):
         """
         Download a file from S3 to local disk
         :param key: String: the key on S3
         :param filename: String: The filename on local
+        :param transfer_config: Dict: part_size, max_concurrency, max_bandwidth and multipart_threshold overrides
+        :param metrics: TransferMetrics: Receives the progress of the download
         :return: the local filename
         """
-        self.resource.Bucket(self.bucket).download_file(key, filename)
+        self.resource.Bucket(self.bucket).download_file(key, filename,
+                                                        Config=build_transfer_config(**(transfer_config or {})),
+                                                        Callback=metrics)
+        if metrics is not None:
+            metrics.finish()
         return filename
 
     def get_object_metadata(self, key):
@@ -388,8 +1275,7 @@ class ConnectorS3:
         Get the metadata from an S3 object
         :return: Dict: metadata from S3
         """
-        obj = self.client.get_object(Bucket=self.bucket, Key=key)
-        return obj.get('Metadata', {})
+        return self._object_metadata(key).metadata
 
 
 
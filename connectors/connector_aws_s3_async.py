@@ -0,0 +1,238 @@
+import asyncio
+import json
+
+from botocore.exceptions import ClientError
+
+from src.lib.connectors import client_pool, resilience
+from src.lib.connectors.connector_aws_s3 import MAX_COPY_OBJECT_SIZE, MULTIPART_COPY_PART_SIZE, DELETE_BATCH_SIZE
+from src.lib.connectors.settings import setting
+from src.lib.logs.logger import Logger
+
+
+class AsyncConnectorS3:
+    """
+    asyncio flavour of ConnectorS3 for high fan-out workloads, built on aiobotocore. Every call is awaited on the
+    event loop instead of holding a thread, and max_concurrency bounds the number of requests in flight.
+    Use it as an async context manager so the underlying HTTP connection pool gets closed:
+
+        async with AsyncConnectorS3('bucket') as s3:
+            contents = await asyncio.gather(*(s3.get_object(key) for key in keys))
+    """
+
+    def __init__(self, bucket, endpoint_url=None, max_concurrency=None, max_pool_connections=None):
+        """
+        :param bucket: String: The bucket this connector works on
+        :param endpoint_url: String: The S3 endpoint, S3_ENDPOINT if None
+        :param max_concurrency: Integer: Requests in flight at once, S3_ASYNC_MAX_CONCURRENCY if None
+        :param max_pool_connections: Integer: Size of the HTTP connection pool, S3_ASYNC_MAX_POOL_CONNECTIONS if None
+        """
+        self.bucket = bucket
+        self.bucket_base = 's3a://{}/'.format(self.bucket)
+        self.max_concurrency = max_concurrency or setting('S3_ASYNC_MAX_CONCURRENCY')
+        self.max_pool_connections = max_pool_connections or setting('S3_ASYNC_MAX_POOL_CONNECTIONS')
+        endpoint_url = endpoint_url or setting('S3_ENDPOINT')
+        self.params = {'endpoint_url': endpoint_url}
+        if 'local' in endpoint_url:
+            self.params['aws_access_key_id'] = 'foo'
+            self.params['aws_secret_access_key'] = 'bar'
+        self.client = None
+        self._client_context = None
+        self._semaphore = None
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def open(self):
+        if self.client is None:
+            # aiobotocore is imported with the first client, not with the connector
+            from aiobotocore.config import AioConfig
+            from aiobotocore.session import get_session
+
+            config = AioConfig(max_pool_connections=self.max_pool_connections,
+                               retries=client_pool.NO_BOTOCORE_RETRIES)
+            self._client_context = get_session().create_client('s3', config=config, **self.params)
+            self.client = client_pool.instrument_client(await self._client_context.__aenter__())
+            resilience.for_endpoint('s3', self.client.meta.endpoint_url).attach_async(self.client)
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+    async def close(self):
+        if self._client_context is not None:
+            await self._client_context.__aexit__(None, None, None)
+            self.client = None
+            self._client_context = None
+
+    async def _call(self, operation, **kwargs):
+        await self.open()
+        async with self._semaphore:
+            return await getattr(self.client, operation)(**kwargs)
+
+    async def get_object(self, key):
+        """
+        Get content of a file on S3
+        :param key: String: The S3 key of the file
+        :return: String: A string holding the file contents, None if key not found
+        """
+        try:
+            response = await self._call('get_object', Bucket=self.bucket, Key=key)
+            async with self._semaphore:
+                async with response['Body'] as body:
+                    return (await body.read()).decode('utf-8')
+        except ClientError as ex:
+            if resilience.is_not_found(ex):
+                return None
+            raise
+
+    async def put_object(self, object, key, metadata=None):
+        """
+        Put data as a file on S3
+        :param object: String: A String containing the data to write
+        :param key: String: The key under which to put the data
+        :param metadata: Dict: metadata to pass to the object
+        """
+        kwargs = {'Bucket': self.bucket, 'Key': key, 'Body': object, 'ACL': 'bucket-owner-full-control'}
+        if metadata:
+            kwargs['Metadata'] = metadata
+        await self._call('put_object', **kwargs)
+
+    async def delete_object(self, key):
+        """
+        Delete the object(s) with the given key(s) from S3, in batches of 1000 for a list of keys
+        :param key: String or List of Strings: The key(s) of the object(s) to delete
+        """
+        Logger.debug("Deleting files:{}", key)
+        if type(key) == str:
+            await self._call('delete_object', Bucket=self.bucket, Key=key)
+        else:
+            keys = list(key)
+            await asyncio.gather(*(self._delete_batch(keys[start:start + DELETE_BATCH_SIZE])
+                                   for start in range(0, len(keys), DELETE_BATCH_SIZE)))
+
+    async def _delete_batch(self, keys):
+        response = await self._call('delete_objects', Bucket=self.bucket,
+                                    Delete={'Objects': [{'Key': k} for k in keys], 'Quiet': True})
+        return {e['Key']: e.get('Message', e.get('Code')) for e in response.get('Errors', [])}
+
+    async def iter_objects(self, prefix, suffix='', start_after=None):
+        """
+        Stream the objects under a prefix, one list_objects_v2 page at a time
+        :param prefix: String: The prefix to list
+        :param suffix: String: Only yield keys ending with this suffix
+        :param start_after: String: Only yield keys sorting after this key
+        :return: Async generator of the list_objects_v2 entries (dicts with Key, Size, LastModified, ETag)
+        """
+        kwargs = {'Bucket': self.bucket, 'Prefix': prefix}
+        if start_after:
+            kwargs['StartAfter'] = start_after
+        while True:
+            page = await self._call('list_objects_v2', **kwargs)
+            for obj in page.get('Contents', ()):
+                if obj['Key'].endswith(suffix):
+                    yield obj
+            if not page.get('IsTruncated'):
+                return
+            kwargs['ContinuationToken'] = page['NextContinuationToken']
+
+    async def list_objects(self, prefix, limit=None, give_size=False, suffix=''):
+        """
+        List the keys of all objects in a given layer
+        :param prefix: String: The name of the layer
+        :param limit: Integer: limit the number of files returned, if None or 0: no limit
+        :param give_size: Boolean: Also return the size of the files listed in bytes
+        :param suffix: String: Only list keys ending with this suffix
+        :return: List of Strings or (List of Strings, int): A list of keys and if give_size=True, also an integer in bytes
+        """
+        objects = []
+        total_size = 0
+        async for obj in self.iter_objects(prefix, suffix=suffix):
+            if limit and len(objects) >= limit:
+                break
+            objects.append(obj['Key'])
+            total_size += obj['Size']
+        if give_size:
+            return objects, total_size
+        return objects
+
+    async def copy_files(self, destination, source_folder='', files=None, destination_bucket='',
+                         delete_source_after_copy=False):
+        """
+        Copy or move files concurrently, see ConnectorS3.copy_files
+        :return: Dict: {'copied': [source keys], 'deleted': [source keys], 'failed': {source key: error message}}
+        """
+        if destination_bucket.strip() == '':
+            destination_bucket = self.bucket
+        source_base = source_folder + "/" if source_folder != '' else ''
+        pairs = [(source_base + file, destination + '/' + str(file)[str(file).rfind('/') + 1:]) for file in files or []]
+
+        results = await asyncio.gather(*(self._copy_one(source, destination_bucket, target) for source, target in pairs),
+                                       return_exceptions=True)
+        report = {'copied': [], 'deleted': [], 'failed': {}}
+        for (source, _), result in zip(pairs, results):
+            if isinstance(result, Exception):
+                report['failed'][source] = str(result)
+            else:
+                report['copied'].append(source)
+
+        if delete_source_after_copy and report['copied']:
+            copied = report['copied']
+            batches = [copied[start:start + DELETE_BATCH_SIZE] for start in range(0, len(copied), DELETE_BATCH_SIZE)]
+            for batch, errors in zip(batches, await asyncio.gather(*(self._delete_batch(b) for b in batches))):
+                report['failed'].update(errors)
+                report['deleted'].extend(k for k in batch if k not in errors)
+        Logger.info("Copied {} objects, deleted {}, failed {}", len(report['copied']), len(report['deleted']),
+                    len(report['failed']))
+        return report
+
+    async def _copy_one(self, source_key, destination_bucket, destination_key):
+        try:
+            await self._call('copy_object', CopySource={'Bucket': self.bucket, 'Key': source_key},
+                             Bucket=destination_bucket, Key=destination_key)
+            return
+        except ClientError as ex:
+            # copy_object rejects sources over 5 GB, those go through upload_part_copy
+            if ex.response.get('Error', {}).get('Code') != 'InvalidRequest':
+                raise
+            head = await self._call('head_object', Bucket=self.bucket, Key=source_key)
+            if head['ContentLength'] <= MAX_COPY_OBJECT_SIZE:
+                raise
+        await self._multipart_copy(source_key, destination_bucket, destination_key, head)
+
+    async def _multipart_copy(self, source_key, destination_bucket, destination_key, head):
+        size = head['ContentLength']
+        upload_id = (await self._call('create_multipart_upload', Bucket=destination_bucket, Key=destination_key,
+                                      Metadata=head.get('Metadata', {})))['UploadId']
+        try:
+            ranges = [(number, start, min(start + MULTIPART_COPY_PART_SIZE, size) - 1)
+                      for number, start in enumerate(range(0, size, MULTIPART_COPY_PART_SIZE), start=1)]
+            responses = await asyncio.gather(*(
+                self._call('upload_part_copy', Bucket=destination_bucket, Key=destination_key,
+                           CopySource={'Bucket': self.bucket, 'Key': source_key},
+                           CopySourceRange='bytes={}-{}'.format(start, end), PartNumber=number, UploadId=upload_id)
+                for number, start, end in ranges))
+            parts = [{'ETag': response['CopyPartResult']['ETag'], 'PartNumber': number}
+                     for (number, _, _), response in zip(ranges, responses)]
+            await self._call('complete_multipart_upload', Bucket=destination_bucket, Key=destination_key,
+                             UploadId=upload_id, MultipartUpload={'Parts': parts})
+        except Exception:
+            await self._call('abort_multipart_upload', Bucket=destination_bucket, Key=destination_key,
+                             UploadId=upload_id)
+            raise
+
+    async def read_json(self, key):
+        """
+        Read a JSON file from S3
+        :param key: String: The S3 key of the file
+        :return: Dict: A JSON object containing the file contents
+        """
+        return json.loads(await self.get_object(key))
+
+    async def write_json(self, json_obj, key):
+        """
+        Write a json file to S3
+        :param json_obj: Dict: A JSON object
+        :param key: String: The key under which to save the file
+        """
+        await self.put_object(json.dumps(json_obj), key)
@@ -1,5 +1,8 @@
-import csv, json
+import csv, json, os
 
+from src.lib.connectors.columnar import (open_text, record_batches, local_sink, dataframe_chunks, output_format_of,
+                                         PartitionedParquetWriter, PARQUET_BATCH_ROWS, DATAFRAME_CHUNK_ROWS)
+from src.lib.connectors.csv_reader import CsvReader
 from src.lib.logs.logger import Logger
 
 #from setup import configs
@@ -11,8 +14,12 @@ class ConnectorFile:
         self.working_dir = working_dir
 
     def read_csv_to_dict(self, file_name):
+        """
+        Read a whole CSV file
+        :return: List of Dicts: The rows, keyed on the header. Use read_csv to stream large files instead
+        """
         file_path = '{}/{}'.format(self.working_dir, file_name)
-        with open(file_path, mode='r', encoding="utf-8") as csv_file:
+        with open(file_path, mode='r', encoding="utf-8", newline='') as csv_file:
             csv_reader = csv.DictReader(csv_file)
             rows = list(csv_reader)
             totalrows = len(rows)
@@ -20,7 +27,17 @@ class ConnectorFile:
             message = 'Processed {} lines.'.format(totalrows)
             Logger.info(message=message)
 
-            return csv_reader
+            return rows
+
+    def read_csv(self, file_name, use_mmap=None, **kwargs):
+        """
+        Streaming reader over a CSV file: rows as tuples/namedtuples/dicts, typed column batches or a row count,
+        parsed lazily. Large files are read through a memory map. ConnectorS3.read_csv reads objects the same way
+        :param use_mmap: Boolean: Read through a memory map, if None only for large files
+        :param kwargs: CsvReader arguments (encoding, fieldnames, delimiter...)
+        :return: CsvReader
+        """
+        return CsvReader.from_path('{}/{}'.format(self.working_dir, file_name), use_mmap=use_mmap, **kwargs)
 
 
     def save_dict_to_jsonfile(self, data, file_name):
@@ -29,42 +46,102 @@ class ConnectorFile:
             with open(file_path, 'w', encoding="utf-8") as fp:
                 json.dump(data, fp)
             return file_path
-        except Exception as ex:
-            print(ex)
+        except Exception:
+            Logger.error('Could not write {}', file_path, exc_info=True)
             return None
 
-    def save_dict_to_csvfile(self, data, file_name, fieldnames):
+    def save_dict_to_csvfile(self, data, file_name, fieldnames, compression=None):
+        """
+        :param compression: String: 'gzip', 'bz2' or 'xz' to compress on the fly, None for plain CSV
+        """
         file_path = '{}/{}'.format(self.working_dir, file_name)
         #file_path = '{}/{}'.format('./static', file_name)
 
         try:
-            with open(file_path, 'w+', encoding="utf-8") as fp:
+            with open_text(file_path, 'w', compression) as fp:
                 fieldnames = fieldnames
                 writer = csv.DictWriter(fp, fieldnames=fieldnames)
                 writer.writeheader()
                 for line in data:
                     writer.writerow(line)
             return file_path
-        except Exception as ex:
-            print(ex)
+        except Exception:
+            Logger.error('Could not write {}', file_path, exc_info=True)
             return None
 
-    def save_df_to_csvfile(self, data, file_name, fieldnames):
+    def save_rows_to_jsonlfile(self, rows, file_name, compression=None):
+        """
+        Write rows as JSON lines, one JSON document per line
+        :param rows: Iterable of Dicts
+        :param compression: String: 'gzip', 'bz2' or 'xz' to compress on the fly, None for plain text
+        :return: String: The path of the file
+        """
         file_path = '{}/{}'.format(self.working_dir, file_name)
-
         try:
-            with open(file_path, 'w+', encoding="utf-8") as fp:
-                fieldnames = fieldnames
-                writer = csv.DictWriter(fp, fieldnames=fieldnames)
-                writer.writeheader()
-                for c_index, c_row in data.iterrows():
-                    data_line = c_row.to_dict()
-                    writer.writerow(data_line)
-            return file_path
-        except Exception as ex:
-            print(ex)
+            with open_text(file_path, 'w', compression) as fp:
+                for row in rows:
+                    fp.write(json.dumps(row))
+                    fp.write('\n')
+        except Exception:
+            Logger.error('Could not write {}', file_path, exc_info=True)
+            raise
+        return file_path
+
+    def save_rows_to_parquet(self, rows, dir_name, fieldnames, partition_cols=None, compression='snappy',
+                             batch_rows=PARQUET_BATCH_ROWS, schema=None):
+        """
+        Write rows as a Parquet dataset, built as Arrow record batches of batch_rows rows and optionally split into
+        Hive style partitions (dir_name/status=Done/part-00000.parquet). Needs pyarrow
+        :param rows: Iterable of tuples in fieldnames order, or of column batches (Dicts: name -> list of values)
+        :param dir_name: String: The dataset directory, under the working dir
+        :param fieldnames: List of Strings: The column names
+        :param partition_cols: List of Strings: Columns to partition on, None for no partitioning
+        :param compression: String: 'snappy', 'gzip', 'zstd', 'brotli', 'lz4' or 'none'
+        :param batch_rows: Integer: Rows per record batch
+        :param schema: pyarrow.Schema: Column types, inferred from the first batch if None
+        :return: List of Strings: The paths of the files written
+        """
+        root = '{}/{}'.format(self.working_dir, dir_name)
+        with PartitionedParquetWriter(local_sink(root), partition_cols=partition_cols,
+                                      compression=compression) as writer:
+            for batch in record_batches(rows, fieldnames, batch_rows=batch_rows, schema=schema):
+                writer.write(batch)
+        Logger.info('Wrote {} rows in {} files.', writer.rows, len(writer.files))
+        return [os.path.join(root, path) for path in writer.files]
+
+    def save_df_to_csvfile(self, data, file_name, fieldnames, compression=None):
+        """
+        Write the fieldnames columns of a DataFrame as CSV, serialized in vectorized chunks, see save_df
+        :return: String: The path of the file, None on error
+        """
+        try:
+            return self.save_df(data.reindex(columns=fieldnames), file_name, output_format='csv',
+                                compression=compression)
+        except Exception:
+            # Logged by save_df
             return None
 
+    def save_df(self, data, file_name, output_format=None, compression=None, chunk_rows=DATAFRAME_CHUNK_ROWS):
+        """
+        Write a DataFrame as CSV, JSON lines or Parquet, chunk_rows rows at a time with vectorized serialization,
+        optionally compressed on the fly. The index is left out
+        :param data: pandas.DataFrame
+        :param file_name: String: The file name under the working dir
+        :param output_format: String: 'csv', 'jsonl' or 'parquet', from the file extension if None
+        :param compression: String: 'gzip', 'bz2' or 'xz' for CSV/JSON lines, a Parquet codec ('snappy' if None)
+        :param chunk_rows: Integer: Rows serialized at a time
+        :return: String: The path of the file
+        """
+        file_path = '{}/{}'.format(self.working_dir, file_name)
+        try:
+            with open(file_path, 'wb') as fp:
+                for chunk in dataframe_chunks(data, output_format or output_format_of(file_name),
+                                              compression=compression, chunk_rows=chunk_rows):
+                    fp.write(chunk.encode('utf-8') if isinstance(chunk, str) else chunk)
+        except Exception:
+            Logger.error('Could not write {}', file_path, exc_info=True)
+            raise
+        return file_path
 
     def get_working_dir(self):
         return self.working_dir
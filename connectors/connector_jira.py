@@ -1,40 +1,119 @@
 # coding=utf-8
-from atlassian import Jira
-from setup import configs
+from concurrent.futures import ThreadPoolExecutor
+
+from src.lib.connectors import client_pool, resilience
+from src.lib.connectors.settings import setting
+from src.lib.logs.logger import Logger
 
 
 class ConnectorJIRA:
 
-    def __init__(self, endpoint_url=configs.get('JIRA_ENDPOINT', 'http://localhost:8080')
+    def __init__(self, endpoint_url=None
                  , username='admin'
                  , password='admin'):
-        try:
-            self.client = Jira(url=endpoint_url
-                               , username=username
-                               , password=password)
-        except ValueError:
-            raise
+        # The Jira client is built on first use, over an HTTP session pooled per (endpoint, user).
+        # endpoint_url defaults to JIRA_ENDPOINT
+        self.endpoint_url = endpoint_url or setting('JIRA_ENDPOINT')
+        self.username = username
+        self.password = password
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            # atlassian (and requests under it) is imported with the first client, not with the connector
+            from atlassian import Jira
 
-    def execute_jql_todict(self, string_jql, expand=None):
+            self._client = Jira(url=self.endpoint_url
+                                , username=self.username
+                                , password=self.password
+                                , session=client_pool.get_http_session(self.endpoint_url, self.username,
+                                                                       service='jira'))
+        return self._client
+
+    def execute_jql_todict(self, string_jql, expand=None, fields='*all'):
+        """
+        :return: Dict: The issues matching the query in one search result, None if Jira answers 404
+        """
         try:
-            data = self.client.jql(string_jql, '*all', 0, None, expand)
-            return data
+            # Paged, so large projects are not cut at the server's maxResults
+            issues = list(self.iter_issues(string_jql, fields=fields, expand=expand))
+            return {'startAt': 0, 'maxResults': len(issues), 'total': len(issues), 'issues': issues}
         except Exception as ex:
-            print(ex)  #TODO: Logging
-            return None
+            return _not_found(ex)
+
+    def count_issues(self, string_jql):
+        """
+        Number of issues matching a JQL query, without fetching any of them
+        """
+        return self.client.jql(string_jql, ['key'], 0, 0)['total']
+
+    def iter_issues(self, string_jql, fields='*all', expand=None, page_size=None, max_workers=None):
+        """
+        Stream the issues matching a JQL query. The first page gives the total and the page size the server
+        actually honours, the remaining startAt/maxResults pages are then fetched in parallel over the pooled
+        HTTP session and yielded in order. Add an ORDER BY to the query so pages stay stable during the extraction
+        :param string_jql: String: The JQL query
+        :param fields: String or List of Strings: The fields to fetch, e.g. ['summary', 'status'], '*all' for all
+        :param expand: String: Entities to expand, e.g. 'changelog'
+        :param page_size: Integer: Issues per request, JIRA_PAGE_SIZE if None
+        :param max_workers: Integer: Pages fetched concurrently, JIRA_MAX_WORKERS if None
+        :return: Generator of issue dicts
+        """
+        page_size = page_size or setting('JIRA_PAGE_SIZE')
+        max_workers = max_workers or setting('JIRA_MAX_WORKERS')
+
+        first = self.client.jql(string_jql, fields, 0, page_size, expand)
+        yield from first.get('issues', [])
+        total = first.get('total', 0)
+        # The server caps maxResults, keep to the page size it answered with
+        page_size = min(page_size, first.get('maxResults') or page_size)
+        starts = range(len(first.get('issues', [])), total, page_size)
+        if not starts:
+            return
+
+        def fetch(start):
+            return self.client.jql(string_jql, fields, start, page_size, expand).get('issues', [])
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            in_flight = []
+            starts = iter(starts)
+            # Keep a bounded window of pages in flight, consumed in order
+            for start in starts:
+                in_flight.append(executor.submit(fetch, start))
+                if len(in_flight) >= max_workers * 2:
+                    break
+            while in_flight:
+                issues = in_flight.pop(0).result()
+                next_start = next(starts, None)
+                if next_start is not None:
+                    in_flight.append(executor.submit(fetch, next_start))
+                yield from issues
 
     def get_all_agile_boards(self, board_name=None):
+        """
+        :return: Dict: The boards, None if Jira answers 404
+        """
         try:
             data = self.client.get_all_agile_boards(board_name)
             return data
         except Exception as ex:
-            print(ex)  #TODO: Logging
-            return None
+            return _not_found(ex)
 
     def get_all_sprint(self, board_id=None):
+        """
+        :return: Dict: The sprints of the board, None if the board does not exist
+        """
         try:
             data = self.client.get_all_sprint(board_id)
             return data
         except Exception as ex:
-            print(ex)  #TODO: Logging
-            return None
+            return _not_found(ex)
+
+
+def _not_found(error):
+    # Throttled and failing requests were retried by the session already, what is left is raised
+    if resilience.is_not_found(error):
+        return None
+    Logger.error('Jira request failed: {!r}', error)
+    raise error
@@ -0,0 +1,222 @@
+"""
+Streaming CSV reader over local files (memory-mapped when large) and S3 objects (through ConnectorS3.open_object)
+behind one interface. Rows are parsed lazily and never kept, every method opens the source again so the
+same reader can count, then iterate.
+"""
+import array
+import codecs
+import collections
+import csv
+import io
+import mmap
+import os
+
+CSV_BATCH_ROWS = 65536
+# Local files from this size are read through a memory map instead of read() calls
+MMAP_THRESHOLD = 64 * 1024 ** 2
+MMAP_BLOCK_SIZE = 4 * 1024 ** 2
+# array typecodes for the column types of iter_column_batches. Missing float values are NaN, missing bool values False,
+# a missing int value turns the column of its batch into a list holding None
+_TYPECODES = {int: 'q', float: 'd', bool: 'b'}
+
+
+class CsvReader:
+    """
+    Lazy CSV reader. The first line is the header unless fieldnames are given:
+
+        reader = CsvReader.from_path('issues.csv')
+        total = reader.count_rows()
+        for issue in reader.iter_rows(named=True):
+            ...
+        for batch in reader.iter_column_batches(types={'id': int, 'points': float}):
+            batch['points']  # array.array('d'), or a NumPy array with as_numpy=True
+    """
+
+    def __init__(self, open_text, fieldnames=None, **fmtparams):
+        """
+        :param open_text: Callable returning a new text file object (or closeable iterable of lines) over the data,
+            closed after each pass
+        :param fieldnames: List of Strings: The column names, if the data has no header line
+        :param fmtparams: csv.reader formatting parameters (delimiter, quotechar, dialect...)
+        """
+        self.open_text = open_text
+        self.fmtparams = fmtparams
+        self._fieldnames = list(fieldnames) if fieldnames is not None else None
+        self._has_header = fieldnames is None
+
+    @classmethod
+    def from_path(cls, file_path, use_mmap=None, encoding='utf-8', **kwargs):
+        """
+        :param use_mmap: Boolean: Read through a memory map, if None only for files of MMAP_THRESHOLD or more
+        """
+        if use_mmap is None:
+            use_mmap = os.path.getsize(file_path) >= MMAP_THRESHOLD
+        if use_mmap:
+            return cls(lambda: _MappedLines(file_path, encoding), **kwargs)
+        return cls(lambda: open(file_path, 'r', encoding=encoding, newline=''), **kwargs)
+
+    @classmethod
+    def from_s3(cls, conn_s3, key, encoding='utf-8', **kwargs):
+        """
+        :param conn_s3: ConnectorS3: The connector of the bucket holding the object
+        """
+        return cls(lambda: io.TextIOWrapper(conn_s3.open_object(key), encoding=encoding, newline=''), **kwargs)
+
+    @property
+    def fieldnames(self):
+        if self._fieldnames is None:
+            with self._open() as rows:
+                self._fieldnames = next(rows, [])
+        return self._fieldnames
+
+    def iter_rows(self, named=False):
+        """
+        :param named: Boolean: Yield namedtuples (invalid column names are renamed _0, _1...) instead of tuples
+        :return: Generator of tuples, short rows padded with None and long rows cut to the header
+        """
+        width = len(self.fieldnames)
+        make = collections.namedtuple('Row', self.fieldnames, rename=True)._make if named else tuple
+        with self._open() as rows:
+            if self._has_header:
+                next(rows, None)
+            for row in rows:
+                if not row:
+                    continue
+                if len(row) != width:
+                    row = (row + [None] * width)[:width]
+                yield make(row)
+
+    def iter_dicts(self):
+        """
+        :return: Generator of Dicts, like csv.DictReader
+        """
+        fieldnames = self.fieldnames
+        for row in self.iter_rows():
+            yield dict(zip(fieldnames, row))
+
+    def iter_column_batches(self, batch_rows=CSV_BATCH_ROWS, types=None, columns=None, as_numpy=False):
+        """
+        Rows transposed into column batches of batch_rows rows. Numeric columns are packed into array.array
+        (8 bytes a value instead of a Python object), other columns are lists of strings. In typed columns empty
+        fields and the padding of short rows are None (NaN in float columns, False in bool columns), an int column
+        with a missing value is a list in that batch
+        :param batch_rows: Integer: Rows per batch
+        :param types: Dict: column name -> int, float, bool or a callable; untyped columns stay strings
+        :param columns: List of Strings: The columns to return, all if None
+        :param as_numpy: Boolean: Return NumPy arrays (zero-copy over the array.array buffers)
+        :return: Generator of Dicts: column name -> array
+        """
+        types = types or {}
+        fieldnames = self.fieldnames
+        columns = list(columns or fieldnames)
+        indices = [fieldnames.index(column) for column in columns]
+        converters = [_column_converter(types.get(column)) for column in columns]
+        typecodes = [_TYPECODES.get(types.get(column)) for column in columns]
+
+        def new_batch():
+            return [array.array(typecode) if typecode else [] for typecode in typecodes]
+
+        batch = new_batch()
+        count = 0
+        positions = list(zip(range(len(columns)), indices, converters))
+        for row in self.iter_rows():
+            for position, index, convert in positions:
+                value = convert(row[index])
+                try:
+                    batch[position].append(value)
+                except TypeError:
+                    # None in a packed column
+                    batch[position] = batch[position].tolist() + [value]
+            count += 1
+            if count == batch_rows:
+                yield self._finish_batch(columns, batch, as_numpy)
+                batch = new_batch()
+                count = 0
+        if count:
+            yield self._finish_batch(columns, batch, as_numpy)
+
+    def count_rows(self):
+        """
+        :return: Integer: The number of data rows, counted without keeping any
+        """
+        count = 0
+        for _ in self.iter_rows():
+            count += 1
+        return count
+
+    @staticmethod
+    def _finish_batch(columns, batch, as_numpy):
+        if as_numpy:
+            import numpy
+            batch = [numpy.frombuffer(values, dtype='?' if values.typecode == 'b' else values.typecode)
+                     if isinstance(values, array.array)
+                     else numpy.array(values, dtype=object) for values in batch]
+        return dict(zip(columns, batch))
+
+    def _open(self):
+        return _Rows(self.open_text(), self.fmtparams)
+
+
+class _Rows:
+    """
+    csv.reader over a text source, closing the source when the iteration ends
+    """
+
+    def __init__(self, text, fmtparams):
+        self._text = text
+        self._rows = csv.reader(text, **fmtparams)
+
+    def __enter__(self):
+        return self._rows
+
+    def __exit__(self, exc_type, exc, tb):
+        self._text.close()
+
+
+def _column_converter(column_type):
+    """
+    :return: Callable casting a field, empty fields and the None padding of short rows are not cast
+    """
+    if column_type is None or column_type is str:
+        return lambda value: value
+    if column_type is float:
+        return lambda value: float(value) if value else float('nan')
+    if column_type is bool:
+        return lambda value: value is not None and value.strip().lower() in ('1', 'true', 't', 'yes', 'y')
+    return lambda value: column_type(value) if value else None
+
+
+class _MappedLines:
+    """
+    Lines of a local file read through a memory map: the mapped pages are shared with the page cache and copied out
+    one block at a time (no read() calls, memory bounded by the block size), each block is decoded and split on
+    newlines, csv.reader joins the lines of quoted multi-line fields
+    """
+
+    def __init__(self, file_path, encoding, block_size=MMAP_BLOCK_SIZE):
+        self._file = open(file_path, 'rb')
+        size = os.fstat(self._file.fileno()).st_size
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+        if self._map is not None and hasattr(mmap, 'MADV_SEQUENTIAL'):
+            self._map.madvise(mmap.MADV_SEQUENTIAL)
+        self._decoder = codecs.getincrementaldecoder(encoding)()
+        self._block_size = block_size
+
+    def __iter__(self):
+        if self._map is None:
+            return
+        rest = ''
+        for start in range(0, len(self._map), self._block_size):
+            lines = (rest + self._decoder.decode(self._map[start:start + self._block_size])).split('\n')
+            rest = lines.pop()
+            for line in lines:
+                yield line + '\n'
+        rest += self._decoder.decode(b'', final=True)
+        if rest:
+            yield rest
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self._file.close()
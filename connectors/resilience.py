@@ -0,0 +1,391 @@
+"""
+Retry, throttling and circuit breaking shared by the connectors. Every service endpoint (an S3 or Athena endpoint, a
+Jira host) gets one Resilience, holding:
+- an adaptive token bucket: calls wait for a token, the rate is halved when the service throttles and creeps back
+  up with every successful call,
+- a retry policy: throttled and transient errors (429, 5xx, SlowDown, connection errors) are retried with
+  exponential backoff and full jitter, "not found" and client errors are not,
+- a circuit breaker: after a run of failed calls the endpoint is considered down and calls fail at once with
+  CircuitOpenError, until a trial call goes through after reset_timeout.
+
+Pooled boto3 clients and HTTP sessions get it from client_pool, through botocore events and
+resilient_http.ResilientHTTPAdapter, so every call is covered, paginators and managed transfers included.
+Resilience.call covers any other callable.
+"""
+import random
+import threading
+import time
+
+from botocore.exceptions import ClientError, ConnectionError as BotoConnectionError, HTTPClientError
+
+from src.lib.connectors.settings import setting
+from src.lib.logs.logger import Logger
+
+# The rate never drops below this share of the configured rate
+MIN_RATE_SHARE = 0.02
+# Throttles within this many seconds of a rate decrease answer calls sent before it, they do not halve it again
+RATE_DECREASE_INTERVAL = 1.0
+
+# Outcomes of a call
+THROTTLED = 'throttled'
+TRANSIENT = 'transient'
+NOT_FOUND = 'not_found'
+FAILED = 'failed'
+RETRYABLE = (THROTTLED, TRANSIENT)
+
+THROTTLE_CODES = {'SlowDown', 'Throttling', 'ThrottlingException', 'ThrottledException', 'RequestThrottled',
+                  'RequestThrottledException', 'TooManyRequestsException', 'RequestLimitExceeded',
+                  'ProvisionedThroughputExceededException', 'BandwidthLimitExceeded', 'EC2ThrottledException'}
+TRANSIENT_CODES = {'InternalError', 'InternalFailure', 'ServiceUnavailable', 'RequestTimeout',
+                   'RequestTimeoutException', 'PriorRequestNotComplete'}
+# The endpoint does not implement the operation, asking again will not help
+UNSUPPORTED_CODES = {'NotImplemented', 'XNotImplemented'}
+NOT_FOUND_CODES = {'NoSuchKey', 'NotFound', '404', 'NoSuchUpload', 'EntityNotFoundException',
+                   'ResourceNotFoundException'}
+
+
+class CircuitOpenError(Exception):
+    """
+    The endpoint failed too often lately, the call was not attempted
+    """
+
+    def __init__(self, name, retry_in):
+        super().__init__('Circuit for {} is open, next trial in {:.1f}s'.format(name, retry_in))
+        self.name = name
+        self.retry_in = retry_in
+
+
+def classify(error=None, status=None, code=None):
+    """
+    :param error: Exception: A botocore, requests or OS error
+    :param status: Integer: An HTTP status, for responses that were not raised
+    :param code: String: An AWS error code
+    :return: String: THROTTLED, TRANSIENT, NOT_FOUND or FAILED, None for a success
+    """
+    response = getattr(error, 'response', None)
+    if isinstance(error, ClientError) and isinstance(response, dict):
+        code = code or response.get('Error', {}).get('Code')
+        status = status or response.get('ResponseMetadata', {}).get('HTTPStatusCode')
+    elif status is None and hasattr(response, 'status_code'):
+        status = response.status_code
+    if code in THROTTLE_CODES or status == 429:
+        return THROTTLED
+    if code in NOT_FOUND_CODES or status == 404:
+        return NOT_FOUND
+    if code in UNSUPPORTED_CODES or status == 501:
+        return FAILED
+    if code in TRANSIENT_CODES or (status is not None and status >= 500):
+        return TRANSIENT
+    if status is not None and status < 400 and error is None:
+        return None
+    if status is not None:
+        return FAILED
+    if isinstance(error, FileNotFoundError):
+        return NOT_FOUND
+    if isinstance(error, (HTTPClientError, BotoConnectionError, ConnectionError, TimeoutError)):
+        return TRANSIENT
+    # requests' ConnectionError and Timeout, http.client errors
+    if isinstance(error, OSError):
+        return TRANSIENT
+    return FAILED if error is not None else None
+
+
+def is_not_found(error):
+    """
+    :return: Boolean: The error says the object/resource does not exist, as opposed to a failed call
+    """
+    return classify(error) == NOT_FOUND
+
+
+class RetryPolicy:
+    """
+    How often a call runs before its error is raised, with exponential backoff and full jitter between attempts
+    """
+
+    def __init__(self, attempts=None, backoff=None, max_delay=None, retry_on=None):
+        """
+        :param attempts: Integer: Runs in total, RESILIENCE_MAX_ATTEMPTS if None, 1 for no retries
+        :param backoff: Number: Base delay in seconds, doubled after every attempt, RESILIENCE_BACKOFF if None
+        :param max_delay: Number: Upper bound of the delay in seconds, RESILIENCE_MAX_DELAY if None
+        :param retry_on: Tuple of Exception classes: Retry these errors, if None the throttled and transient ones
+        """
+        self.attempts = attempts or setting('RESILIENCE_MAX_ATTEMPTS')
+        self.backoff = setting('RESILIENCE_BACKOFF') if backoff is None else backoff
+        self.max_delay = setting('RESILIENCE_MAX_DELAY') if max_delay is None else max_delay
+        self.retry_on = retry_on
+
+    def should_retry(self, error, attempt):
+        """
+        :param error: Exception: The error of the attempt
+        :param attempt: Integer: The attempt that failed, from 1
+        """
+        if attempt >= self.attempts:
+            return False
+        if self.retry_on is not None:
+            return isinstance(error, self.retry_on)
+        return classify(error) in RETRYABLE
+
+    def delay(self, attempt):
+        """
+        :param attempt: Integer: The attempt that just failed, from 1
+        :return: Number: Seconds to wait before the next attempt
+        """
+        return random.uniform(0, min(self.max_delay, self.backoff * 2 ** (attempt - 1)))
+
+
+NO_RETRY = RetryPolicy(attempts=1)
+
+
+class AdaptiveRateLimiter:
+    """
+    Token bucket whose rate adapts to the service: halved when it throttles (at most once per
+    RATE_DECREASE_INTERVAL, so a burst of throttled calls counts once), raised by 1% of the configured rate per
+    successful call
+    """
+
+    def __init__(self, rate, burst=None):
+        """
+        :param rate: Number: Calls per second at most, None for no limit until the service throttles
+        :param burst: Number: Tokens that can pile up while idle, one second worth of calls if None
+        """
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst or rate or 0
+        self._updated_at = time.monotonic()
+        self._decreased_at = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Take a token, waiting for it if the bucket is empty
+        """
+        wait = self.reserve()
+        if wait:
+            time.sleep(wait)
+
+    def reserve(self):
+        """
+        Take a token. Tokens are reserved ahead, so waiting callers queue up
+        :return: Number: Seconds to wait before using the token
+        """
+        with self._lock:
+            if self.rate is None:
+                return 0
+            now = time.monotonic()
+            capacity = self.burst or self.rate
+            self.tokens = min(capacity, self.tokens + (now - self._updated_at) * self.rate)
+            self._updated_at = now
+            self.tokens -= 1
+            return -self.tokens / self.rate if self.tokens < 0 else 0
+
+    def throttled(self, calls_per_second=None):
+        """
+        :param calls_per_second: Number: The rate observed when the service pushed back, to start from without a
+            configured rate
+        """
+        with self._lock:
+            now = time.monotonic()
+            if self.rate is None:
+                self.max_rate = self.rate = max(calls_per_second or 10.0, 1.0)
+                self.tokens = 0
+            elif now - self._decreased_at >= RATE_DECREASE_INTERVAL:
+                self.rate = max(self.rate / 2, self.max_rate * MIN_RATE_SHARE)
+            else:
+                return
+            self._decreased_at = now
+        Logger.metrics.count('resilience_rate_decreases_total')
+
+    def succeeded(self):
+        with self._lock:
+            if self.rate is not None and self.rate < self.max_rate:
+                self.rate = min(self.max_rate, self.rate + self.max_rate * 0.01)
+
+
+class CircuitBreaker:
+    """
+    Closed: calls go through. Opened by failure_threshold failed calls in a row (throttled, transient), it fails
+    calls at once for reset_timeout seconds, then lets calls through again: the first success closes it, the first
+    failure opens it for another reset_timeout. "Not found" and client errors prove the service answers and count
+    as successes
+    """
+
+    def __init__(self, name, failure_threshold=None, reset_timeout=None):
+        self.name = name
+        self.failure_threshold = failure_threshold or setting('RESILIENCE_BREAKER_THRESHOLD')
+        self.reset_timeout = setting('RESILIENCE_BREAKER_RESET') if reset_timeout is None else reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        return 'open' if time.monotonic() - self.opened_at < self.reset_timeout else 'half_open'
+
+    def check(self):
+        """
+        :raises CircuitOpenError: The circuit is open
+        """
+        opened_at = self.opened_at
+        if opened_at is not None:
+            retry_in = opened_at + self.reset_timeout - time.monotonic()
+            if retry_in > 0:
+                raise CircuitOpenError(self.name, retry_in)
+
+    def succeeded(self):
+        if self.failures or self.opened_at is not None:
+            with self._lock:
+                self.failures = 0
+                self.opened_at = None
+
+    def failed(self):
+        with self._lock:
+            self.failures += 1
+            # A failed trial call in half-open state opens the circuit again straight away
+            if self.failures >= self.failure_threshold or self.opened_at is not None:
+                if self.state != 'open':
+                    Logger.warning('Circuit for {} opened after {} failed calls', self.name, self.failures)
+                    Logger.metrics.count('resilience_circuit_opened_total', endpoint=self.name)
+                self.opened_at = time.monotonic()
+
+
+class Resilience:
+    """
+    Rate limiter, retry policy and circuit breaker of one endpoint
+    """
+
+    def __init__(self, name, rate=None, retry=None, breaker=None):
+        """
+        :param name: String: The endpoint, for logs, metrics and CircuitOpenError
+        :param rate: Number: Calls per second at most, None for no limit until the service throttles
+        :param retry: RetryPolicy: RetryPolicy() if None
+        :param breaker: CircuitBreaker: CircuitBreaker(name) if None
+        """
+        self.name = name
+        self.limiter = AdaptiveRateLimiter(rate)
+        self.retry = retry or RetryPolicy()
+        self.breaker = breaker or CircuitBreaker(name)
+
+    def call(self, function, *args, **kwargs):
+        """
+        Call function through the rate limiter, retrying it on throttled and transient errors
+        :return: What function returns
+        :raises CircuitOpenError: The endpoint is considered down, function was not called
+        """
+        self.breaker.check()
+        attempt = 1
+        while True:
+            self.limiter.acquire()
+            try:
+                result = function(*args, **kwargs)
+            except Exception as ex:
+                delay = self.failed(ex, attempt)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                attempt += 1
+                continue
+            self.succeeded()
+            return result
+
+    def succeeded(self):
+        self.limiter.succeeded()
+        self.breaker.succeeded()
+
+    def failed(self, error, attempt, outcome=None, retry_after=None):
+        """
+        Account for a failed attempt
+        :param outcome: String: The classify outcome, from error if None
+        :param retry_after: Number: Seconds the service asked to wait (Retry-After)
+        :return: Number: Seconds to wait before the next attempt, None to give up
+        """
+        outcome = outcome or classify(error)
+        if outcome not in RETRYABLE:
+            # The service answered, the request itself is wrong or points at nothing
+            self.breaker.succeeded()
+            return None
+        if outcome == THROTTLED:
+            self.limiter.throttled()
+        self.breaker.failed()
+        retry = self.retry.should_retry(error, attempt) if error is not None else attempt < self.retry.attempts
+        if not retry or self.breaker.state == 'open':
+            return None
+        Logger.metrics.count('resilience_retries_total', endpoint=self.name, outcome=outcome)
+        Logger.debug('Retrying {} call after a {} error, attempt {}', self.name, outcome, attempt + 1)
+        return max(self.retry.delay(attempt), retry_after or 0)
+
+    def attach(self, client):
+        """
+        Route every call of a botocore client through this Resilience. botocore's own retries should be off
+        (retries={'total_max_attempts': 1}), they would multiply the attempts
+        :return: The client
+        """
+        return self._register(client, self._before_send)
+
+    def attach_async(self, client):
+        """
+        attach for an aiobotocore client: the rate limiter waits on the event loop instead of blocking it
+        :return: The client
+        """
+        return self._register(client, self._before_send_async)
+
+    def _register(self, client, before_send):
+        events = client.meta.events
+        events.register('before-call', self._before_call, unique_id='resilience-before-call')
+        events.register('before-send', before_send, unique_id='resilience-before-send')
+        events.register('needs-retry', self._needs_retry, unique_id='resilience-needs-retry')
+        return client
+
+    def _before_call(self, **kwargs):
+        self.breaker.check()
+
+    def _before_send(self, **kwargs):
+        # Every attempt, retries included, takes a token
+        self.limiter.acquire()
+
+    async def _before_send_async(self, **kwargs):
+        import asyncio
+
+        wait = self.limiter.reserve()
+        if wait:
+            await asyncio.sleep(wait)
+
+    def _needs_retry(self, attempts, response=None, caught_exception=None, **kwargs):
+        if caught_exception is not None:
+            return self.failed(caught_exception, attempts)
+        http_response, parsed = response
+        outcome = classify(status=http_response.status_code, code=parsed.get('Error', {}).get('Code'))
+        if outcome is None:
+            self.succeeded()
+            return None
+        return self.failed(None, attempts, outcome=outcome)
+
+
+_endpoints = {}
+_lock = threading.Lock()
+
+
+def for_endpoint(service, endpoint=None):
+    """
+    The Resilience shared by every connector of an endpoint, rate limited at RESILIENCE_RATE_LIMITS[service]
+    :param service: String: 's3', 'athena', 'jira'...
+    :param endpoint: String: The endpoint URL or host, None for the default one
+    :return: Resilience
+    """
+    key = (service, endpoint)
+    with _lock:
+        resilience = _endpoints.get(key)
+        if resilience is None:
+            name = service if endpoint is None else '{} {}'.format(service, endpoint)
+            resilience = _endpoints[key] = Resilience(name, rate=(setting('RESILIENCE_RATE_LIMITS') or {}).get(service))
+        return resilience
+
+
+def reset():
+    """
+    Forget the state of every endpoint (rates, open circuits)
+    """
+    with _lock:
+        _endpoints.clear()
@@ -0,0 +1,51 @@
+"""
+The requests side of resilience, in its own module so that requests is only imported with the first HTTP session.
+"""
+import time
+
+from requests.adapters import HTTPAdapter
+
+from src.lib.connectors.resilience import classify
+from src.lib.connectors.settings import setting
+
+
+class ResilientHTTPAdapter(HTTPAdapter):
+    """
+    requests transport adapter sending every request through a Resilience. A retryable status (429, 5xx) is
+    retried, honouring Retry-After; the last response is returned as is, for raise_for_status
+    """
+
+    def __init__(self, resilience, **kwargs):
+        super().__init__(**kwargs)
+        self.resilience = resilience
+
+    def send(self, request, **kwargs):
+        self.resilience.breaker.check()
+        attempt = 1
+        while True:
+            self.resilience.limiter.acquire()
+            try:
+                response = super().send(request, **kwargs)
+            except Exception as ex:
+                delay = self.resilience.failed(ex, attempt)
+                if delay is None:
+                    raise
+            else:
+                outcome = classify(status=response.status_code)
+                if outcome is None:
+                    self.resilience.succeeded()
+                    return response
+                delay = self.resilience.failed(None, attempt, outcome=outcome, retry_after=_retry_after(response))
+                if delay is None:
+                    return response
+                response.close()
+            time.sleep(delay)
+            attempt += 1
+
+
+def _retry_after(response):
+    value = response.headers.get('Retry-After')
+    try:
+        return min(float(value), setting('RESILIENCE_MAX_DELAY')) if value is not None else None
+    except ValueError:
+        return None
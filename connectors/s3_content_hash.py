@@ -0,0 +1,93 @@
+"""
+Content hashes computed the way S3 computes ETags, so an upload can be skipped when the bucket already holds the same
+bytes. An object uploaded in one request has the MD5 of its body as ETag; a multipart upload has the MD5 of the
+concatenated part MD5s followed by -<number of parts>. Both only depend on the content and the part size, and the
+parts of a file are hashed in parallel (hashlib releases the GIL on large buffers).
+Uploads in dedup mode also store the hash in the object metadata (CONTENT_HASH_METADATA): the ETag of an object
+encrypted with SSE-KMS, or uploaded with other part sizes, is not such a hash.
+"""
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from src.lib.connectors.s3_transfer import MAX_PARTS
+from src.lib.connectors.settings import setting
+
+CONTENT_HASH_METADATA = 'content-hash'
+HASH_CHUNK_SIZE = 1024 ** 2
+
+
+def upload_part_size(size, part_size=None):
+    """
+    The part size a managed upload of size bytes uses: doubled until the upload fits in MAX_PARTS parts
+    """
+    part_size = part_size or setting('S3_TRANSFER_PART_SIZE')
+    while -(-size // part_size) > MAX_PARTS:
+        part_size *= 2
+    return part_size
+
+
+def hash_bytes(data, part_size=None, multipart_threshold=None):
+    """
+    :param data: String/Bytes: The content, strings are encoded to UTF-8
+    :param part_size: Integer: Part size of the upload, S3_TRANSFER_PART_SIZE if None
+    :param multipart_threshold: Integer: Size from which the upload goes multipart, part_size if None
+    :return: String: The ETag S3 gives to this content
+    """
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    view = memoryview(data).cast('B')
+    part_size = upload_part_size(len(view), part_size)
+    if len(view) < (multipart_threshold or part_size):
+        return hashlib.md5(view).hexdigest()
+    digests = [hashlib.md5(view[start:start + part_size]).digest() for start in range(0, len(view), part_size)]
+    return _multipart_etag(digests)
+
+
+def hash_file(path, part_size=None, multipart_threshold=None, max_workers=None):
+    """
+    Stream a file through MD5, its parts in parallel, reading HASH_CHUNK_SIZE bytes at a time
+    :param path: String: The local file
+    :param part_size: Integer: Part size of the upload, S3_TRANSFER_PART_SIZE if None
+    :param multipart_threshold: Integer: Size from which the upload goes multipart, part_size if None
+    :param max_workers: Integer: Parts hashed concurrently, S3_HASH_MAX_WORKERS if None
+    :return: String: The ETag S3 gives to the file once uploaded
+    """
+    size = os.path.getsize(path)
+    part_size = upload_part_size(size, part_size)
+    if size < (multipart_threshold or part_size):
+        return _hash_range(path, 0, size).hexdigest()
+    starts = range(0, size, part_size)
+    with ThreadPoolExecutor(max_workers=min(max_workers or setting('S3_HASH_MAX_WORKERS'), len(starts))) as executor:
+        digests = list(executor.map(lambda start: _hash_range(path, start, min(part_size, size - start)).digest(),
+                                    starts))
+    return _multipart_etag(digests)
+
+
+def content_matches(content_hash, etag=None, metadata=None):
+    """
+    :param content_hash: String: hash_bytes or hash_file of the local content
+    :param etag: String: The ETag of the S3 object, quoted or not
+    :param metadata: Dict: The user metadata of the S3 object
+    :return: Boolean: The S3 object holds this content
+    """
+    if etag is not None and etag.strip('"') == content_hash:
+        return True
+    return bool(metadata) and metadata.get(CONTENT_HASH_METADATA) == content_hash
+
+
+def _hash_range(path, start, length):
+    md5 = hashlib.md5()
+    with open(path, 'rb') as fp:
+        fp.seek(start)
+        while length > 0:
+            chunk = fp.read(min(HASH_CHUNK_SIZE, length))
+            if not chunk:
+                raise IOError("{} changed while being hashed".format(path))
+            md5.update(chunk)
+            length -= len(chunk)
+    return md5
+
+
+def _multipart_etag(digests):
+    return '{}-{}'.format(hashlib.md5(b''.join(digests)).hexdigest(), len(digests))
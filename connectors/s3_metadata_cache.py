@@ -0,0 +1,203 @@
+import bisect
+import collections
+import datetime
+import json
+import sqlite3
+import threading
+import time
+
+from src.lib.connectors.settings import setting
+
+ObjectMetadata = collections.namedtuple('ObjectMetadata', ('size', 'etag', 'last_modified', 'metadata'))
+
+
+class S3MetadataCache:
+    """
+    Opt-in cache of S3 object metadata and prefix listings, shared by ConnectorS3 instances.
+    Entries live in a size-bounded in-memory LRU and, when sqlite_path is given, in an on-disk SQLite store that
+    outlives the process. Every entry expires after ttl seconds and is dropped as soon as a connector writes,
+    copies or deletes the key, or sees a different ETag for it.
+    """
+
+    def __init__(self, max_entries=100000, ttl=None, sqlite_path=None, max_listing_keys=10000):
+        """
+        :param max_entries: Integer: Number of objects and listings kept in memory before the least recently used go
+        :param ttl: Number: Seconds an entry stays valid, S3_METADATA_CACHE_TTL if None
+        :param sqlite_path: String: Path of an SQLite file persisting object metadata across runs, None for memory only
+        :param max_listing_keys: Integer: Listings longer than this are not cached
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl if ttl is not None else setting('S3_METADATA_CACHE_TTL')
+        self.max_listing_keys = max_listing_keys
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._objects = collections.OrderedDict()
+        self._listings = collections.OrderedDict()
+        self._lock = threading.RLock()
+        self._db = None
+        if sqlite_path:
+            self._db = sqlite3.connect(sqlite_path, check_same_thread=False)
+            self._db.execute('CREATE TABLE IF NOT EXISTS objects (bucket TEXT, key TEXT, size INTEGER, etag TEXT, '
+                             'last_modified TEXT, metadata TEXT, expires_at REAL, PRIMARY KEY (bucket, key))')
+            self._db.commit()
+
+    def get(self, bucket, key):
+        """
+        :return: ObjectMetadata or None on a miss. metadata is None if the entry came from a listing
+        """
+        with self._lock:
+            value = self._lookup(self._objects, (bucket, key))
+            if value is None and self._db is not None:
+                value = self._db_get(bucket, key)
+                if value is not None:
+                    self._store(self._objects, (bucket, key), value)
+            self._count(value)
+            return value
+
+    def put(self, bucket, key, size, etag, last_modified, metadata=None):
+        return self.put_many(bucket, [(key, size, etag, last_modified, metadata)])[0]
+
+    def put_many(self, bucket, entries):
+        """
+        :param entries: Iterable of (key, size, etag, last_modified, metadata) tuples
+        :return: List of the ObjectMetadata stored
+        """
+        values = [(key, ObjectMetadata(size, etag, last_modified, metadata))
+                  for key, size, etag, last_modified, metadata in entries]
+        with self._lock:
+            for key, value in values:
+                self._store(self._objects, (bucket, key), value)
+            if self._db is not None:
+                expires_at = time.time() + self.ttl
+                self._db.executemany('INSERT OR REPLACE INTO objects VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                     [(bucket, key, v.size, v.etag,
+                                       v.last_modified.isoformat() if v.last_modified else None,
+                                       json.dumps(v.metadata) if v.metadata is not None else None, expires_at)
+                                      for key, v in values])
+                self._db.commit()
+        return [value for _, value in values]
+
+    def get_listing(self, bucket, prefix):
+        """
+        :return: Tuple of (key, size) pairs for every object under prefix, or None on a miss
+        """
+        with self._lock:
+            value = self._lookup(self._listings, (bucket, prefix))
+            self._count(value)
+            return value
+
+    def put_listing(self, bucket, prefix, entries):
+        entries = tuple(entries)
+        if len(entries) <= self.max_listing_keys:
+            with self._lock:
+                self._store(self._listings, (bucket, prefix), entries)
+
+    def validate(self, bucket, key, etag):
+        """
+        Drop the cached entry for key if it was stored with a different ETag than the one just seen
+        """
+        with self._lock:
+            entry = self._objects.get((bucket, key))
+            cached = entry[1] if entry else (self._db_get(bucket, key) if self._db is not None else None)
+            if cached is not None and cached.etag != etag:
+                self.invalidate(bucket, key)
+
+    def invalidate(self, bucket, key):
+        """
+        Forget a key and every cached listing it belongs to
+        """
+        self.invalidate_many(bucket, [key])
+
+    def invalidate_many(self, bucket, keys):
+        """
+        Forget keys (e.g. a delete_objects batch) and every cached listing holding any of them, in one pass over the
+        listings and one SQLite transaction
+        """
+        keys = sorted(keys)
+        if not keys:
+            return
+        with self._lock:
+            for key in keys:
+                self._objects.pop((bucket, key), None)
+            for cached_bucket, prefix in list(self._listings):
+                if cached_bucket != bucket:
+                    continue
+                # The first key sorting at or after the prefix starts with it if any of them does
+                index = bisect.bisect_left(keys, prefix)
+                if index < len(keys) and keys[index].startswith(prefix):
+                    del self._listings[(cached_bucket, prefix)]
+            if self._db is not None:
+                self._db.executemany('DELETE FROM objects WHERE bucket = ? AND key = ?',
+                                     [(bucket, key) for key in keys])
+                self._db.commit()
+
+    def invalidate_prefix(self, bucket, prefix):
+        """
+        Forget every key under a prefix and every listing overlapping it
+        """
+        with self._lock:
+            for cached in [k for k in self._objects if k[0] == bucket and k[1].startswith(prefix)]:
+                del self._objects[cached]
+            for cached in [k for k in self._listings
+                           if k[0] == bucket and (k[1].startswith(prefix) or prefix.startswith(k[1]))]:
+                del self._listings[cached]
+            if self._db is not None:
+                self._db.execute("DELETE FROM objects WHERE bucket = ? AND substr(key, 1, ?) = ?",
+                                 (bucket, len(prefix), prefix))
+                self._db.commit()
+
+    def clear(self):
+        with self._lock:
+            self._objects.clear()
+            self._listings.clear()
+            if self._db is not None:
+                self._db.execute('DELETE FROM objects')
+                self._db.commit()
+
+    def stats(self):
+        """
+        :return: Dict: hit/miss/eviction counters and the number of entries held in memory
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'hit_ratio': self.hits / lookups if lookups else 0.0,
+                    'objects': len(self._objects), 'listings': len(self._listings)}
+
+    def _lookup(self, entries, cache_key):
+        entry = entries.get(cache_key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del entries[cache_key]
+            return None
+        entries.move_to_end(cache_key)
+        return value
+
+    def _store(self, entries, cache_key, value):
+        entries[cache_key] = (time.monotonic() + self.ttl, value)
+        entries.move_to_end(cache_key)
+        while len(self._objects) + len(self._listings) > self.max_entries:
+            # Evict the least recently used entry of the same kind, unless the new entry is the only one of its kind
+            other = self._listings if entries is self._objects else self._objects
+            victims = entries if len(entries) > 1 or not other else other
+            victims.popitem(last=False)
+            self.evictions += 1
+
+    def _count(self, value):
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+
+    def _db_get(self, bucket, key):
+        row = self._db.execute('SELECT size, etag, last_modified, metadata FROM objects '
+                               'WHERE bucket = ? AND key = ? AND expires_at > ?', (bucket, key, time.time())).fetchone()
+        if row is None:
+            return None
+        size, etag, last_modified, metadata = row
+        return ObjectMetadata(size, etag,
+                              datetime.datetime.fromisoformat(last_modified) if last_modified else None,
+                              json.loads(metadata) if metadata is not None else None)
@@ -0,0 +1,105 @@
+import io
+
+from botocore.exceptions import ClientError
+
+
+class S3ObjectReader(io.RawIOBase):
+    """
+    Seekable, read-only file object over an S3 object.
+    Sequential reads share one streaming GET and copy straight into the caller's buffer through readinto,
+    a seek to another position reopens the stream with a Range header.
+    """
+
+    def __init__(self, client, bucket, key, size=None, on_response=None):
+        """
+        :param client: A boto3 S3 client
+        :param bucket: String: The bucket of the object
+        :param key: String: The S3 key of the object
+        :param size: Integer: The object size if already known, saves a HEAD request on seeks from the end
+        :param on_response: Callable receiving every get_object response, e.g. to validate a metadata cache
+        """
+        super().__init__()
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+        self._size = size
+        self._on_response = on_response
+        self._position = 0
+        self._body = None
+
+    @property
+    def size(self):
+        if self._size is None:
+            self._size = self.client.head_object(Bucket=self.bucket, Key=self.key)['ContentLength']
+        return self._size
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            position = offset
+        elif whence == io.SEEK_CUR:
+            position = self._position + offset
+        elif whence == io.SEEK_END:
+            position = self.size + offset
+        else:
+            raise ValueError("Invalid whence: {}".format(whence))
+        if position < 0:
+            raise ValueError("Negative seek position {}".format(position))
+        if position != self._position:
+            self._close_body()
+            self._position = position
+        return self._position
+
+    def readinto(self, buffer):
+        if self.closed:
+            raise ValueError("I/O operation on closed file")
+        view = memoryview(buffer).cast('B')
+        if not len(view) or (self._size is not None and self._position >= self._size):
+            return 0
+        if self._body is None:
+            if not self._open():
+                return 0
+        if hasattr(self._body, 'readinto'):
+            read = self._body.readinto(view)
+        else:
+            data = self._body.read(len(view))
+            read = len(data)
+            view[:read] = data
+        self._position += read
+        return read
+
+    def close(self):
+        self._close_body()
+        super().close()
+
+    def _open(self):
+        kwargs = {'Bucket': self.bucket, 'Key': self.key}
+        if self._position:
+            kwargs['Range'] = 'bytes={}-'.format(self._position)
+        try:
+            response = self.client.get_object(**kwargs)
+        except ClientError as ex:
+            # Reading at or past the end of the object
+            if ex.response.get('Error', {}).get('Code') == 'InvalidRange':
+                return False
+            raise
+        if self._on_response is not None:
+            self._on_response(response)
+        if self._size is None:
+            content_range = response.get('ContentRange')
+            self._size = int(content_range.rsplit('/', 1)[1]) if content_range else response['ContentLength']
+        self._body = response['Body']
+        return True
+
+    def _close_body(self):
+        if self._body is not None:
+            self._body.close()
+            self._body = None
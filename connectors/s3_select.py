@@ -0,0 +1,305 @@
+"""
+S3 Select pushdown: a projection, a filter and a limit sent to S3 as SQL, so that only the matching rows of a CSV,
+JSON lines or Parquet object cross the network. Queries are built from a column list and simple conditions rather
+than taken as SQL, so the same query can also be evaluated here over a streaming read of the object, for endpoints
+that do not implement Select (S3-compatible stores, local stand-ins) and for xz files, which Select can not read.
+"""
+import bz2
+import gzip
+import io
+import itertools
+import json
+import lzma
+import operator
+import re
+from urllib.parse import urlparse
+
+from botocore.exceptions import BotoCoreError, ClientError
+
+from src.lib.connectors.columnar import iter_parquet_rows
+from src.lib.connectors.csv_reader import CsvReader
+
+COMPARISONS = {'=': operator.eq, '!=': operator.ne, '<': operator.lt, '<=': operator.le, '>': operator.gt,
+               '>=': operator.ge}
+OPERATORS = tuple(COMPARISONS) + ('in', 'like')
+# S3 Select reads these compressions of CSV and JSON objects, Parquet ones are compressed internally
+SELECT_COMPRESSIONS = {None: 'NONE', 'gzip': 'GZIP', 'bz2': 'BZIP2'}
+# Answers of endpoints without S3 Select
+UNSUPPORTED_CODES = {'NotImplemented', 'XNotImplemented', 'MethodNotAllowed'}
+# Errors of the object or the credentials rather than of the query, raised whatever the endpoint
+OBJECT_ERROR_CODES = {'NoSuchKey', 'NoSuchBucket', 'AccessDenied'}
+# CSV fields are text: they are cast to the type of the value they are compared with
+_CSV_CASTS = {bool: 'BOOL', int: 'INT', float: 'FLOAT'}
+
+
+class SelectQuery:
+    """
+    Projection, conditions (all of which must hold) and limit of a select, as S3 Select SQL and as a local filter
+    giving the same rows:
+
+        query = SelectQuery(['key', 'summary'], where=[('status', '=', 'Done'), ('id', '>', 1000)], limit=10)
+        query.expression('csv')
+        # SELECT s."key", s."summary" FROM S3Object s WHERE s."status" = 'Done' AND CAST(s."id" AS INT) > 1000 LIMIT 10
+    """
+
+    def __init__(self, columns=None, where=None, limit=None):
+        """
+        :param columns: List of Strings: The columns to return, all if None
+        :param where: Dict column -> value for equalities, or List of (column, operator, value) tuples. Operators are
+            =, !=, <, <=, >, >=, in (value is a list) and like (% and _ wildcards); None with = or != tests for NULL
+        :param limit: Integer: Rows at most, all if None
+        """
+        if isinstance(where, dict):
+            where = [(column, '=', value) for column, value in where.items()]
+        self.columns = list(columns) if columns else None
+        self.conditions = [_condition(*condition) for condition in where or ()]
+        self.limit = limit
+
+    @property
+    def read_columns(self):
+        """
+        :return: List of Strings: The columns the query needs to read, None for all of them
+        """
+        if self.columns is None:
+            return None
+        return list(dict.fromkeys(self.columns + [column for column, _, _ in self.conditions]))
+
+    def expression(self, input_format):
+        """
+        :param input_format: String: 'csv', 'jsonl' or 'parquet'
+        :return: String: The S3 Select SQL expression
+        """
+        projection = ', '.join(map(_reference, self.columns)) if self.columns else '*'
+        expression = 'SELECT {} FROM S3Object s'.format(projection)
+        if self.conditions:
+            expression += ' WHERE ' + ' AND '.join(_sql_condition(condition, input_format)
+                                                   for condition in self.conditions)
+        if self.limit is not None:
+            expression += ' LIMIT {:d}'.format(self.limit)
+        return expression
+
+    def project(self, records):
+        """
+        Shape the records returned by S3 Select like the local rows: columns missing from a record are None
+        :param records: Iterable of Dicts
+        :return: Generator of Dicts
+        """
+        if self.columns is None:
+            yield from records
+            return
+        for record in records:
+            yield {column: record.get(column) for column in self.columns}
+
+    def apply(self, rows, input_format):
+        """
+        The local evaluation of the query
+        :param rows: Iterable of Dicts: All the rows of the object
+        :param input_format: String: 'csv', 'jsonl' or 'parquet'
+        :return: Generator of Dicts
+        """
+        predicates = [_predicate(condition, input_format) for condition in self.conditions]
+        matching = (row for row in rows if all(predicate(row) for predicate in predicates))
+        if self.limit is not None:
+            matching = itertools.islice(matching, self.limit)
+        return self.project(matching)
+
+
+def input_serialization(input_format, compression=None, delimiter=','):
+    """
+    :return: Dict: The InputSerialization of select_object_content, None if S3 Select can not read the object
+    """
+    if compression not in SELECT_COMPRESSIONS or (input_format == 'parquet' and compression is not None):
+        return None
+    if input_format == 'csv':
+        # Quoted fields (issue descriptions) may span lines
+        serialization = {'CSV': {'FileHeaderInfo': 'USE', 'FieldDelimiter': delimiter,
+                                 'AllowQuotedRecordDelimiter': True}}
+    elif input_format == 'jsonl':
+        serialization = {'JSON': {'Type': 'LINES'}}
+    elif input_format == 'parquet':
+        serialization = {'Parquet': {}}
+    else:
+        return None
+    serialization['CompressionType'] = SELECT_COMPRESSIONS[compression]
+    return serialization
+
+
+def is_select_unsupported(error, aws=True):
+    """
+    :param error: Exception: Raised by select_object_content
+    :param aws: Boolean: The request went to AWS. S3-compatible stores and stand-ins implement part of the SQL at
+        best and fail on the rest with any error: from those every error but a missing key or a denied access
+        counts as unsupported
+    :return: Boolean: The endpoint can not run the query through S3 Select
+    """
+    if not isinstance(error, ClientError):
+        # botocore clients only raise ClientError and BotoCoreError, anything else comes from a stand-in running
+        # in process, like the SQL parser of moto
+        return not isinstance(error, BotoCoreError)
+    code = error.response.get('Error', {}).get('Code')
+    status = error.response.get('ResponseMetadata', {}).get('HTTPStatusCode')
+    if code in UNSUPPORTED_CODES or status in (405, 501):
+        return True
+    return not aws and code not in OBJECT_ERROR_CODES and status not in (403, 404)
+
+
+def is_aws_endpoint(endpoint_url):
+    """
+    :param endpoint_url: String: An S3 endpoint URL
+    :return: Boolean: The endpoint is AWS
+    """
+    host = urlparse(endpoint_url or '').hostname or ''
+    return host == 'amazonaws.com' or host.endswith(('.amazonaws.com', '.amazonaws.com.cn'))
+
+
+def iter_select_records(payload, on_stats=None):
+    """
+    Decode the event stream of a select_object_content response with JSON output. Records events carry chunks of
+    newline-delimited records, cut anywhere
+    :param payload: The response Payload EventStream
+    :param on_stats: Callable receiving the Stats details (BytesScanned, BytesProcessed, BytesReturned)
+    :return: Generator of Dicts
+    :raises IOError: The stream ended before its End event, the result is incomplete
+    """
+    pending = b''
+    complete = False
+    for event in payload:
+        if 'Records' in event:
+            lines = (pending + event['Records']['Payload']).split(b'\n')
+            pending = lines.pop()
+            for line in lines:
+                if line:
+                    yield json.loads(line)
+        elif 'Stats' in event and on_stats is not None:
+            on_stats(event['Stats']['Details'])
+        elif 'End' in event:
+            complete = True
+    if pending.strip():
+        yield json.loads(pending)
+    if not complete:
+        raise IOError("S3 Select result stream ended before its End event")
+
+
+def iter_object_rows(conn_s3, key, input_format, compression=None, delimiter=',', columns=None):
+    """
+    Stream all the rows of an object, for the local evaluation of a query
+    :param conn_s3: ConnectorS3: The connector of the bucket holding the object
+    :param columns: List of Strings: The columns needed, only those are read from Parquet objects, all if None
+    :return: Generator of Dicts, CSV values are strings
+    """
+    if input_format == 'parquet':
+        with conn_s3.open_object(key) as fp:
+            yield from iter_parquet_rows(fp, columns)
+        return
+
+    def open_text():
+        return io.TextIOWrapper(_decompressed(conn_s3.open_object(key), compression), encoding='utf-8', newline='')
+
+    if input_format == 'csv':
+        yield from CsvReader(open_text, delimiter=delimiter).iter_dicts()
+    elif input_format == 'jsonl':
+        with open_text() as fp:
+            for line in fp:
+                if line.strip():
+                    yield json.loads(line)
+    else:
+        raise ValueError("Unknown input format {}, use csv, jsonl or parquet".format(input_format))
+
+
+def _condition(column, op, value):
+    op = op.lower()
+    if op not in OPERATORS:
+        raise ValueError("Unknown operator {}, use one of {}".format(op, list(OPERATORS)))
+    if op == 'in':
+        value = tuple(value)
+        if not value:
+            raise ValueError("in needs at least one value")
+    elif value is None and op not in ('=', '!='):
+        raise ValueError("None can only be compared with = or !=")
+    elif op == 'like' and not isinstance(value, str):
+        raise ValueError("like needs a string pattern")
+    return column, op, value
+
+
+def _reference(column):
+    return 's."{}"'.format(column.replace('"', '""'))
+
+
+def _literal(value):
+    if isinstance(value, bool):
+        return 'TRUE' if value else 'FALSE'
+    if isinstance(value, (int, float)):
+        return repr(value)
+    if isinstance(value, str):
+        return "'{}'".format(value.replace("'", "''"))
+    raise ValueError("Can not compare with {!r}, use strings, numbers or booleans".format(value))
+
+
+def _sql_condition(condition, input_format):
+    column, op, value = condition
+    reference = _reference(column)
+    if value is None:
+        return '{} IS {}NULL'.format(reference, 'NOT ' if op == '!=' else '')
+    cast = _CSV_CASTS.get(type(value[0] if op == 'in' else value)) if input_format == 'csv' else None
+    if cast:
+        reference = 'CAST({} AS {})'.format(reference, cast)
+    if op == 'in':
+        return '{} IN ({})'.format(reference, ', '.join(map(_literal, value)))
+    return '{} {} {}'.format(reference, op.upper(), _literal(value))
+
+
+def _predicate(condition, input_format):
+    column, op, value = condition
+    convert = None
+    if input_format == 'csv' and value is not None:
+        convert = _csv_converter(type(value[0] if op == 'in' else value))
+    if value is None:
+        test = (lambda field: field is None) if op == '=' else (lambda field: field is not None)
+    elif op == 'in':
+        test = value.__contains__
+    elif op == 'like':
+        pattern = re.compile(''.join('.*' if char == '%' else '.' if char == '_' else re.escape(char)
+                                     for char in value), re.DOTALL)
+
+        def test(field):
+            return isinstance(field, str) and pattern.fullmatch(field) is not None
+    else:
+        compare = COMPARISONS[op]
+
+        def test(field):
+            return field is not None and compare(field, value)
+
+    def predicate(row):
+        field = row.get(column)
+        try:
+            if convert is not None and field is not None:
+                field = convert(field)
+            return test(field)
+        except (TypeError, ValueError):
+            # Like S3 Select, a field that does not compare with the value does not match
+            return False
+    return predicate
+
+
+def _csv_converter(value_type):
+    if value_type is bool:
+        return _parse_bool
+    if value_type in (int, float):
+        return value_type
+    return None
+
+
+def _parse_bool(text):
+    value = {'true': True, 'false': False}.get(text.strip().lower())
+    if value is None:
+        raise ValueError("{!r} is not a boolean".format(text))
+    return value
+
+
+def _decompressed(fp, compression):
+    if compression is None:
+        return fp
+    openers = {'gzip': gzip.GzipFile, 'bz2': bz2.BZ2File, 'xz': lzma.LZMAFile}
+    if compression not in openers:
+        raise ValueError("Unknown compression {}, use one of {}".format(compression, list(openers)))
+    return openers[compression](fileobj=fp) if compression == 'gzip' else openers[compression](fp)
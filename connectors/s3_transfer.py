@@ -0,0 +1,333 @@
+import io
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from src.lib.connectors.resilience import RetryPolicy
+from src.lib.connectors.settings import setting
+
+# S3 refuses multipart parts under 5 MB (except the last one) and uploads of more than 10000 parts
+MIN_PART_SIZE = 5 * 1024 ** 2
+MAX_PARTS = 10000
+PART_RETRIES = 3
+# Throttled and transient part uploads only, a part rejected by S3 fails the upload at once
+PART_RETRY = RetryPolicy(attempts=PART_RETRIES + 1, backoff=0.2)
+
+
+def build_transfer_config(part_size=None, max_concurrency=None, max_bandwidth=None, multipart_threshold=None):
+    """
+    TransferConfig for boto3's managed upload_file/download_file, defaulting to the S3_TRANSFER_* settings
+    :param part_size: Integer: Multipart chunk size in bytes
+    :param max_concurrency: Integer: Number of parts transferred concurrently
+    :param max_bandwidth: Integer: Bandwidth cap in bytes per second, None for no cap
+    :param multipart_threshold: Integer: Size from which transfers go multipart, part_size if None
+    :return: TransferConfig
+    """
+    from boto3.s3.transfer import TransferConfig
+
+    part_size = part_size or setting('S3_TRANSFER_PART_SIZE')
+    kwargs = {'multipart_chunksize': part_size,
+              'multipart_threshold': multipart_threshold or part_size,
+              'max_concurrency': max_concurrency or setting('S3_TRANSFER_MAX_CONCURRENCY')}
+    max_bandwidth = max_bandwidth or setting('S3_TRANSFER_MAX_BANDWIDTH')
+    if max_bandwidth:
+        kwargs['max_bandwidth'] = max_bandwidth
+    return TransferConfig(**kwargs)
+
+
+class TransferMetrics:
+    """
+    Progress and throughput of one transfer. An instance is callable, so it can be passed as the Callback of
+    boto3's managed transfers, which only report transferred bytes. Multipart uploads run by MultipartUploader
+    also record per-part latencies and retries. on_update is called with snapshot() after every update.
+    """
+
+    def __init__(self, on_update=None, total_bytes=None):
+        self.on_update = on_update
+        self.total_bytes = total_bytes
+        self.bytes_transferred = 0
+        self.part_latencies = []
+        self.retries = 0
+        self.started_at = time.monotonic()
+        self.finished_at = None
+        self._lock = threading.Lock()
+
+    def __call__(self, bytes_amount):
+        with self._lock:
+            self.bytes_transferred += bytes_amount
+        self._notify()
+
+    def record_part(self, size, latency):
+        with self._lock:
+            self.bytes_transferred += size
+            self.part_latencies.append(latency)
+        self._notify()
+
+    def record_retry(self):
+        with self._lock:
+            self.retries += 1
+        self._notify()
+
+    def finish(self):
+        self.finished_at = time.monotonic()
+        self._notify()
+
+    def snapshot(self):
+        """
+        :return: Dict: bytes transferred, elapsed seconds, bytes/s, part count, mean/max part latency and retries
+        """
+        with self._lock:
+            elapsed = (self.finished_at or time.monotonic()) - self.started_at
+            latencies = list(self.part_latencies)
+            return {'bytes': self.bytes_transferred,
+                    'total_bytes': self.total_bytes,
+                    'seconds': elapsed,
+                    'bytes_per_second': self.bytes_transferred / elapsed if elapsed > 0 else 0.0,
+                    'parts': len(latencies),
+                    'part_latency_mean': sum(latencies) / len(latencies) if latencies else None,
+                    'part_latency_max': max(latencies) if latencies else None,
+                    'retries': self.retries,
+                    'done': self.finished_at is not None}
+
+    def _notify(self):
+        if self.on_update is not None:
+            self.on_update(self.snapshot())
+
+
+class BandwidthLimiter:
+    """
+    Token bucket shared by the parts of a transfer, capping it at max_bandwidth bytes per second
+    """
+
+    def __init__(self, max_bandwidth):
+        self.max_bandwidth = max_bandwidth
+        self._available = float(max_bandwidth)
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def consume(self, amount):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._available = min(self.max_bandwidth,
+                                      self._available + (now - self._updated_at) * self.max_bandwidth)
+                self._updated_at = now
+                # Parts bigger than one second of bandwidth go through once the bucket is full
+                if self._available >= min(amount, self.max_bandwidth):
+                    self._available -= amount
+                    return
+                missing = min(amount, self.max_bandwidth) - self._available
+            time.sleep(missing / self.max_bandwidth)
+
+
+class MultipartUploader:
+    """
+    Upload an in-memory buffer, a file object or a generator of byte chunks to S3 as a concurrent multipart upload,
+    without a temporary file. At most max_concurrency parts are held in memory at a time. Payloads that fit in a
+    single part are sent with one put_object instead.
+    """
+
+    def __init__(self, client, bucket, key, part_size=None, max_concurrency=None, max_bandwidth=None, metrics=None,
+                 extra_args=None):
+        """
+        :param client: A boto3 S3 client
+        :param bucket: String: The destination bucket
+        :param key: String: The destination key
+        :param part_size: Integer: Part size in bytes, S3_TRANSFER_PART_SIZE if None
+        :param max_concurrency: Integer: Number of parts uploaded concurrently, S3_TRANSFER_MAX_CONCURRENCY if None
+        :param max_bandwidth: Integer: Bandwidth cap in bytes per second, S3_TRANSFER_MAX_BANDWIDTH if None
+        :param metrics: TransferMetrics: Receives per-part progress, latencies and retries
+        :param extra_args: Dict: Extra put_object/create_multipart_upload arguments (ACL, Metadata, ContentType...)
+        """
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+        self.part_size = max(part_size or setting('S3_TRANSFER_PART_SIZE'), MIN_PART_SIZE)
+        self.max_concurrency = max_concurrency or setting('S3_TRANSFER_MAX_CONCURRENCY')
+        max_bandwidth = max_bandwidth or setting('S3_TRANSFER_MAX_BANDWIDTH')
+        self.limiter = BandwidthLimiter(max_bandwidth) if max_bandwidth else None
+        self.metrics = metrics or TransferMetrics()
+        self.extra_args = extra_args or {}
+
+    def upload(self, source):
+        """
+        :param source: bytes/bytearray/memoryview/str, a binary file object or an iterable of bytes/str chunks
+        :return: Dict: The put_object or complete_multipart_upload response
+        """
+        parts = self._iter_parts(source)
+        first = next(parts, b'')
+        second = next(parts, None)
+        if second is None:
+            return self._put_single(first)
+
+        upload_id = self.client.create_multipart_upload(Bucket=self.bucket, Key=self.key,
+                                                        **self.extra_args)['UploadId']
+        try:
+            completed = []
+            in_flight = set()
+            with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+                for part_number, body in enumerate(self._chain(first, second, parts), start=1):
+                    if part_number > MAX_PARTS:
+                        raise ValueError("{} needs more than {} parts, raise part_size".format(self.key, MAX_PARTS))
+                    # Bound the number of buffered parts so a generator source never gets fully materialised
+                    if len(in_flight) >= self.max_concurrency:
+                        done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                        completed.extend(future.result() for future in done)
+                    in_flight.add(executor.submit(self._upload_part, upload_id, part_number, body))
+                completed.extend(future.result() for future in in_flight)
+            response = self.client.complete_multipart_upload(
+                Bucket=self.bucket, Key=self.key, UploadId=upload_id,
+                MultipartUpload={'Parts': sorted(completed, key=lambda part: part['PartNumber'])})
+        except BaseException:
+            self.client.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=upload_id)
+            raise
+        self.metrics.finish()
+        return response
+
+    def _put_single(self, body):
+        if self.limiter is not None:
+            self.limiter.consume(len(body))
+        started_at = time.monotonic()
+        response = self.client.put_object(Bucket=self.bucket, Key=self.key, Body=body, **self.extra_args)
+        self.metrics.record_part(len(body), time.monotonic() - started_at)
+        self.metrics.finish()
+        return response
+
+    def _upload_part(self, upload_id, part_number, body):
+        # On top of the client's own retries: a part is worth another try after the endpoint recovered
+        attempt = 1
+        while True:
+            if self.limiter is not None:
+                self.limiter.consume(len(body))
+            started_at = time.monotonic()
+            try:
+                response = self.client.upload_part(Bucket=self.bucket, Key=self.key, UploadId=upload_id,
+                                                   PartNumber=part_number, Body=body)
+            except Exception as ex:
+                if not PART_RETRY.should_retry(ex, attempt):
+                    raise
+                self.metrics.record_retry()
+                time.sleep(PART_RETRY.delay(attempt))
+                attempt += 1
+                continue
+            self.metrics.record_part(len(body), time.monotonic() - started_at)
+            return {'ETag': response['ETag'], 'PartNumber': part_number}
+
+    @staticmethod
+    def _chain(first, second, rest):
+        yield first
+        yield second
+        yield from rest
+
+    def _read_part(self, source):
+        """
+        Read part_size bytes, or up to EOF. Raw streams may return less than asked from one read, and S3 rejects
+        parts under 5 MiB other than the last one
+        """
+        chunk = source.read(self.part_size)
+        if not chunk or len(chunk) >= self.part_size:
+            return chunk.encode('utf-8') if isinstance(chunk, str) else chunk
+        part = bytearray()
+        while chunk:
+            part += chunk.encode('utf-8') if isinstance(chunk, str) else chunk
+            if len(part) >= self.part_size:
+                break
+            chunk = source.read(self.part_size - len(part))
+        return bytes(part)
+
+    def _iter_parts(self, source):
+        """
+        Cut the source into part_size chunks, lazily so only the parts being uploaded are held as separate copies
+        """
+        if isinstance(source, str):
+            source = source.encode('utf-8')
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            view = memoryview(source).cast('B')
+            for start in range(0, len(view), self.part_size):
+                yield view[start:start + self.part_size].tobytes()
+            return
+        if hasattr(source, 'read'):
+            while True:
+                part = self._read_part(source)
+                if not part:
+                    return
+                yield part
+        buffer = bytearray()
+        for chunk in source:
+            buffer += chunk.encode('utf-8') if isinstance(chunk, str) else chunk
+            while len(buffer) >= self.part_size:
+                yield bytes(buffer[:self.part_size])
+                del buffer[:self.part_size]
+        if buffer:
+            yield bytes(buffer)
+
+
+class MultipartWriter(io.RawIOBase):
+    """
+    Binary file object uploading what is written to it as it goes: every part_size bytes written are sent as a
+    part of a multipart upload, so only one part is held in memory. Parts are sent by the writing thread, one at a
+    time. Closing sends the rest and completes the upload; a file smaller than a part goes with one put_object
+    """
+
+    def __init__(self, uploader, on_close=None):
+        """
+        :param uploader: MultipartUploader: The destination, part size and bandwidth of the upload
+        :param on_close: Callable run once the upload is finished, or failed
+        """
+        super().__init__()
+        self.uploader = uploader
+        self.on_close = on_close
+        self._buffer = bytearray()
+        self._size = 0
+        self._upload_id = None
+        self._parts = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        buffered = len(self._buffer)
+        self._buffer += data
+        written = len(self._buffer) - buffered
+        self._size += written
+        if len(self._buffer) >= self.uploader.part_size:
+            self._send_part()
+        return written
+
+    def tell(self):
+        return self._size
+
+    def close(self):
+        if self.closed:
+            return
+        uploader = self.uploader
+        try:
+            if self._upload_id is None:
+                uploader._put_single(bytes(self._buffer))
+            else:
+                if self._buffer:
+                    self._send_part()
+                uploader.client.complete_multipart_upload(Bucket=uploader.bucket, Key=uploader.key,
+                                                          UploadId=self._upload_id,
+                                                          MultipartUpload={'Parts': self._parts})
+                uploader.metrics.finish()
+        except BaseException:
+            if self._upload_id is not None:
+                uploader.client.abort_multipart_upload(Bucket=uploader.bucket, Key=uploader.key,
+                                                       UploadId=self._upload_id)
+            raise
+        finally:
+            self._buffer = None
+            super().close()
+            if self.on_close is not None:
+                self.on_close()
+
+    def _send_part(self):
+        uploader = self.uploader
+        if self._upload_id is None:
+            self._upload_id = uploader.client.create_multipart_upload(Bucket=uploader.bucket, Key=uploader.key,
+                                                                      **uploader.extra_args)['UploadId']
+        if len(self._parts) == MAX_PARTS:
+            raise ValueError("{} needs more than {} parts, raise part_size".format(uploader.key, MAX_PARTS))
+        body, self._buffer = bytes(self._buffer), bytearray()
+        self._parts.append(uploader._upload_part(self._upload_id, len(self._parts) + 1, body))
@@ -0,0 +1,89 @@
+"""
+Settings of the connectors and pipelines, read from setup.configs when they are used rather than when a module is
+imported: configs.update(...) takes effect at any time, before or after the connectors are imported, and
+override() changes settings for a block only. Keys missing from configs fall back to DEFAULTS.
+
+    from src.lib.connectors.settings import override, setting
+
+    setting('S3_COPY_MAX_WORKERS')  # configs['S3_COPY_MAX_WORKERS'], 10 if not set
+    with override(S3_ENDPOINT='http://localhost:5000'):
+        ...
+"""
+import contextlib
+
+from setup import configs
+
+DEFAULTS = {
+    'S3_ENDPOINT': 'https://s3.amazonaws.com',
+    'ATHENA_ENDPOINT': 'https://aws.amazon.com/athena',
+    'JIRA_ENDPOINT': 'http://localhost:8080',
+    'AWS_MAX_POOL_CONNECTIONS': 50,
+    'HTTP_POOL_CONNECTIONS': 20,
+    'S3_COPY_MAX_WORKERS': 10,
+    'S3_DELETE_MAX_WORKERS': 8,
+    'S3_LIST_MAX_WORKERS': 8,
+    'S3_DOWNLOAD_MAX_WORKERS': 8,
+    'S3_HASH_MAX_WORKERS': 4,
+    'S3_METADATA_CACHE_TTL': 300,
+    'S3_TRANSFER_PART_SIZE': 16 * 1024 ** 2,
+    'S3_TRANSFER_MAX_CONCURRENCY': 10,
+    'S3_TRANSFER_MAX_BANDWIDTH': None,
+    'S3_ASYNC_MAX_CONCURRENCY': 256,
+    'S3_ASYNC_MAX_POOL_CONNECTIONS': 100,
+    'QUERY_TIME_OUT': 30,
+    'QUERY_POLL_MAX_DELAY': 5,
+    'ATHENA_MAX_CONCURRENT_QUERIES': 5,
+    'ATHENA_RESULT_CACHE_TTL': 600,
+    'JIRA_PAGE_SIZE': 100,
+    'JIRA_MAX_WORKERS': 4,
+    'JIRA_SYNC_PREFIX': 'Uploads/issues',
+    'JIRA_SYNC_COMPACT_EVERY': 24,
+    'RESILIENCE_MAX_ATTEMPTS': 5,
+    'RESILIENCE_BACKOFF': 0.2,
+    'RESILIENCE_MAX_DELAY': 20,
+    # Calls per second per endpoint before any throttling, None for no limit
+    'RESILIENCE_RATE_LIMITS': {},
+    'RESILIENCE_BREAKER_THRESHOLD': 20,
+    'RESILIENCE_BREAKER_RESET': 30,
+    'PIPELINE_STAGE_ATTEMPTS': 3,
+    'PIPELINE_RETRY_BACKOFF': 2,
+    # Local directory or s3://bucket/prefix checkpointing the pipelines' extractions, empty for none
+    'PIPELINE_CHECKPOINT_LOCATION': '',
+    # 0 runs transforms in-process, n > 0 on a pool of n worker processes
+    'PIPELINE_TRANSFORM_WORKERS': 0,
+    'PIPELINE_TRANSFORM_CHUNK_SIZE': 500,
+    # The pipelines run threads (stages, connection pools), which fork would copy in a broken state
+    'PIPELINE_TRANSFORM_START_METHOD': 'spawn',
+    'LOG_LEVEL': 'INFO',
+    # 'text' or 'json'
+    'LOG_FORMAT': 'text',
+    # Prometheus text export written at exit, empty to disable
+    'METRICS_PROMETHEUS_FILE': '',
+}
+_MISSING = object()
+
+
+def setting(key):
+    """
+    :param key: String: The configs key
+    :return: The value in configs, DEFAULTS[key] (None for keys without a default) if not set
+    """
+    return configs.get(key, DEFAULTS.get(key))
+
+
+@contextlib.contextmanager
+def override(**values):
+    """
+    Change settings for the duration of a with block, process-wide. Pooled clients and endpoint Resilience
+    already created keep the settings they were built with
+    """
+    previous = {key: configs.get(key, _MISSING) for key in values}
+    configs.update(values)
+    try:
+        yield
+    finally:
+        for key, value in previous.items():
+            if value is _MISSING:
+                configs.pop(key, None)
+            else:
+                configs[key] = value
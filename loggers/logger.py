@@ -1,7 +1,209 @@
+"""
+Process-wide structured logger and metrics. Messages below LOG_LEVEL cost one comparison: their str.format
+arguments are only applied to enabled records. Records are put on an in-memory queue and written to stdout in
+batches by a background thread, so callers never wait on the terminal or a pipe. LOG_FORMAT 'json' writes one JSON
+document per record, keyword arguments becoming fields. LOG_LEVEL and LOG_FORMAT are read through settings when the
+writer starts, on the first record:
+
+    Logger.info('Copied {} objects', count, bucket=bucket)
+    Logger.metrics.count('rows_written_total', rows, table='issues')
+    Logger.export_prometheus('/var/lib/node_exporter/textfile/pipeline.prom')
+"""
+import atexit
+import datetime
+import json
+import os
+import queue
+import sys
+import threading
+import time
+import traceback
+
+from src.lib.connectors.settings import setting
+from src.lib.logs.metrics import MetricsRegistry
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+LEVEL_NAMES = {DEBUG: 'DEBUG', INFO: 'INFO', WARNING: 'WARNING', ERROR: 'ERROR'}
+
+# Records written by one write call at most
+WRITE_BATCH = 1000
+
+_STOP = object()
+_records = queue.SimpleQueue()
+_writer = None
+_lock = threading.Lock()
+
+
+def _level_of(level):
+    if isinstance(level, str):
+        return {name: number for number, name in LEVEL_NAMES.items()}[level.upper()]
+    return level
+
+
+# 0 until the writer starts and reads LOG_LEVEL: every record reaches Logger.log, which starts it
+_level = 0
+# The level given to Logger.set_level, kept over LOG_LEVEL
+_set_level = None
 
 
 class Logger:
 
+    metrics = MetricsRegistry()
+    # 'text' or 'json', LOG_FORMAT if None
+    output_format = None
+
+    @staticmethod
+    def debug(message='', *args, **fields):
+        if _level <= DEBUG:
+            Logger.log(DEBUG, message, *args, **fields)
+
+    @staticmethod
+    def info(message='', *args, **fields):
+        if _level <= INFO:
+            Logger.log(INFO, message, *args, **fields)
+
+    @staticmethod
+    def warning(message='', *args, **fields):
+        if _level <= WARNING:
+            Logger.log(WARNING, message, *args, **fields)
+
+    @staticmethod
+    def error(message='', *args, exc_info=False, **fields):
+        Logger.log(ERROR, message, *args, exc_info=exc_info, **fields)
+
+    @staticmethod
+    def log(level, message='', *args, exc_info=False, **fields):
+        """
+        :param level: Integer: DEBUG, INFO, WARNING or ERROR
+        :param message: String: The message, with str.format placeholders for args
+        :param args: Values formatted into the message, only if the level is enabled
+        :param exc_info: Boolean: Add the traceback of the exception being handled
+        :param fields: Structured fields of the record
+        """
+        if _writer is None:
+            _start()
+        if level < _level:
+            return
+        # The message is formatted here, while its arguments still hold their values; rendering and writing the
+        # record happen on the writer thread
+        _records.put((time.time(), level, message.format(*args) if args else str(message), fields,
+                      traceback.format_exc().rstrip() if exc_info else None))
+
     @staticmethod
-    def info(message=''):
-        print(message)
+    def is_enabled_for(level):
+        if _writer is None:
+            _start()
+        return _level_of(level) >= _level
+
+    @staticmethod
+    def set_level(level):
+        """
+        :param level: Integer or String: DEBUG, INFO, WARNING, ERROR or their names
+        """
+        global _level, _set_level
+        _level = _set_level = _level_of(level)
+
+    @staticmethod
+    def flush(timeout=None):
+        """
+        Wait until every record logged so far is written
+        """
+        if _writer is not None:
+            written = threading.Event()
+            _records.put(written)
+            written.wait(timeout)
+
+    @staticmethod
+    def summary():
+        """
+        :return: Dict: The counters and latency histograms recorded so far, see MetricsRegistry.summary
+        """
+        return Logger.metrics.summary()
+
+    @staticmethod
+    def export_prometheus(path=None):
+        """
+        :param path: String: The file, METRICS_PROMETHEUS_FILE if None
+        :return: String: The path written
+        """
+        return Logger.metrics.export_prometheus(path or setting('METRICS_PROMETHEUS_FILE'))
+
+
+def _render(record):
+    created, level, message, fields, exc_text = record
+    if Logger.output_format == 'json':
+        document = {'time': datetime.datetime.fromtimestamp(created, datetime.timezone.utc).isoformat(),
+                    'level': LEVEL_NAMES.get(level, level), 'message': message}
+        document.update(fields)
+        if exc_text:
+            document['exception'] = exc_text
+        return json.dumps(document, default=str)
+    if fields:
+        message += ' ' + ' '.join('{}={}'.format(name, value) for name, value in fields.items())
+    if level >= WARNING:
+        message = '{}: {}'.format(LEVEL_NAMES.get(level, level), message)
+    if exc_text:
+        message += '\n' + exc_text
+    return message
+
+
+def _write():
+    while True:
+        batch = [_records.get()]
+        while len(batch) < WRITE_BATCH:
+            try:
+                batch.append(_records.get_nowait())
+            except queue.Empty:
+                break
+        lines = [_render(record) for record in batch if isinstance(record, tuple)]
+        if lines:
+            try:
+                sys.stdout.write('\n'.join(lines) + '\n')
+                sys.stdout.flush()
+            except Exception:
+                # A closed or broken stdout must not kill the writer, flush() would wait forever
+                pass
+        for record in batch:
+            if isinstance(record, threading.Event):
+                record.set()
+        if any(record is _STOP for record in batch):
+            return
+
+
+def _start():
+    global _writer, _level
+    with _lock:
+        if _writer is None:
+            _level = _set_level if _set_level is not None else _level_of(setting('LOG_LEVEL'))
+            if Logger.output_format is None:
+                Logger.output_format = setting('LOG_FORMAT')
+            _writer = threading.Thread(target=_write, name='logger-writer', daemon=True)
+            _writer.start()
+
+
+def _stop():
+    global _writer
+    with _lock:
+        if _writer is not None:
+            _records.put(_STOP)
+            _writer.join()
+            _writer = None
+    if setting('METRICS_PROMETHEUS_FILE'):
+        Logger.export_prometheus()
+
+
+def _after_fork_in_child():
+    # The child inherits the writer of its parent but not its thread: records put on the inherited queue would
+    # never be written, and flush() would wait forever. A new writer starts on the child's first record
+    global _writer, _records, _lock
+    _writer = None
+    _records = queue.SimpleQueue()
+    _lock = threading.Lock()
+
+
+atexit.register(_stop)
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
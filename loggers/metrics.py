@@ -0,0 +1,144 @@
+"""
+In-process counters and latency histograms, keyed on a name and labels, for a summary at the end of a job or an
+export in the Prometheus text format (e.g. for the node_exporter textfile collector)
+"""
+import bisect
+import contextlib
+import os
+import threading
+import time
+
+# Upper bounds in seconds of the latency histogram buckets, a last +Inf bucket is implied
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class MetricsRegistry:
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._counters = {}
+        # (name, labels) -> [count per bucket..., +Inf count, sum, max]
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def count(self, name, value=1, **labels):
+        """
+        Add value to a counter
+        """
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        """
+        Record a value (a latency in seconds) in a histogram
+        """
+        key = (name, _label_key(labels))
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [0] * (len(self.buckets) + 1) + [0.0, 0.0]
+            histogram[index] += 1
+            histogram[-2] += value
+            histogram[-1] = max(histogram[-1], value)
+
+    @contextlib.contextmanager
+    def timer(self, name, **labels):
+        """
+        Observe the wall time of the with block in a histogram
+        """
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started_at, **labels)
+
+    def summary(self):
+        """
+        :return: Dict: 'counters': {'name{labels}': value}, 'histograms': {'name{labels}': count, sum, mean, max
+            and the p50/p95/p99 bucket bounds}
+        """
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {key: list(values) for key, values in self._histograms.items()}
+        result = {'counters': {}, 'histograms': {}}
+        for (name, labels), value in sorted(counters.items()):
+            result['counters'][name + _format_labels(labels)] = value
+        for (name, labels), values in sorted(histograms.items()):
+            counts = values[:-2]
+            total = sum(counts)
+            stats = {'count': total, 'sum': values[-2], 'mean': values[-2] / total if total else None,
+                     'max': values[-1]}
+            for quantile in (0.5, 0.95, 0.99):
+                stats['p{}'.format(int(quantile * 100))] = self._bucket_quantile(counts, total, quantile, values[-1])
+            result['histograms'][name + _format_labels(labels)] = stats
+        return result
+
+    def to_prometheus(self):
+        """
+        :return: String: Every metric in the Prometheus text exposition format
+        """
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {key: list(values) for key, values in self._histograms.items()}
+        lines = []
+        typed = set()
+        for (name, labels), value in sorted(counters.items()):
+            if name not in typed:
+                typed.add(name)
+                lines.append('# TYPE {} counter'.format(name))
+            lines.append('{}{} {}'.format(name, _format_labels(labels), _format_value(value)))
+        for (name, labels), values in sorted(histograms.items()):
+            if name not in typed:
+                typed.add(name)
+                lines.append('# TYPE {} histogram'.format(name))
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), values[:-2]):
+                cumulative += count
+                lines.append('{}_bucket{} {}'.format(name, _format_labels(labels + (('le', str(bound)),)), cumulative))
+            lines.append('{}_sum{} {}'.format(name, _format_labels(labels), _format_value(values[-2])))
+            lines.append('{}_count{} {}'.format(name, _format_labels(labels), cumulative))
+        return '\n'.join(lines) + '\n'
+
+    def export_prometheus(self, path):
+        """
+        Write to_prometheus to a file, replaced atomically so a collector never reads it half written
+        :return: String: The path
+        """
+        temp_path = '{}.{}.tmp'.format(path, os.getpid())
+        with open(temp_path, 'w', encoding='utf-8') as fp:
+            fp.write(self.to_prometheus())
+        os.replace(temp_path, path)
+        return path
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def _bucket_quantile(self, counts, total, quantile, maximum):
+        # Upper bound of the bucket holding the quantile, the largest value seen for the +Inf bucket
+        if not total:
+            return None
+        cumulative = 0
+        for bound, count in zip(self.buckets, counts):
+            cumulative += count
+            if cumulative >= quantile * total:
+                return min(bound, maximum)
+        return maximum
+
+
+def _label_key(labels):
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(name, value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+                          for name, value in labels) + '}'
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
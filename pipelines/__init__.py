@@ -0,0 +1,38 @@
+"""
+Jira to S3 pipelines and the framework they run on. Loaded lazily like the connectors: importing the package
+imports no pipeline, each name below imports its module on first access.
+
+    from src.lib.pipelines import run_all_issues_to_s3
+"""
+import importlib
+
+# Public name -> module of the package defining it
+_EXPORTS = {
+    'run_all_issues_to_s3': 'local_all_jira_issues_to_s3',
+    'register_issues_table': 'local_all_jira_issues_to_s3',
+    'run_incremental_issues_to_s3': 'incremental_jira_issues_to_s3',
+    'compact_issues': 'incremental_jira_issues_to_s3',
+    'Pipeline': 'runner',
+    'Stage': 'runner',
+    'RetryPolicy': 'runner',
+    'LocalCheckpoints': 'runner',
+    'S3Checkpoints': 'runner',
+    'checkpoints_at': 'runner',
+    'TransformStage': 'transforms',
+}
+
+__all__ = sorted(_EXPORTS)
+
+
+def __getattr__(name):
+    module = _EXPORTS.get(name)
+    if module is None:
+        raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+    value = getattr(importlib.import_module('.' + module, __name__), name)
+    # Cached on the package, later lookups do not come back here
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -0,0 +1,167 @@
+import datetime
+import json
+
+from src.lib.connectors.connector_jira import ConnectorJIRA
+from src.lib.connectors.connector_aws_s3 import ConnectorS3, DELETE_BATCH_SIZE
+from src.lib.connectors.settings import setting
+from src.lib.pipelines.local_all_jira_issues_to_s3 import ISSUE_FIELDS, issue_to_row
+from src.lib.logs.logger import Logger
+
+# Format of the `updated` field in the Jira REST API, and of a date in JQL (minute resolution)
+JIRA_TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%S.%f%z'
+JQL_TIMESTAMP_FORMAT = '%Y/%m/%d %H:%M'
+
+
+def run_incremental_issues_to_s3(jql='project = Testing', prefix=None, compact=None):
+    """
+    Sync the issues matching a JQL query to S3, fetching only the issues updated since the last run.
+    Layout under prefix:
+        _watermark.json                                  last `updated` timestamp seen and the keys updated at it
+        deltas/updated_date=YYYY-MM-DD/from_<wm>.jsonl   the issues of one run, by date of their last update
+        snapshot/issues.jsonl                            one row per issue, deltas merged in by compact_issues
+    Deltas are written before the watermark moves, and their names only depend on the watermark the run started
+    from, so a failed or repeated run rewrites the same files. The cost of a run follows the number of changed issues
+    :param jql: String: The JQL filter of the issues to sync, without ORDER BY
+    :param prefix: String: The S3 prefix of the sync, JIRA_SYNC_PREFIX if None
+    :param compact: Boolean: Merge the deltas into the snapshot after the run. If None, compact once there are
+        JIRA_SYNC_COMPACT_EVERY delta files
+    :return: Integer: The number of issues written
+    """
+    prefix = prefix or setting('JIRA_SYNC_PREFIX')
+    conn_s3 = ConnectorS3(bucket=setting('S3_BUCKET'))
+    conn_jira = ConnectorJIRA(endpoint_url=setting('JIRA_ENDPOINT'),
+                              username=setting('JIRA_USER'),
+                              password=setting('JIRA_PASSWORD'))
+
+    watermark = read_watermark(conn_s3, prefix)
+    issues = fetch_changed_issues(conn_jira, jql, watermark)
+
+    if issues:
+        rows = [dict(issue_to_row(issue), updated=issue['fields']['updated']) for issue in issues]
+        write_deltas(conn_s3, prefix, rows, watermark)
+        write_watermark(conn_s3, prefix, next_watermark(watermark, issues))
+    Logger.info("Synced {} changed issues since {}", len(issues), watermark['updated'] if watermark else 'start')
+
+    delta_keys = conn_s3.list_objects('{}/deltas/'.format(prefix), suffix='.jsonl')
+    if compact or (compact is None and len(delta_keys) >= setting('JIRA_SYNC_COMPACT_EVERY')):
+        compact_issues(conn_s3, prefix, delta_keys)
+    return len(issues)
+
+
+def fetch_changed_issues(conn_jira, jql, watermark):
+    """
+    The issues updated at or after the watermark, minus the ones the watermark records as already synced.
+    JQL compares dates to the minute, in the timezone of the Jira user, which is also the one of the `updated`
+    timestamps the API returns: the query starts at the minute of the watermark and the seconds are filtered here.
+    Issues updated while the pages are read move to the end of the result, which can shift another issue across a
+    page boundary; a key-only listing of the same query afterwards catches those
+    """
+    if watermark is None:
+        changed_jql = jql
+    else:
+        since = _parse_timestamp(watermark['updated'])
+        changed_jql = '({}) AND updated >= "{}"'.format(jql, since.strftime(JQL_TIMESTAMP_FORMAT))
+    ordered_jql = changed_jql + ' ORDER BY updated ASC, key ASC'
+
+    issues = {}
+    for issue in conn_jira.iter_issues(ordered_jql, fields=ISSUE_FIELDS + ['updated']):
+        issues[issue['key']] = issue
+    missing = [issue['key'] for issue in conn_jira.iter_issues(ordered_jql, fields=['key'])
+               if issue['key'] not in issues]
+    for start in range(0, len(missing), 100):
+        keys_jql = 'key in ({})'.format(', '.join(missing[start:start + 100]))
+        for issue in conn_jira.iter_issues(keys_jql, fields=ISSUE_FIELDS + ['updated']):
+            issues[issue['key']] = issue
+
+    return sorted((issue for issue in issues.values() if not _already_synced(issue, watermark)),
+                  key=lambda issue: (_parse_updated(issue), issue['key']))
+
+
+def next_watermark(watermark, issues):
+    """
+    :param watermark: Dict: The watermark the run started from, None on the first run
+    :param issues: List of Dicts: The issues of the run, sorted by `updated`
+    :return: Dict: {'updated': last `updated` timestamp seen, 'keys': keys of the issues updated at that instant}
+    """
+    last = _parse_updated(issues[-1])
+    keys = sorted(issue['key'] for issue in issues if _parse_updated(issue) == last)
+    if watermark is not None and _parse_timestamp(watermark['updated']) == last:
+        keys = sorted(set(keys) | set(watermark['keys']))
+    return {'updated': issues[-1]['fields']['updated'], 'keys': keys}
+
+
+def read_watermark(conn_s3, prefix):
+    """
+    :return: Dict: The watermark of the sync under prefix, None if it never ran
+    """
+    content = conn_s3.get_object('{}/_watermark.json'.format(prefix))
+    return json.loads(content) if content else None
+
+
+def write_watermark(conn_s3, prefix, watermark):
+    conn_s3.write_json(watermark, '{}/_watermark.json'.format(prefix), dedup=True)
+
+
+def write_deltas(conn_s3, prefix, rows, watermark):
+    """
+    Write the rows of a run as JSON lines, one file per date of last update
+    """
+    run_name = 'from_{}'.format(_parse_timestamp(watermark['updated']).strftime('%Y%m%dT%H%M%S%f%z')
+                                if watermark else 'start')
+    partitions = {}
+    for row in rows:
+        partitions.setdefault(row['updated'][:10], []).append(row)
+    for date, partition in sorted(partitions.items()):
+        key = '{}/deltas/updated_date={}/{}.jsonl'.format(prefix, date, run_name)
+        conn_s3.put_object(_to_json_lines(partition), key)
+
+
+def compact_issues(conn_s3, prefix, delta_keys=None):
+    """
+    Merge the deltas into the snapshot, keeping the last update of every issue, then delete the merged deltas.
+    Deltas only get deleted once the new snapshot is written, and merging a delta twice gives the same snapshot,
+    so an interrupted compaction is simply run again
+    :param delta_keys: List of Strings: The deltas to merge, all of them if None
+    :return: Integer: The number of issues in the snapshot
+    """
+    snapshot_key = '{}/snapshot/issues.jsonl'.format(prefix)
+    if delta_keys is None:
+        delta_keys = conn_s3.list_objects('{}/deltas/'.format(prefix), suffix='.jsonl')
+    if not delta_keys:
+        return None
+
+    rows = {}
+    sources = ([snapshot_key] if conn_s3.list_objects(snapshot_key, limit=1) else []) + sorted(delta_keys)
+    for source in sources:
+        for row in conn_s3.iter_json(source):
+            current = rows.get(row['key'])
+            if current is None or _parse_timestamp(row['updated']) >= _parse_timestamp(current['updated']):
+                rows[row['key']] = row
+
+    conn_s3.put_object(_to_json_lines(rows[key] for key in sorted(rows)), snapshot_key)
+    delta_keys = list(delta_keys)
+    for start in range(0, len(delta_keys), DELETE_BATCH_SIZE):
+        conn_s3.delete_object(delta_keys[start:start + DELETE_BATCH_SIZE])
+    Logger.info("Compacted {} deltas into {} issues", len(delta_keys), len(rows))
+    return len(rows)
+
+
+def _to_json_lines(rows):
+    for row in rows:
+        yield json.dumps(row) + '\n'
+
+
+def _already_synced(issue, watermark):
+    if watermark is None:
+        return False
+    since = _parse_timestamp(watermark['updated'])
+    updated = _parse_updated(issue)
+    return updated < since or (updated == since and issue['key'] in watermark['keys'])
+
+
+def _parse_updated(issue):
+    return _parse_timestamp(issue['fields']['updated'])
+
+
+def _parse_timestamp(value):
+    return datetime.datetime.strptime(value, JIRA_TIMESTAMP_FORMAT)
@@ -1,32 +1,179 @@
+import datetime
+
 from src.lib.connectors.connector_jira import ConnectorJIRA
 from src.lib.connectors.connector_aws_s3 import ConnectorS3
+from src.lib.connectors.connector_aws_athenas import ConnectorAthenas
 from src.lib.connectors.connector_file import ConnectorFile
+from src.lib.connectors.columnar import (record_batches, string_schema, s3_sink, compress_chunks,
+                                         PartitionedParquetWriter, PARQUET_BATCH_ROWS, TEXT_CODECS)
+from src.lib.connectors.settings import setting
+from src.lib.pipelines.streaming import bounded_stage, encode_csv, encode_jsonl, iter_batches
+from src.lib.pipelines.runner import Pipeline, Stage, RetryPolicy, checkpoints_at
+from src.lib.pipelines.transforms import TransformStage
+from src.lib.logs.logger import Logger
+
+# The only issue fields the transform below reads (id, key and self always come back)
+ISSUE_FIELDS = ['description', 'status', 'summary']
+ROW_FIELDS = ['id', 'key', 'url', 'description', 'status', 'summary']
+UPLOAD_BUCKET = 'eda0x7b2263-sbx-eu-west-1'
+# The upload buffers up to max_concurrency + 1 parts: small parts keep the streaming mode's memory low
+STREAM_TRANSFER_CONFIG = {'part_size': 8 * 1024 ** 2, 'max_concurrency': 4}
+PARQUET_PREFIX = 'Uploads/issues_parquet'
+
+
+def issue_to_row(issue):
+    """
+    The flat record the pipelines export for a Jira issue
+    """
+    return {
+        "id": issue['id'],
+        "key": issue['key'],
+        "url": issue['self'],
+        "description": issue['fields']['description'],
+        "status": issue['fields']['status']['name'],
+        "summary": issue['fields']['summary'],
+    }
+
 
-from setup import configs
+def issues_to_columns(issues):
+    """
+    The records of issue_to_row for a batch of issues, as columns (name -> list of values) for Arrow
+    """
+    return {
+        "id": [c['id'] for c in issues],
+        "key": [c['key'] for c in issues],
+        "url": [c['self'] for c in issues],
+        "description": [c['fields']['description'] for c in issues],
+        "status": [c['fields']['status']['name'] for c in issues],
+        "summary": [c['fields']['summary'] for c in issues],
+    }
 
 
-def run_all_issues_to_s3():
+def run_all_issues_to_s3(output_format='csv', local_file=False, compression=None, partition_cols=None,
+                         transform=issue_to_row, transform_workers=None, checkpoints=None, run_id=None):
+    """
+    Export all issues of the project to S3.
+    By default issue pages stream through the row transform and the encoder straight into a multipart upload,
+    with bounded queues between the stages, so memory stays flat whatever the size of the project. With
+    local_file=True the CSV is written to STATIC_FOLDER first and uploaded from there.
+    Parquet goes to PARQUET_PREFIX as a dataset, Hive partitioned on partition_cols, see register_issues_table.
+    It replaces the previous export only once it is complete: a failed load leaves the previous one in place.
+    The transform runs in a TransformStage, on transform_workers processes for CPU-heavy transforms.
+    The export runs as a Pipeline (extract -> transform -> encode -> load). With a checkpoint store the extracted
+    issues are checkpointed: a run failing after the extraction, started again on the same day, resumes from the
+    checkpoint instead of querying Jira again. The price is the streaming overlap: the whole extraction is written
+    to the store before the transform and the upload start. Without one (the default) issue pages flow straight
+    into the upload, and a failed run starts over
+    :param output_format: String: 'csv', 'jsonl' or 'parquet' (streaming only)
+    :param local_file: Boolean: Go through a local file instead of streaming
+    :param compression: String: 'gzip', 'bz2' or 'xz' for CSV/JSON lines, a Parquet codec ('snappy' if None)
+    :param partition_cols: List of Strings: Parquet partition columns, e.g. ['status']
+    :param transform: Callable: issue -> Dict with the ROW_FIELDS keys. A module-level function to run on workers
+    :param transform_workers: Integer: Transform processes, PIPELINE_TRANSFORM_WORKERS if None, 0 for in-process
+    :param checkpoints: LocalCheckpoints or S3Checkpoints: From PIPELINE_CHECKPOINT_LOCATION if None, none if
+        that is empty
+    :param run_id: String: The run the checkpoints belong to, one per day if None
+    :return: List of StageMetrics
+    """
     # Initialize clients
-    conn_s3 = ConnectorS3(bucket=configs.get('S3_BUCKET'))
-    conn_jira = ConnectorJIRA(endpoint_url=configs.get('JIRA_ENDPOINT'),
-                              username=configs.get('JIRA_USERNAME'),
-                              password=configs.get('JIRA_PASSWORD'))
-    conn_file = ConnectorFile(working_dir='../../../{}'.format(configs.get('STATIC_FOLDER')))
+    conn_s3 = ConnectorS3(bucket=setting('S3_BUCKET'))
+    conn_upload = ConnectorS3(bucket=UPLOAD_BUCKET)
+    conn_jira = ConnectorJIRA(endpoint_url=setting('JIRA_ENDPOINT'),
+                              username=setting('JIRA_USERNAME'),
+                              password=setting('JIRA_PASSWORD'))
+    transform_stage = TransformStage(transform, workers=transform_workers)
+    retry = RetryPolicy()
+    if checkpoints is None:
+        checkpoints = checkpoints_at(setting('PIPELINE_CHECKPOINT_LOCATION'))
 
-    # Get all issues
-    jql_get_issues = 'project = Testing '
-    issues_dict = conn_jira.execute_jql_todict(jql_get_issues)
+    def extract(_):
+        # Get all issues
+        jql_get_issues = 'project = Testing ORDER BY key'
+        return bounded_stage(conn_jira.iter_issues(jql_get_issues, fields=ISSUE_FIELDS),
+                             maxsize=setting('JIRA_PAGE_SIZE') * 2)
 
-    # Parse required fields
-    processed_dict = [{
-        "id": c['id'],
-        "key": c['key'],
-        "url": c['self'],
-        "description": c['fields']['description'],
-        "status": c['fields']['status']['name'],
-        "summary": c['fields']['summary'],
+    stages = [Stage('extract', extract, retry=retry, checkpoint=bool(checkpoints))]
+    if local_file:
+        stages += [Stage('transform', transform_stage),
+                   Stage('load', lambda rows: _save_and_upload(conn_s3, rows), retry=retry)]
+    elif output_format == 'parquet':
+        stages += [Stage('transform', lambda issues: _parquet_batches(issues, transform_stage)),
+                   Stage('load', lambda batches: _write_parquet(conn_upload, batches, compression or 'snappy',
+                                                                partition_cols), retry=retry)]
+    else:
+        # Rows -> encoded chunks -> multipart upload, each arrow a bounded queue
+        encode = (lambda rows: encode_csv(rows, fieldnames=ROW_FIELDS)) if output_format == 'csv' else encode_jsonl
+        key = 'Uploads/issues.{}{}'.format(output_format, TEXT_CODECS.get(compression, ''))
+        stages += [Stage('transform', transform_stage),
+                   Stage('encode', lambda rows: bounded_stage(compress_chunks(encode(rows), compression))),
+                   Stage('load', lambda chunks: conn_upload.put_object_stream(chunks, key,
+                                                                             transfer_config=STREAM_TRANSFER_CONFIG),
+                         retry=retry)]
+
+    pipeline = Pipeline('all_issues_to_s3', stages, checkpoints=checkpoints)
+    pipeline.run(run_id=run_id or 'all_issues_to_s3-{}'.format(datetime.date.today().isoformat()))
+
+    keys = conn_s3.list_objects('Uploads')
+    Logger.info('{} files under Uploads', len(keys))
+    Logger.debug('Files under Uploads: {}', keys)
+    return pipeline.metrics
+
+
+def register_issues_table(database, s3_output, table='jira_issues', partition_cols=None):
+    """
+    Register the Parquet export of run_all_issues_to_s3 as an Athena table, loading its partitions
+    :param partition_cols: List of Strings: The partition columns the export was written with
+    """
+    partition_cols = partition_cols or []
+    columns = [(name, 'string') for name in ROW_FIELDS]
+    ConnectorAthenas().register_table(table, [c for c in columns if c[0] not in partition_cols],
+                                      's3://{}/{}'.format(UPLOAD_BUCKET, PARQUET_PREFIX), database, s3_output,
+                                      partition_columns=[c for c in columns if c[0] in partition_cols])
 
-    } for c in issues_dict['issues']]
+
+def _parquet_batches(issues, transform_stage):
+    if transform_stage.function is issue_to_row and not transform_stage.workers:
+        # Column batches straight from the issue pages, without a dict per issue
+        rows = (issues_to_columns(batch) for batch in iter_batches(issues, PARQUET_BATCH_ROWS))
+    else:
+        rows = (tuple(row[name] for name in ROW_FIELDS) for row in transform_stage(issues))
+    return record_batches(rows, ROW_FIELDS, schema=string_schema(ROW_FIELDS))
+
+
+def _write_parquet(conn_s3, batches, compression, partition_cols):
+    # The export is written aside first, so a failed or retried load leaves the table on the previous export
+    run = datetime.datetime.now(datetime.timezone.utc).strftime('%Y%m%dT%H%M%S%f')
+    staging = '{}_staging/{}'.format(PARQUET_PREFIX, run)
+    try:
+        with PartitionedParquetWriter(s3_sink(conn_s3, staging, part_size=STREAM_TRANSFER_CONFIG['part_size']),
+                                      partition_cols=partition_cols,
+                                      compression=compression) as writer:
+            for batch in batches:
+                writer.write(batch)
+        # Moved next to the previous export's files under names of their own, server-side
+        keys = {path: _run_file_key(path, run) for path in writer.files}
+        report = conn_s3.copy_objects(('{}/{}'.format(staging, path), key) for path, key in keys.items())
+        if report['failed']:
+            raise IOError('Could not publish the Parquet export {}: {}'.format(run, report['failed']))
+    finally:
+        conn_s3.delete_objects_in_s3(staging + '/')
+    # Only now that the whole export is in place are the files of the previous ones removed
+    current = set(keys.values())
+    conn_s3.delete_keys(obj for obj in conn_s3.iter_objects(PARQUET_PREFIX + '/', fields=('Key', 'Size'))
+                        if obj.Key not in current)
+
+
+def _run_file_key(path, run):
+    # status=Done/part-00000.parquet -> <PARQUET_PREFIX>/status=Done/<run>-part-00000.parquet
+    directory, _, name = path.rpartition('/')
+    return '/'.join(part for part in (PARQUET_PREFIX, directory, '{}-{}'.format(run, name)) if part)
+
+
+def _save_and_upload(conn_s3, rows):
+    conn_file = ConnectorFile(working_dir='../../../{}'.format(setting('STATIC_FOLDER')))
+
+    # Parse required fields
+    processed_dict = list(rows)
 
     # Save to file
     if len(processed_dict) > 0:
@@ -35,12 +182,11 @@ def run_all_issues_to_s3():
         file_path = conn_file.save_dict_to_csvfile(data=processed_dict
                                                    , file_name=file_name
                                                    , fieldnames=header)
+        if file_path is None:
+            raise IOError('Could not write {} to {}'.format(file_name, conn_file.get_working_dir()))
 
-        # Try copy
+        # Try copy, skipped when the issues did not change since the last run
         conn_s3.upload_file(file_name=file_path
-                            , bucket='eda0x7b2263-sbx-eu-west-1'
-                            , destination_name='Uploads/{}'.format(file_name))
-
-    # list all files
-    for c in conn_s3.list_objects('Uploads'):
-        print(c)
\ No newline at end of file
+                            , bucket=UPLOAD_BUCKET
+                            , destination_name='Uploads/{}'.format(file_name)
+                            , dedup=True)
@@ -0,0 +1,333 @@
+"""
+Small pipeline framework: a Pipeline runs named stages (extract -> transform -> load), timing each of them and
+counting the rows and bytes they produce. Stages hand their output to the next one as is, so generator stages
+stream into each other. A checkpointed stage has its output written to a checkpoint store (local directory or
+S3) instead: a failed run started again with the same run id skips the stages before the last complete
+checkpoint and reads it back. A failing stage is retried following its RetryPolicy, together with the
+streaming stages before and after it, from the last checkpoint.
+
+    pipeline = Pipeline('issues', [Stage('extract', extract, checkpoint=True),
+                                   Stage('transform', transform),
+                                   Stage('load', load, retry=RetryPolicy(attempts=3))],
+                        checkpoints=checkpoints_at('./checkpoints'))
+    pipeline.run()
+"""
+import collections.abc
+import gzip
+import json
+import os
+import shutil
+import threading
+import time
+
+from src.lib.connectors import resilience
+from src.lib.connectors.columnar import compress_chunks
+from src.lib.connectors.connector_aws_s3 import ConnectorS3
+from src.lib.connectors.settings import setting
+from src.lib.pipelines.streaming import encode_jsonl
+from src.lib.logs.logger import Logger
+
+RETRY_MAX_DELAY = 60  # In seconds
+
+# Exclusive time accounting: the time a stage spends pulling from the stage before it is not its own
+_timing = threading.local()
+
+
+class RetryPolicy(resilience.RetryPolicy):
+    """
+    resilience.RetryPolicy with the stage defaults: any error is retried, after a longer backoff
+    """
+
+    def __init__(self, attempts=None, backoff=None, max_delay=RETRY_MAX_DELAY, retry_on=(Exception,)):
+        """
+        :param attempts: Integer: Runs in total, PIPELINE_STAGE_ATTEMPTS if None, 1 for no retries
+        :param backoff: Number: Base delay in seconds, doubled after every attempt, PIPELINE_RETRY_BACKOFF if None
+        :param max_delay: Number: Upper bound of the delay in seconds
+        :param retry_on: Tuple of Exception classes: The errors worth another attempt, others are raised at once.
+            None for the throttled and transient errors only, see resilience.classify
+        """
+        super().__init__(attempts or setting('PIPELINE_STAGE_ATTEMPTS'),
+                         setting('PIPELINE_RETRY_BACKOFF') if backoff is None else backoff, max_delay, retry_on)
+
+
+NO_RETRY = RetryPolicy(attempts=1)
+
+
+class Stage:
+
+    def __init__(self, name, function, retry=None, checkpoint=False):
+        """
+        :param name: String: Unique name of the stage in its pipeline, also names its checkpoint
+        :param function: Callable: output of the previous stage (the run input for the first one) -> output
+        :param retry: RetryPolicy: NO_RETRY if None
+        :param checkpoint: Boolean: Write the output to the pipeline's checkpoint store. The output must then be an
+            iterable of JSON serializable items, read back as a generator
+        """
+        self.name = name
+        self.function = function
+        self.retry = retry or NO_RETRY
+        self.checkpoint = checkpoint
+
+
+class StageMetrics:
+    """
+    Wall time spent in a stage (its call and producing its items, without the time spent in the stages before
+    it), the items it produced and their size: bytes for bytes, str (UTF-8) and Arrow data, 0 for other items
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.seconds = 0.0
+        self.rows = 0
+        self.bytes = 0
+        self.attempts = 0
+        self.resumed = False
+
+    def as_dict(self):
+        return {'stage': self.name, 'seconds': self.seconds, 'rows': self.rows, 'bytes': self.bytes,
+                'attempts': self.attempts, 'resumed': self.resumed}
+
+
+class Pipeline:
+
+    def __init__(self, name, stages, checkpoints=None):
+        """
+        :param name: String: The pipeline name, default run id
+        :param stages: List of Stage: Run in order
+        :param checkpoints: LocalCheckpoints or S3Checkpoints: Where checkpointed stages write their output, None
+            to stream through them
+        """
+        self.name = name
+        self.stages = list(stages)
+        self.checkpoints = checkpoints
+        self.metrics = []
+
+    def run(self, data=None, run_id=None, resume=True):
+        """
+        Run the stages. The checkpoints of a run are deleted once it succeeded, so the next run starts afresh
+        :param data: The input of the first stage
+        :param run_id: String: Identifies the run its checkpoints belong to, the pipeline name if None
+        :param resume: Boolean: Skip the stages a previous failed run with this run id completed
+        :return: The output of the last stage, a list if it is an iterator
+        """
+        run_id = run_id or self.name
+        self.metrics = [StageMetrics(stage.name) for stage in self.stages]
+        if self.checkpoints is not None and not resume:
+            self.checkpoints.clear(run_id)
+
+        source = self._input(data)
+        segment = []
+        for index, stage in enumerate(self.stages):
+            checkpointed = stage.checkpoint and self.checkpoints is not None
+            if checkpointed and resume and self.checkpoints.exists(run_id, stage.name):
+                # Stages of the segment feed this checkpoint only, none of them has to run again
+                for metrics in self.metrics[index - len(segment):index + 1]:
+                    metrics.resumed = True
+                Logger.info('Stage {} resumed from its checkpoint', stage.name)
+                source = self._reader(run_id, stage.name)
+                segment = []
+                continue
+            segment.append(stage)
+            if checkpointed or index == len(self.stages) - 1:
+                output = self._run_segment(run_id, segment, source, self.metrics[index + 1 - len(segment):index + 1],
+                                           checkpointed)
+                source = self._reader(run_id, stage.name) if checkpointed else None
+                segment = []
+
+        if source is not None:
+            output = list(source())
+        if self.checkpoints is not None:
+            self.checkpoints.clear(run_id)
+        return output
+
+    @staticmethod
+    def _input(data):
+        return lambda: data
+
+    def _reader(self, run_id, stage_name):
+        return lambda: self.checkpoints.read(run_id, stage_name)
+
+    def _run_segment(self, run_id, segment, source, metrics, checkpointed):
+        """
+        Run stages streaming into each other up to a checkpoint or the end of the pipeline, the whole segment
+        again from source on an error the RetryPolicy of the stage raising it retries. Errors reading the source or
+        writing the checkpoint follow the policy of the last stage
+        """
+        attempt = 1
+        while True:
+            timers = [_StageTimer(stage_metrics, stage) for stage_metrics, stage in zip(metrics, segment)]
+            for stage_metrics in metrics:
+                stage_metrics.attempts = attempt
+            try:
+                output = source()
+                for stage, timer in zip(segment, timers):
+                    output = timer.call(stage.function, output)
+                if checkpointed:
+                    self.checkpoints.write(run_id, segment[-1].name, output)
+                elif isinstance(output, collections.abc.Iterator):
+                    output = list(output)
+                for stage_metrics in metrics:
+                    Logger.info('Stage {} done in {:.2f}s: {} rows, {} bytes', stage_metrics.name,
+                                stage_metrics.seconds, stage_metrics.rows, stage_metrics.bytes)
+                    labels = {'pipeline': self.name, 'stage': stage_metrics.name}
+                    Logger.metrics.observe('pipeline_stage_seconds', stage_metrics.seconds, **labels)
+                    Logger.metrics.count('pipeline_stage_rows_total', stage_metrics.rows, **labels)
+                    Logger.metrics.count('pipeline_stage_bytes_total', stage_metrics.bytes, **labels)
+                return output
+            except Exception as ex:
+                failed = getattr(ex, 'pipeline_stage', None) or segment[-1]
+                policy = failed.retry
+                if not policy.should_retry(ex, attempt):
+                    raise
+                delay = policy.delay(attempt)
+                Logger.warning('Stage {} failed ({!r}), attempt {} of {} in {:.1f}s', failed.name, ex,
+                               attempt + 1, policy.attempts, delay)
+                Logger.metrics.count('pipeline_stage_retries_total', pipeline=self.name, stage=failed.name)
+                time.sleep(delay)
+                attempt += 1
+            finally:
+                # Stop the threads of half-consumed streaming stages, downstream first
+                for timer in reversed(timers):
+                    timer.close()
+
+
+class _StageTimer:
+
+    def __init__(self, metrics, stage):
+        self.metrics = metrics
+        self.stage = stage
+        self.metrics.seconds = 0.0
+        self.metrics.rows = 0
+        self.metrics.bytes = 0
+        self._iterators = []
+
+    def call(self, function, data):
+        output = self._timed(function, data)
+        if isinstance(output, collections.abc.Iterator):
+            wrapper = self._iterate(output)
+            self._iterators = [wrapper, output]
+            return wrapper
+        if isinstance(output, (list, tuple)):
+            self.metrics.rows += len(output)
+            self.metrics.bytes += sum(_size(item) for item in output)
+        return output
+
+    def close(self):
+        for iterator in self._iterators:
+            if hasattr(iterator, 'close'):
+                iterator.close()
+
+    def _iterate(self, iterator):
+        while True:
+            try:
+                item = self._timed(next, iterator)
+            except StopIteration:
+                return
+            self.metrics.rows += 1
+            self.metrics.bytes += _size(item)
+            yield item
+
+    def _timed(self, function, argument):
+        stack = _timing.__dict__.setdefault('stack', [])
+        stack.append(0.0)
+        start = time.perf_counter()
+        try:
+            return function(argument)
+        except StopIteration:
+            raise
+        except Exception as ex:
+            # Tag the error with the stage it comes from, the stages pulling from it on the way up keep the tag
+            if getattr(ex, 'pipeline_stage', None) is None:
+                ex.pipeline_stage = self.stage
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            inner = stack.pop()
+            self.metrics.seconds += elapsed - inner
+            if stack:
+                stack[-1] += elapsed
+
+
+def _size(item):
+    if isinstance(item, (bytes, bytearray, memoryview)):
+        return len(item)
+    if isinstance(item, str):
+        return len(item.encode('utf-8'))
+    return getattr(item, 'nbytes', 0)
+
+
+class LocalCheckpoints:
+    """
+    Stage outputs as gzipped JSON lines under directory/<run id>/<stage>.jsonl.gz. A <stage>.done marker written
+    after the data tells a complete checkpoint from one cut short by a failure
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def exists(self, run_id, stage_name):
+        return os.path.exists(self._path(run_id, stage_name, '.done'))
+
+    def write(self, run_id, stage_name, items):
+        os.makedirs(os.path.join(self.directory, run_id), exist_ok=True)
+        with open(self._path(run_id, stage_name, '.jsonl.gz'), 'wb') as fp:
+            for chunk in compress_chunks(encode_jsonl(items), 'gzip'):
+                fp.write(chunk)
+        open(self._path(run_id, stage_name, '.done'), 'w').close()
+
+    def read(self, run_id, stage_name):
+        with gzip.open(self._path(run_id, stage_name, '.jsonl.gz'), 'rt', encoding='utf-8') as fp:
+            for line in fp:
+                yield json.loads(line)
+
+    def clear(self, run_id):
+        shutil.rmtree(os.path.join(self.directory, run_id), ignore_errors=True)
+
+    def _path(self, run_id, stage_name, suffix):
+        return os.path.join(self.directory, run_id, stage_name + suffix)
+
+
+class S3Checkpoints:
+    """
+    The LocalCheckpoints layout under an S3 prefix, written as a streaming multipart upload
+    """
+
+    def __init__(self, conn_s3, prefix):
+        """
+        :param conn_s3: ConnectorS3: The connector of the checkpoint bucket
+        :param prefix: String: The prefix the run directories go under
+        """
+        self.conn_s3 = conn_s3
+        self.prefix = prefix.rstrip('/')
+
+    def exists(self, run_id, stage_name):
+        return self.conn_s3.check_key_exists(self._key(run_id, stage_name, '.done'))
+
+    def write(self, run_id, stage_name, items):
+        self.conn_s3.put_object_stream(compress_chunks(encode_jsonl(items), 'gzip'),
+                                       self._key(run_id, stage_name, '.jsonl.gz'))
+        self.conn_s3.put_object('', self._key(run_id, stage_name, '.done'))
+
+    def read(self, run_id, stage_name):
+        with gzip.GzipFile(fileobj=self.conn_s3.open_object(self._key(run_id, stage_name, '.jsonl.gz'))) as fp:
+            for line in fp:
+                yield json.loads(line)
+
+    def clear(self, run_id):
+        self.conn_s3.delete_objects_in_s3('{}/{}/'.format(self.prefix, run_id))
+
+    def _key(self, run_id, stage_name, suffix):
+        return '{}/{}/{}{}'.format(self.prefix, run_id, stage_name, suffix)
+
+
+def checkpoints_at(location):
+    """
+    :param location: String: A local directory or s3://bucket/prefix, empty for no checkpoints
+    :return: LocalCheckpoints, S3Checkpoints or None
+    """
+    if not location:
+        return None
+    if location.startswith('s3://'):
+        bucket, _, prefix = location[len('s3://'):].partition('/')
+        return S3Checkpoints(ConnectorS3(bucket=bucket), prefix)
+    return LocalCheckpoints(location)
@@ -0,0 +1,107 @@
+import csv
+import io
+import json
+import queue
+import threading
+
+STAGE_QUEUE_SIZE = 4
+ENCODE_BATCH_ROWS = 1000
+
+_DONE = object()
+
+
+def bounded_stage(items, maxsize=STAGE_QUEUE_SIZE):
+    """
+    Run a generator on its own thread, handing its items over through a queue of at most maxsize items. The
+    producer blocks while the queue is full, so a slow consumer holds back the producer instead of piling items
+    up in memory, and both sides overlap their waits (network, encoding, uploads).
+    An exception in the producer is raised in the consumer; closing the returned generator stops the producer
+    :param items: Iterable: The items to produce
+    :param maxsize: Integer: Items buffered between the producer and the consumer
+    :return: Generator of the items, in order
+    """
+    handover = queue.Queue(maxsize=maxsize)
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                handover.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for item in items:
+                if not put((item, None)):
+                    return
+            put((_DONE, None))
+        except BaseException as ex:
+            put((_DONE, ex))
+        finally:
+            if hasattr(items, 'close'):
+                items.close()
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    try:
+        while True:
+            item, error = handover.get()
+            if item is _DONE:
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        stop.set()
+        producer.join()
+
+
+def encode_csv(rows, fieldnames, batch_rows=ENCODE_BATCH_ROWS):
+    """
+    Encode dict rows as CSV with a header line, batch_rows rows per yielded chunk
+    :return: Generator of Strings
+    """
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=fieldnames)
+    writer.writeheader()
+    for count, row in enumerate(rows, start=1):
+        writer.writerow(row)
+        if count % batch_rows == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def encode_jsonl(rows, batch_rows=ENCODE_BATCH_ROWS):
+    """
+    Encode rows as JSON lines, batch_rows rows per yielded chunk
+    :return: Generator of Strings
+    """
+    batch = []
+    for row in rows:
+        batch.append(json.dumps(row))
+        if len(batch) == batch_rows:
+            yield '\n'.join(batch) + '\n'
+            batch = []
+    if batch:
+        yield '\n'.join(batch) + '\n'
+
+
+def iter_batches(items, size):
+    """
+    Group items into lists of at most size items
+    :return: Generator of Lists
+    """
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
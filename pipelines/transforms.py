@@ -0,0 +1,87 @@
+import collections
+from concurrent.futures import wait, FIRST_COMPLETED
+
+from src.lib.connectors.settings import setting
+from src.lib.pipelines.streaming import iter_batches
+
+_function = None
+
+
+class TransformStage:
+    """
+    Apply a mapping function to a stream of items, in-process or over a pool of worker processes for CPU-bound
+    transforms. Items are sent to the workers in chunks so pickling costs one round trip per chunk, and at most
+    two chunks per worker are in flight so memory stays bounded whatever the length of the stream:
+
+        rows = TransformStage(issue_to_row, workers=4)(issues)
+
+    With workers, the function must be picklable: a module-level function, not a lambda or a closure
+    """
+
+    def __init__(self, function, workers=None, chunk_size=None, ordered=True, batched=False):
+        """
+        :param function: Callable: item -> output, or list of items -> output if batched
+        :param workers: Integer: Worker processes, PIPELINE_TRANSFORM_WORKERS if None, 0 to run in-process
+        :param chunk_size: Integer: Items per chunk sent to a worker (and per call if batched)
+        :param ordered: Boolean: Yield outputs in input order, else as soon as their chunk is done
+        :param batched: Boolean: Call function once per chunk and yield one output per chunk
+        """
+        self.function = function
+        self.workers = setting('PIPELINE_TRANSFORM_WORKERS') if workers is None else workers
+        self.chunk_size = chunk_size or setting('PIPELINE_TRANSFORM_CHUNK_SIZE')
+        self.ordered = ordered
+        self.batched = batched
+
+    def __call__(self, items):
+        """
+        :param items: Iterable: The input items
+        :return: Generator of the outputs
+        """
+        if not self.workers:
+            if self.batched:
+                return (self.function(chunk) for chunk in iter_batches(items, self.chunk_size))
+            return (self.function(item) for item in items)
+        return self._run_pool(items)
+
+    def _run_pool(self, items):
+        # Only the process pool needs multiprocessing, in-process transforms do not pay for its import
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+
+        apply = _apply_batch if self.batched else _apply_items
+        # The function is shipped once per worker, not with every chunk
+        with ProcessPoolExecutor(max_workers=self.workers,
+                                 mp_context=multiprocessing.get_context(setting('PIPELINE_TRANSFORM_START_METHOD')),
+                                 initializer=_init_worker, initargs=(self.function,)) as executor:
+            pending = collections.deque()
+            for chunk in iter_batches(items, self.chunk_size):
+                if len(pending) >= self.workers * 2:
+                    yield from self._collect(pending)
+                pending.append(executor.submit(apply, chunk))
+            while pending:
+                yield from self._collect(pending)
+
+    def _collect(self, pending):
+        """
+        Take one finished chunk off pending: the oldest one if ordered, else the first to finish
+        """
+        if self.ordered:
+            future = pending.popleft()
+        else:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            future = done.pop()
+            pending.remove(future)
+        return [future.result()] if self.batched else future.result()
+
+
+def _init_worker(function):
+    global _function
+    _function = function
+
+
+def _apply_items(chunk):
+    return [_function(item) for item in chunk]
+
+
+def _apply_batch(chunk):
+    return _function(chunk)
@@ -5,6 +5,41 @@ configs = {
   "JIRA_ENDPOINT": "http://localhost:8080",
   "JIRA_USER": "",
   "JIRA_PASSWORD":"",
+  "JIRA_PAGE_SIZE": 100,
+  "JIRA_MAX_WORKERS": 4,
+  "JIRA_SYNC_PREFIX": "Uploads/issues",
+  "JIRA_SYNC_COMPACT_EVERY": 24, # Delta files before the incremental sync compacts them
+  "PIPELINE_TRANSFORM_WORKERS": 0, # Worker processes of the transform stage, 0 to run it in-process
+  "PIPELINE_TRANSFORM_CHUNK_SIZE": 500, # Items sent to a transform worker at a time
+  "PIPELINE_TRANSFORM_START_METHOD": "spawn",
+  "PIPELINE_CHECKPOINT_LOCATION": "", # Local directory or s3://bucket/prefix, empty to stream without checkpoints
+  "PIPELINE_STAGE_ATTEMPTS": 3,
+  "PIPELINE_RETRY_BACKOFF": 2, # In seconds
+  "LOG_LEVEL": "INFO",
+  "LOG_FORMAT": "text", # 'text' or 'json'
+  "METRICS_PROMETHEUS_FILE": "", # Prometheus text export written at exit, empty to disable
   "QUERY_TIME_OUT": 30, # In seconds
-  "ATHENA_ENDPOINT":"https://aws.amazon.com/athena"
+  "QUERY_POLL_MAX_DELAY": 5, # In seconds
+  "ATHENA_MAX_CONCURRENT_QUERIES": 5,
+  "ATHENA_RESULT_CACHE_TTL": 600, # In seconds
+  "ATHENA_ENDPOINT":"https://aws.amazon.com/athena",
+  "S3_COPY_MAX_WORKERS": 10,
+  "S3_DELETE_MAX_WORKERS": 8, # delete_objects batches of 1000 keys sent concurrently
+  "S3_LIST_MAX_WORKERS": 8,
+  "S3_METADATA_CACHE_TTL": 300, # In seconds
+  "S3_DOWNLOAD_MAX_WORKERS": 8,
+  "S3_HASH_MAX_WORKERS": 4, # Parts of a file hashed concurrently by the dedup uploads
+  "S3_TRANSFER_PART_SIZE": 16777216, # In bytes
+  "S3_TRANSFER_MAX_CONCURRENCY": 10,
+  "S3_TRANSFER_MAX_BANDWIDTH": None, # In bytes per second, None for no cap
+  "S3_ASYNC_MAX_CONCURRENCY": 256,
+  "S3_ASYNC_MAX_POOL_CONNECTIONS": 100,
+  "AWS_MAX_POOL_CONNECTIONS": 50,
+  "HTTP_POOL_CONNECTIONS": 20,
+  "RESILIENCE_MAX_ATTEMPTS": 5, # Attempts per API call on throttled and transient errors
+  "RESILIENCE_BACKOFF": 0.2, # In seconds, doubled after every attempt
+  "RESILIENCE_MAX_DELAY": 20, # In seconds
+  "RESILIENCE_RATE_LIMITS": {"s3": 3500, "athena": 20, "jira": 50}, # Calls per second per endpoint
+  "RESILIENCE_BREAKER_THRESHOLD": 20, # Failed calls in a row opening the circuit of an endpoint
+  "RESILIENCE_BREAKER_RESET": 30 # In seconds
 }
@@ -0,0 +1,18 @@
+"""
+Shared fixtures. Every test starts with empty client pools and endpoint states, no rate limits and short retry
+delays, so stand-ins and fault injection answer in milliseconds.
+"""
+import pytest
+
+from src.lib.connectors import client_pool, resilience
+from src.lib.connectors.settings import override
+
+
+@pytest.fixture(autouse=True)
+def fresh_connectors():
+    client_pool.reset()
+    resilience.reset()
+    with override(RESILIENCE_RATE_LIMITS={}, RESILIENCE_BACKOFF=0.001, RESILIENCE_MAX_DELAY=0.01):
+        yield
+    client_pool.reset()
+    resilience.reset()
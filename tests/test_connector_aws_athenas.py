@@ -0,0 +1,129 @@
+import time
+
+import boto3
+import pytest
+from botocore.stub import Stubber
+
+from src.lib.connectors import connector_aws_athenas
+from src.lib.connectors.connector_aws_athenas import AthenaQueryError, AthenaResultCache, ConnectorAthenas
+
+DATABASE = 'db'
+OUTPUT = 's3://bucket/results'
+
+
+@pytest.fixture
+def stubber(monkeypatch):
+    monkeypatch.setattr(connector_aws_athenas, 'POLL_INITIAL_DELAY', 0)
+    client = boto3.client('athena', region_name='eu-west-1', aws_access_key_id='testing',
+                          aws_secret_access_key='testing')
+    with Stubber(client) as stubber:
+        yield stubber
+        stubber.assert_no_pending_responses()
+
+
+@pytest.fixture
+def conn_athena(stubber):
+    return ConnectorAthenas(client=stubber.client)
+
+
+def expect_start(stubber, query, query_execution_id, database=DATABASE, s3_output=OUTPUT):
+    stubber.add_response('start_query_execution', {'QueryExecutionId': query_execution_id},
+                         {'QueryString': query, 'QueryExecutionContext': {'Database': database},
+                          'ResultConfiguration': {'OutputLocation': s3_output}})
+
+
+def expect_poll(stubber, states):
+    """
+    :param states: Dict: QueryExecutionId -> state, in the order the ids are polled
+    """
+    executions = [{'QueryExecutionId': query_execution_id, 'Status': {'State': state}}
+                  for query_execution_id, state in states.items()]
+    for execution in executions:
+        if execution['Status']['State'] == 'FAILED':
+            execution['Status']['StateChangeReason'] = 'SYNTAX_ERROR'
+    stubber.add_response('batch_get_query_execution', {'QueryExecutions': executions},
+                         {'QueryExecutionIds': list(states)})
+
+
+def test_run_queries_keeps_to_the_concurrency_limit(stubber, conn_athena):
+    # The Stubber fails on any call out of this order: a third query started before a slot frees up
+    expect_start(stubber, 'SELECT 0', 'q0')
+    expect_start(stubber, 'SELECT 1', 'q1')
+    expect_poll(stubber, {'q0': 'RUNNING', 'q1': 'SUCCEEDED'})
+    expect_start(stubber, 'SELECT 2', 'q2')
+    expect_poll(stubber, {'q0': 'RUNNING', 'q2': 'QUEUED'})
+    expect_poll(stubber, {'q0': 'SUCCEEDED', 'q2': 'FAILED'})
+
+    outcomes = list(conn_athena.run_queries(['SELECT 0', 'SELECT 1', 'SELECT 2'], DATABASE, OUTPUT,
+                                            max_concurrency=2))
+
+    # In completion order
+    assert [(o.index, o.query_execution_id, o.state) for o in outcomes] == [
+        (1, 'q1', 'SUCCEEDED'), (0, 'q0', 'SUCCEEDED'), (2, 'q2', 'FAILED')]
+    assert outcomes[2].reason == 'SYNTAX_ERROR'
+    assert not any(o.cached for o in outcomes)
+
+
+def test_run_queries_polls_in_batches_of_50(stubber, conn_athena):
+    ids = ['q{}'.format(i) for i in range(60)]
+    for i, query_execution_id in enumerate(ids):
+        expect_start(stubber, 'SELECT {}'.format(i), query_execution_id)
+    expect_poll(stubber, dict.fromkeys(ids[:50], 'SUCCEEDED'))
+    expect_poll(stubber, dict.fromkeys(ids[50:], 'SUCCEEDED'))
+
+    outcomes = list(conn_athena.run_queries(['SELECT {}'.format(i) for i in range(60)], DATABASE, OUTPUT,
+                                            max_concurrency=60))
+
+    assert [o.query_execution_id for o in outcomes] == ids
+
+
+def test_run_queries_reuses_cached_results(stubber, conn_athena):
+    cache = AthenaResultCache(ttl=60)
+    expect_start(stubber, 'SELECT * FROM t', 'q0')
+    expect_poll(stubber, {'q0': 'SUCCEEDED'})
+    expect_start(stubber, 'SELECT * FROM t', 'q1', database='other')
+    expect_poll(stubber, {'q1': 'SUCCEEDED'})
+    expect_start(stubber, 'SELECT * FROM t', 'q2', s3_output='s3://bucket/other')
+    expect_poll(stubber, {'q2': 'SUCCEEDED'})
+
+    first = list(conn_athena.run_queries(['SELECT * FROM t'], DATABASE, OUTPUT, cache=cache))
+    # Same normalized SQL, database and output location: no query started
+    again = list(conn_athena.run_queries(['  SELECT *\n  FROM t;'], DATABASE, OUTPUT, cache=cache))
+    other_database = list(conn_athena.run_queries(['SELECT * FROM t'], 'other', OUTPUT, cache=cache))
+    other_output = list(conn_athena.run_queries(['SELECT * FROM t'], DATABASE, 's3://bucket/other', cache=cache))
+
+    assert (first[0].query_execution_id, first[0].cached) == ('q0', False)
+    assert (again[0].query_execution_id, again[0].cached, again[0].state) == ('q0', True, 'SUCCEEDED')
+    assert other_database[0].query_execution_id == 'q1'
+    assert other_output[0].query_execution_id == 'q2'
+    assert (cache.hits, cache.misses) == (1, 3)
+
+
+def test_result_cache_expires():
+    cache = AthenaResultCache(ttl=0.01)
+    cache.put('SELECT 1', DATABASE, OUTPUT, 'q0')
+
+    assert cache.get('SELECT 1', DATABASE, OUTPUT) == 'q0'
+    time.sleep(0.02)
+    assert cache.get('SELECT 1', DATABASE, OUTPUT) is None
+
+
+def test_result_cache_skips_statements_that_are_not_reads():
+    cache = AthenaResultCache(ttl=60)
+    cache.put('MSCK REPAIR TABLE t', DATABASE, OUTPUT, 'q0')
+    cache.put('with x as (select 1) select * from x', DATABASE, OUTPUT, 'q1')
+
+    assert cache.get('MSCK REPAIR TABLE t', DATABASE, OUTPUT) is None
+    assert cache.get('with x as (select 1) select * from x', DATABASE, OUTPUT) == 'q1'
+
+
+def test_wait_for_query_raises_on_a_failed_query(stubber, conn_athena):
+    stubber.add_response('get_query_execution',
+                         {'QueryExecution': {'QueryExecutionId': 'q0',
+                                             'Status': {'State': 'FAILED', 'StateChangeReason': 'SYNTAX_ERROR'}}},
+                         {'QueryExecutionId': 'q0'})
+
+    with pytest.raises(AthenaQueryError) as error:
+        conn_athena.wait_for_query('q0')
+
+    assert (error.value.state, error.value.reason) == ('FAILED', 'SYNTAX_ERROR')
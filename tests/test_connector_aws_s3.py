@@ -0,0 +1,250 @@
+import io
+import json
+
+import pytest
+
+from src.lib.benchmarks.stand_ins import StubS3Client
+from src.lib.connectors.connector_aws_s3 import ConnectorS3
+from src.lib.connectors.s3_metadata_cache import S3MetadataCache
+from src.lib.connectors.settings import override
+
+
+@pytest.fixture
+def s3_client():
+    return StubS3Client()
+
+
+@pytest.fixture
+def conn_s3(s3_client):
+    return ConnectorS3('bucket', client=s3_client)
+
+
+def test_write_json_sends_small_documents_in_one_put(conn_s3, s3_client):
+    assert conn_s3.write_json({'updated': '2020-01-01 00:00'}, 'state.json') is True
+
+    assert json.loads(s3_client.objects['state.json']['Body']) == {'updated': '2020-01-01 00:00'}
+    assert s3_client.calls == {'PutObject': 1}
+
+
+def test_write_json_dedup_skips_an_unchanged_document(conn_s3, s3_client):
+    assert conn_s3.write_json({'a': 1}, 'state.json', dedup=True) is True
+    assert conn_s3.write_json({'a': 1}, 'state.json', dedup=True) is False
+    assert s3_client.calls['PutObject'] == 1
+
+
+def test_write_json_streams_large_documents(conn_s3, s3_client):
+    document = {'issues': [{'key': 'TEST-{}'.format(i), 'summary': 'x' * 100} for i in range(2000)]}
+
+    conn_s3.write_json(document, 'issues.json', stream=True)
+
+    assert json.loads(s3_client.objects['issues.json']['Body']) == document
+    assert conn_s3.read_json('issues.json') == document
+
+
+@pytest.fixture
+def metadata_cache(tmp_path):
+    return S3MetadataCache(ttl=60, sqlite_path=str(tmp_path / 'cache.db'), max_listing_keys=100)
+
+
+def test_delete_keys_invalidates_a_batch_in_one_transaction(s3_client, metadata_cache):
+    conn_s3 = ConnectorS3('bucket', client=s3_client, metadata_cache=metadata_cache)
+    for i in range(30):
+        s3_client.put_object(Bucket='bucket', Key='logs/{:02d}'.format(i), Body=b'x')
+    s3_client.put_object(Bucket='bucket', Key='other/1', Body=b'x')
+    assert len(conn_s3.list_objects('logs/')) == 30
+    assert conn_s3.list_objects('other/') == ['other/1']
+    statements = []
+    metadata_cache._db.set_trace_callback(statements.append)
+
+    conn_s3.delete_keys(['logs/{:02d}'.format(i) for i in range(20)])
+
+    assert sum(statement == 'COMMIT' for statement in statements) == 1
+    assert metadata_cache.get('bucket', 'logs/00') is None
+    assert metadata_cache.get('bucket', 'logs/25') is not None
+    # The listing holding the deleted keys is dropped, the other one is still served from the cache
+    assert metadata_cache.get_listing('bucket', 'logs/') is None
+    assert metadata_cache.get_listing('bucket', 'other/') == (('other/1', 1),)
+    assert conn_s3.list_objects('logs/') == ['logs/{:02d}'.format(i) for i in range(20, 30)]
+
+
+def test_only_listings_under_the_size_bound_are_cached(s3_client, metadata_cache):
+    conn_s3 = ConnectorS3('bucket', client=s3_client, metadata_cache=metadata_cache)
+    for i in range(150):
+        s3_client.put_object(Bucket='bucket', Key='big/{:03d}'.format(i), Body=b'x')
+    for i in range(3):
+        s3_client.put_object(Bucket='bucket', Key='small/{}'.format(i), Body=b'x')
+
+    assert conn_s3.list_objects('big/', give_size=True) == (['big/{:03d}'.format(i) for i in range(150)], 150)
+    assert conn_s3.list_objects('small/', suffix='2') == ['small/2']
+    listed = s3_client.calls['ListObjectsV2']
+    conn_s3.list_objects('big/')
+    conn_s3.list_objects('small/')
+
+    assert s3_client.calls['ListObjectsV2'] == listed + 1
+    assert metadata_cache.get_listing('bucket', 'big/') is None
+    # The object metadata of the large listing is cached all the same
+    assert metadata_cache.get('bucket', 'big/149').size == 1
+
+
+def test_parallel_listing_shards_level_by_level(conn_s3, s3_client):
+    keys = ['p/{}/{}/f{}'.format(top, sub, i) for top in ('d0', 'd1') for sub in 'abcd' for i in range(3)]
+    keys += ['p/d0/direct', 'p/readme'] + ['p/top{:04d}'.format(i) for i in range(2500)]
+    for key in keys:
+        s3_client.put_object(Bucket='bucket', Key=key, Body=b'x')
+    record = conn_s3._object_record(('Key',))
+
+    segments = conn_s3._delimiter_shards('p/', '/', '', record, max_workers=4)
+
+    # Two sub-prefixes are fewer than the workers: the level below is listed, giving 8
+    assert [segment[0] for segment in segments if segment[3] is None] == [
+        'p/{}/{}/'.format(top, sub) for top in ('d0', 'd1') for sub in 'abcd']
+    # The direct objects come in page-sized runs, not one segment each
+    direct = [segment for segment in segments if segment[3] is not None]
+    assert sum(len(segment[3]) for segment in direct) == 2502
+    assert len(direct) <= 5
+    for ordered in (True, False):
+        listed = [r.Key for r in conn_s3.iter_objects_parallel('p/', max_workers=4, ordered=ordered)]
+        assert listed == sorted(keys) if ordered else sorted(listed) == sorted(keys)
+
+
+def test_parallel_listing_of_a_flat_prefix_splits_key_ranges(conn_s3, s3_client):
+    keys = ['flat/{:04d}'.format(i) for i in range(1500)]
+    for key in keys:
+        s3_client.put_object(Bucket='bucket', Key=key, Body=b'x')
+
+    assert conn_s3._delimiter_shards('flat/', '/', '', conn_s3._object_record(('Key',)), max_workers=4) is None
+    assert [r.Key for r in conn_s3.iter_objects_parallel('flat/', ordered=True)] == keys
+
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 3, 7, 1024])
+def test_iter_json_joins_documents_split_across_chunks(conn_s3, s3_client, chunk_size):
+    content = '12345 -1.5e+3\n{"a": [1, 2]}"text" true 678 null\n[{"b": 0.25}]\n9'
+    s3_client.put_object(Bucket='bucket', Key='documents.json', Body=content.encode('utf-8'))
+
+    assert list(conn_s3.iter_json('documents.json', chunk_size=chunk_size)) == [
+        12345, -1500.0, {'a': [1, 2]}, 'text', True, 678, None, [{'b': 0.25}], 9]
+
+
+@pytest.fixture
+def locked_keys(s3_client, monkeypatch):
+    """
+    Keys delete_objects reports as errors instead of deleting
+    """
+    locked = set()
+    delete_objects = s3_client.delete_objects
+
+    def partly_failing(Bucket, Delete, **kwargs):
+        objects = [obj for obj in Delete['Objects'] if obj['Key'] not in locked]
+        delete_objects(Bucket=Bucket, Delete=dict(Delete, Objects=objects), **kwargs)
+        return {'Errors': [{'Key': obj['Key'], 'Code': 'AccessDenied', 'Message': 'Access Denied'}
+                           for obj in Delete['Objects'] if obj['Key'] in locked]}
+
+    monkeypatch.setattr(s3_client, 'delete_objects', partly_failing)
+    return locked
+
+
+def test_delete_objects_in_s3_reports_failed_deletions(conn_s3, s3_client, locked_keys):
+    for i in range(3):
+        s3_client.put_object(Bucket='bucket', Key='old/{}'.format(i), Body=b'xx')
+    locked_keys.add('old/1')
+
+    report = conn_s3.delete_objects_in_s3('old/')
+
+    assert (report['deleted'], report['bytes_freed'], report['failed']) == (2, 4, {'old/1': 'Access Denied'})
+    assert conn_s3.list_objects('old/') == ['old/1']
+
+
+def test_copy_and_sync_reports_share_the_batch_deletion(conn_s3, s3_client, locked_keys, tmp_path):
+    for key in ('src/a', 'src/b', 'dst/stale', 'dst/locked'):
+        s3_client.put_object(Bucket='bucket', Key=key, Body=b'x')
+    locked_keys.update({'src/b', 'dst/locked'})
+
+    moved = conn_s3.copy_objects([('src/a', 'moved/a'), ('src/b', 'moved/b')], delete_source=True)
+    synced = conn_s3.sync_directory(str(tmp_path), 'dst', delete=True)
+
+    assert (moved['deleted'], moved['failed']) == (['src/a'], {'src/b': 'Access Denied'})
+    assert (synced['deleted'], synced['failed']) == (['dst/stale'], {'dst/locked': 'Access Denied'})
+
+
+class ShortReads(io.RawIOBase):
+    """
+    A raw stream returning at most 1 MiB per read, like an unbuffered S3ObjectReader
+    """
+
+    def __init__(self, data):
+        self.data = io.BytesIO(data)
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        chunk = self.data.read(min(len(buffer), 1024 ** 2))
+        buffer[:len(chunk)] = chunk
+        return len(chunk)
+
+
+def test_put_object_stream_fills_parts_from_short_reads(conn_s3, s3_client, monkeypatch):
+    part_sizes = []
+    upload_part = s3_client.upload_part
+
+    def recorded(**kwargs):
+        part_sizes.append(len(kwargs['Body']))
+        return upload_part(**kwargs)
+
+    monkeypatch.setattr(s3_client, 'upload_part', recorded)
+    data = bytes(range(256)) * (11 * 1024 ** 2 // 256)
+
+    conn_s3.put_object_stream(ShortReads(data), 'stream.bin', transfer_config={'part_size': 5 * 1024 ** 2})
+
+    assert sorted(part_sizes) == [1024 ** 2, 5 * 1024 ** 2, 5 * 1024 ** 2]
+    assert s3_client.objects['stream.bin']['Body'] == data
+
+
+def test_put_object_sizes_strings_in_utf8_bytes(conn_s3, s3_client):
+    # 3M characters fit in one 5 MiB part, their 6 MB of UTF-8 do not
+    text = 'é' * (3 * 1000 ** 2)
+
+    with override(S3_TRANSFER_PART_SIZE=5 * 1024 ** 2):
+        conn_s3.put_object(text, 'text.txt')
+
+    assert s3_client.calls.get('PutObject', 0) == 0
+    assert s3_client.calls['CompleteMultipartUpload'] == 1
+    assert s3_client.objects['text.txt']['Body'].decode('utf-8') == text
+
+
+def test_open_writer_sends_parts_as_they_fill(conn_s3, s3_client):
+    chunk = bytes(range(256)) * 4096
+
+    with conn_s3.open_writer('big.bin', transfer_config={'part_size': 5 * 1024 ** 2}) as fp:
+        for i in range(12):
+            fp.write(chunk)
+            # Never more than one part held
+            assert s3_client.calls.get('UploadPart', 0) == (i + 1) // 5
+        assert fp.tell() == 12 * len(chunk)
+
+    assert s3_client.calls['UploadPart'] == 3
+    assert s3_client.objects['big.bin']['Body'] == chunk * 12
+
+
+def test_open_writer_puts_a_small_file_in_one_request(conn_s3, s3_client):
+    with conn_s3.open_writer('small.txt', metadata={'source': 'test'}) as fp:
+        fp.write(b'content')
+
+    assert s3_client.calls == {'PutObject': 1}
+    assert s3_client.objects['small.txt']['Metadata'] == {'source': 'test'}
+
+
+def test_open_writer_aborts_the_upload_on_a_failed_part(conn_s3, s3_client, monkeypatch):
+    fp = conn_s3.open_writer('failed.bin', transfer_config={'part_size': 5 * 1024 ** 2})
+    fp.write(b'x' * 5 * 1024 ** 2)
+
+    def failing_complete(**kwargs):
+        raise ConnectionError('Injected fault')
+
+    monkeypatch.setattr(s3_client, 'complete_multipart_upload', failing_complete)
+    with pytest.raises(ConnectionError):
+        fp.close()
+
+    assert s3_client.calls['AbortMultipartUpload'] == 1
+    assert 'failed.bin' not in s3_client.objects
+    assert fp.closed
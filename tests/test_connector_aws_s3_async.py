@@ -0,0 +1,135 @@
+import asyncio
+import itertools
+import os
+
+import pytest
+
+pytest.importorskip('aiobotocore')
+ThreadedMotoServer = pytest.importorskip('moto.server').ThreadedMotoServer
+
+from src.lib.connectors import connector_aws_s3_async
+from src.lib.connectors.connector_aws_s3 import ConnectorS3
+from src.lib.connectors.connector_aws_s3_async import AsyncConnectorS3
+
+_buckets = itertools.count()
+
+
+@pytest.fixture(scope='module')
+def endpoint():
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+    server = ThreadedMotoServer(ip_address='127.0.0.1', port=0, verbose=False)
+    server.start()
+    # 'local' in the endpoint makes the connectors use dummy credentials
+    yield 'http://localhost:{}'.format(server.get_host_and_port()[1])
+    server.stop()
+
+
+@pytest.fixture
+def bucket(endpoint):
+    bucket = 'async-{}'.format(next(_buckets))
+    ConnectorS3(bucket, endpoint_url=endpoint).client.create_bucket(Bucket=bucket)
+    return bucket
+
+
+def run(endpoint, bucket, scenario, **kwargs):
+    async def main():
+        async with AsyncConnectorS3(bucket, endpoint_url=endpoint, **kwargs) as s3:
+            return await scenario(s3)
+    return asyncio.run(main())
+
+
+def test_put_and_get_object(endpoint, bucket):
+    async def scenario(s3):
+        await s3.put_object('content', 'dir/key', metadata={'source': 'test'})
+        return await s3.get_object('dir/key'), await s3.get_object('dir/missing')
+
+    assert run(endpoint, bucket, scenario) == ('content', None)
+    head = ConnectorS3(bucket, endpoint_url=endpoint).client.head_object(Bucket=bucket, Key='dir/key')
+    assert head['Metadata'] == {'source': 'test'}
+
+
+def test_read_and_write_json(endpoint, bucket):
+    async def scenario(s3):
+        await s3.write_json({'watermark': '2020-01-01', 'ids': [1, 2]}, 'state.json')
+        return await s3.read_json('state.json')
+
+    assert run(endpoint, bucket, scenario) == {'watermark': '2020-01-01', 'ids': [1, 2]}
+
+
+def test_list_objects_pages_through_the_prefix(endpoint, bucket):
+    keys = ['logs/{:02d}.txt'.format(i) for i in range(25)] + ['logs/readme.md', 'other/1.txt']
+    pages = 0
+
+    async def scenario(s3):
+        await asyncio.gather(*(s3.put_object('x' * 10, key) for key in keys))
+        list_objects_v2 = s3.client.list_objects_v2
+
+        async def paged(**kwargs):
+            nonlocal pages
+            pages += 1
+            return await list_objects_v2(MaxKeys=10, **kwargs)
+
+        s3.client.list_objects_v2 = paged
+        return (await s3.list_objects('logs/'), await s3.list_objects('logs/', limit=5),
+                await s3.list_objects('logs/', give_size=True, suffix='.md'),
+                [obj['Key'] async for obj in s3.iter_objects('logs/', start_after='logs/23.txt')])
+
+    listed, limited, (markdown, size), after = run(endpoint, bucket, scenario)
+    assert listed == sorted(keys[:-1])
+    assert limited == listed[:5]
+    assert (markdown, size) == (['logs/readme.md'], 10)
+    assert after == ['logs/24.txt', 'logs/readme.md']
+    assert pages == 3 + 1 + 3 + 1
+
+
+def test_copy_files_and_move(endpoint, bucket):
+    async def scenario(s3):
+        await asyncio.gather(*(s3.put_object(str(i), 'src/{}.txt'.format(i)) for i in range(3)))
+        copied = await s3.copy_files('copy', source_folder='src', files=['0.txt', '1.txt'])
+        moved = await s3.copy_files('moved', source_folder='src', files=['2.txt', 'missing.txt'],
+                                    delete_source_after_copy=True)
+        return copied, moved, await s3.list_objects('')
+
+    copied, moved, keys = run(endpoint, bucket, scenario)
+    assert copied == {'copied': ['src/0.txt', 'src/1.txt'], 'deleted': [], 'failed': {}}
+    assert (moved['copied'], moved['deleted'], list(moved['failed'])) == (['src/2.txt'], ['src/2.txt'],
+                                                                          ['src/missing.txt'])
+    assert keys == ['copy/0.txt', 'copy/1.txt', 'moved/2.txt', 'src/0.txt', 'src/1.txt']
+
+
+def test_delete_object_and_batches(endpoint, bucket, monkeypatch):
+    monkeypatch.setattr(connector_aws_s3_async, 'DELETE_BATCH_SIZE', 10)
+    keys = ['del/{:02d}'.format(i) for i in range(30)]
+
+    async def scenario(s3):
+        await asyncio.gather(*(s3.put_object('x', key) for key in keys + ['single']))
+        await s3.delete_object('single')
+        await s3.delete_object(keys[:25])
+        return await s3.list_objects('')
+
+    assert run(endpoint, bucket, scenario) == keys[25:]
+
+
+def test_requests_in_flight_stay_under_max_concurrency(endpoint, bucket):
+    in_flight = peak = 0
+
+    async def scenario(s3):
+        await s3.open()
+        put_object = s3.client.put_object
+
+        async def counted(**kwargs):
+            nonlocal in_flight, peak
+            in_flight += 1
+            peak = max(peak, in_flight)
+            try:
+                await asyncio.sleep(0.01)
+                return await put_object(**kwargs)
+            finally:
+                in_flight -= 1
+
+        s3.client.put_object = counted
+        await asyncio.gather(*(s3.put_object('x', 'k/{}'.format(i)) for i in range(40)))
+        return await s3.list_objects('k/')
+
+    assert len(run(endpoint, bucket, scenario, max_concurrency=4)) == 40
+    assert peak == 4
@@ -0,0 +1,39 @@
+import gzip
+import json
+
+import pytest
+
+from src.lib.connectors.connector_file import ConnectorFile
+from src.lib.logs.logger import Logger
+
+
+def test_save_rows_to_jsonlfile(tmp_path):
+    path = ConnectorFile(str(tmp_path)).save_rows_to_jsonlfile(({'id': i} for i in range(3)), 'rows.jsonl.gz',
+                                                               compression='gzip')
+
+    with gzip.open(path, 'rt', encoding='utf-8') as fp:
+        assert [json.loads(line) for line in fp] == [{'id': 0}, {'id': 1}, {'id': 2}]
+
+
+def test_save_rows_to_jsonlfile_logs_and_raises_on_error(tmp_path, capsys):
+    with pytest.raises(TypeError):
+        ConnectorFile(str(tmp_path)).save_rows_to_jsonlfile([{'id': 0}, {'id': object()}], 'rows.jsonl')
+    Logger.flush()
+
+    output = capsys.readouterr().out
+    assert 'ERROR: Could not write {}/rows.jsonl'.format(tmp_path) in output
+    assert 'TypeError' in output
+
+
+def test_save_df_raises_on_error(tmp_path):
+    pandas = pytest.importorskip('pandas')
+
+    with pytest.raises(OSError):
+        ConnectorFile(str(tmp_path / 'missing')).save_df(pandas.DataFrame({'id': [1]}), 'rows.csv')
+
+
+def test_save_dict_to_csvfile_still_returns_none_on_error(tmp_path, capsys):
+    assert ConnectorFile(str(tmp_path / 'missing')).save_dict_to_csvfile([{'id': 1}], 'rows.csv', ['id']) is None
+    Logger.flush()
+
+    assert 'ERROR: Could not write' in capsys.readouterr().out
@@ -0,0 +1,65 @@
+import pytest
+
+from src.lib.benchmarks.stand_ins import FakeJiraServer
+from src.lib.connectors.connector_jira import ConnectorJIRA
+from src.lib.connectors.settings import override
+
+JQL = 'project = Testing ORDER BY key'
+
+
+@pytest.fixture
+def jira_server():
+    with FakeJiraServer(issues=250) as server:
+        yield server
+
+
+def test_iter_issues_fetches_every_page_in_order(jira_server):
+    conn_jira = ConnectorJIRA(endpoint_url=jira_server.url)
+
+    issues = list(conn_jira.iter_issues(JQL, page_size=20, max_workers=3))
+
+    assert [issue['key'] for issue in issues] == ['TEST-{}'.format(i + 1) for i in range(250)]
+    assert jira_server.requests == 13
+
+
+def test_iter_issues_keeps_to_the_server_page_cap():
+    with FakeJiraServer(issues=250, max_results_cap=30) as server:
+        issues = list(ConnectorJIRA(endpoint_url=server.url).iter_issues(JQL, page_size=100, max_workers=4))
+
+        assert len(issues) == 250
+        assert len({issue['key'] for issue in issues}) == 250
+        assert server.requests == 9
+
+
+def test_iter_issues_projects_fields(jira_server):
+    issues = list(ConnectorJIRA(endpoint_url=jira_server.url).iter_issues(JQL, fields=['summary', 'status']))
+
+    assert len(issues) == 250
+    assert all(set(issue['fields']) == {'summary', 'status'} for issue in issues)
+    assert issues[0]['fields']['status'] == {'name': 'To Do'}
+
+
+def test_iter_issues_of_an_empty_result_makes_one_request(jira_server):
+    assert list(ConnectorJIRA(endpoint_url=jira_server.url).iter_issues('key in (NOPE-1)')) == []
+    assert jira_server.requests == 1
+
+
+def test_execute_jql_todict(jira_server):
+    result = ConnectorJIRA(endpoint_url=jira_server.url).execute_jql_todict('key in (TEST-3, TEST-7)')
+
+    assert result['total'] == 2
+    assert [issue['key'] for issue in result['issues']] == ['TEST-3', 'TEST-7']
+
+
+def test_not_found_returns_none(jira_server):
+    # The stand-in only serves the search endpoint, the boards answer 404
+    assert ConnectorJIRA(endpoint_url=jira_server.url).get_all_agile_boards() is None
+
+
+def test_failure_raises():
+    with override(RESILIENCE_MAX_ATTEMPTS=2), FakeJiraServer(issues=10, fault_rate=1.0, fault_status=500) as server:
+        with pytest.raises(Exception) as error:
+            ConnectorJIRA(endpoint_url=server.url).execute_jql_todict(JQL)
+
+        assert error.value.response.status_code == 500
+        assert server.requests == 2
@@ -0,0 +1,48 @@
+import array
+import math
+
+import pytest
+
+from src.lib.connectors.csv_reader import CsvReader, _MappedLines
+
+CONTENT = 'id,points,done,summary\n1,2.5,true,"first,\nline"\n2,,false,second\n3,1\n,4.0,yes,fourth\n'
+
+
+@pytest.fixture(params=[False, True], ids=['read', 'mmap'])
+def reader(request, tmp_path):
+    file_path = tmp_path / 'issues.csv'
+    file_path.write_text(CONTENT, encoding='utf-8')
+    return CsvReader.from_path(str(file_path), use_mmap=request.param)
+
+
+def test_iter_rows_pads_short_rows(reader):
+    assert list(reader.iter_rows()) == [('1', '2.5', 'true', 'first,\nline'), ('2', '', 'false', 'second'),
+                                        ('3', '1', None, None), ('', '4.0', 'yes', 'fourth')]
+    assert reader.count_rows() == 4
+
+
+def test_mapped_lines_split_blocks_inside_characters(tmp_path):
+    file_path = tmp_path / 'names.csv'
+    file_path.write_text('name\n' + 'é€\n' * 1000, encoding='utf-8')
+    reader = CsvReader(lambda: _MappedLines(str(file_path), 'utf-8', block_size=7))
+
+    assert [row[0] for row in reader.iter_rows()] == ['é€'] * 1000
+
+
+def test_column_batches_keep_missing_values(reader):
+    types = {'id': int, 'points': float, 'done': bool}
+
+    batches = list(reader.iter_column_batches(batch_rows=2, types=types, columns=['id', 'points', 'done']))
+
+    assert batches[0]['id'] == array.array('q', [1, 2])
+    assert [math.isnan(value) for value in batches[0]['points']] == [False, True]
+    # An empty int field turns the column of its batch into a list
+    assert batches[1]['id'] == [3, None]
+    assert batches[1]['points'] == array.array('d', [1.0, 4.0])
+    assert list(batches[1]['done']) == [False, True]
+
+
+def test_column_batches_cast_with_a_callable(reader):
+    batches = list(reader.iter_column_batches(types={'summary': str.upper}, columns=['summary']))
+
+    assert batches[0]['summary'] == ['FIRST,\nLINE', 'SECOND', None, 'FOURTH']
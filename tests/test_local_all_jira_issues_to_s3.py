@@ -0,0 +1,80 @@
+import csv
+import gzip
+import io
+import json
+
+import pytest
+
+from src.lib.benchmarks.stand_ins import FakeJiraServer, StubS3Client
+from src.lib.connectors import client_pool
+from src.lib.connectors.settings import override, setting
+from src.lib.pipelines import local_all_jira_issues_to_s3
+from src.lib.pipelines.runner import LocalCheckpoints
+
+
+@pytest.fixture
+def s3_client():
+    # Every ConnectorS3 of the pipeline gets the stand-in from the pool
+    return client_pool.set_client('s3', StubS3Client(), endpoint_url=setting('S3_ENDPOINT'))
+
+
+@pytest.fixture
+def jira_server():
+    with FakeJiraServer(issues=120, max_results_cap=50) as server, override(JIRA_ENDPOINT=server.url):
+        yield server
+
+
+def test_streams_csv_without_checkpoints(s3_client, jira_server, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+    metrics = local_all_jira_issues_to_s3.run_all_issues_to_s3()
+
+    rows = list(csv.DictReader(io.StringIO(s3_client.objects['Uploads/issues.csv']['Body'].decode('utf-8'))))
+    assert [row['key'] for row in rows] == ['TEST-{}'.format(i + 1) for i in range(120)]
+    assert rows[2]['status'] == 'Done'
+    assert not any(stage.resumed for stage in metrics)
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_checkpointed_run_clears_its_checkpoints(s3_client, jira_server, tmp_path):
+    local_all_jira_issues_to_s3.run_all_issues_to_s3(output_format='jsonl', compression='gzip',
+                                                     checkpoints=LocalCheckpoints(str(tmp_path)), run_id='test')
+
+    lines = gzip.decompress(s3_client.objects['Uploads/issues.jsonl.gz']['Body']).decode('utf-8').splitlines()
+    assert [json.loads(line)['id'] for line in lines] == [str(10000 + i) for i in range(120)]
+    assert not list(tmp_path.rglob('*.jsonl.gz'))
+
+
+def parquet_keys(s3_client):
+    return [key for key in s3_client.keys if key.startswith(local_all_jira_issues_to_s3.PARQUET_PREFIX)]
+
+
+def test_parquet_export_replaces_the_previous_one_once_complete(s3_client, jira_server):
+    pq = pytest.importorskip('pyarrow.parquet')
+    local_all_jira_issues_to_s3.run_all_issues_to_s3(output_format='parquet', partition_cols=['status'])
+    first = parquet_keys(s3_client)
+
+    local_all_jira_issues_to_s3.run_all_issues_to_s3(output_format='parquet', partition_cols=['status'])
+
+    keys = parquet_keys(s3_client)
+    assert len(keys) == len(first) == 3
+    assert not set(keys) & set(first)
+    assert all(key.split('/')[2].startswith('status=') for key in keys)
+    rows = sum(pq.read_table(io.BytesIO(s3_client.objects[key]['Body'])).num_rows for key in keys)
+    assert rows == 120
+
+
+def test_failed_parquet_load_keeps_the_previous_export(s3_client, jira_server, monkeypatch):
+    pytest.importorskip('pyarrow')
+    local_all_jira_issues_to_s3.run_all_issues_to_s3(output_format='parquet')
+    previous = parquet_keys(s3_client)
+
+    def failing_copy(*args, **kwargs):
+        raise ConnectionError('Injected fault')
+
+    monkeypatch.setattr(s3_client, 'copy_object', failing_copy)
+    with override(PIPELINE_STAGE_ATTEMPTS=1), pytest.raises(IOError):
+        local_all_jira_issues_to_s3.run_all_issues_to_s3(output_format='parquet')
+
+    # The staged files are gone, the table still reads the previous export
+    assert parquet_keys(s3_client) == previous
@@ -0,0 +1,69 @@
+import io
+import json
+import os
+import sys
+
+import pytest
+
+from src.lib.connectors.settings import override
+from src.lib.logs import logger
+from src.lib.logs.logger import Logger
+
+
+@pytest.fixture(autouse=True)
+def fresh_logger(monkeypatch):
+    logger._stop()
+    monkeypatch.setattr(Logger, 'output_format', None)
+    monkeypatch.setattr(logger, '_set_level', None)
+    monkeypatch.setattr(logger, '_level', 0)
+    yield
+    logger._stop()
+
+
+def test_level_and_format_are_read_from_the_settings_when_the_writer_starts(capsys):
+    with override(LOG_LEVEL='WARNING', LOG_FORMAT='json'):
+        Logger.info('skipped')
+        Logger.warning('Copied {} objects', 3, bucket='bucket')
+        Logger.flush()
+
+    records = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert [(r['level'], r['message'], r['bucket']) for r in records] == [('WARNING', 'Copied 3 objects', 'bucket')]
+
+
+def test_set_level_is_kept_over_the_setting(capsys):
+    Logger.set_level('ERROR')
+    with override(LOG_LEVEL='DEBUG'):
+        Logger.warning('skipped')
+        Logger.error('written')
+        Logger.flush()
+
+    assert capsys.readouterr().out == 'ERROR: written\n'
+
+
+def test_metrics_file_is_read_from_the_settings_at_exit(tmp_path):
+    path = tmp_path / 'metrics.prom'
+    Logger.metrics.count('test_logger_records_total')
+
+    with override(METRICS_PROMETHEUS_FILE=str(path)):
+        logger._stop()
+
+    assert 'test_logger_records_total' in path.read_text()
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='fork only')
+def test_a_forked_child_writes_its_records():
+    # The parent's writer is running when the child is forked
+    Logger.info('parent record')
+    Logger.flush()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            sys.stdout = io.StringIO()
+            Logger.info('child record')
+            Logger.flush(timeout=5)
+            os._exit(0 if sys.stdout.getvalue() == 'child record\n' else 1)
+        finally:
+            os._exit(2)
+
+    _, status = os.waitpid(pid, 0)
+    assert os.waitstatus_to_exitcode(status) == 0
@@ -0,0 +1,206 @@
+import time
+
+import boto3
+import pytest
+from botocore.exceptions import ClientError
+from moto import mock_aws
+
+from src.lib.benchmarks.stand_ins import AWSFaultInjector, FakeJiraServer
+from src.lib.connectors import client_pool
+from src.lib.connectors.connector_aws_s3 import ConnectorS3
+from src.lib.connectors.resilience import (AdaptiveRateLimiter, CircuitBreaker, CircuitOpenError, Resilience,
+                                           RetryPolicy, classify, THROTTLED, TRANSIENT, NOT_FOUND, FAILED)
+from src.lib.connectors.settings import override
+
+
+def client_error(code, status):
+    return ClientError({'Error': {'Code': code}, 'ResponseMetadata': {'HTTPStatusCode': status}}, 'GetObject')
+
+
+class Flaky:
+    """
+    Raises the given errors in turn, then returns 'ok'
+    """
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return 'ok'
+
+
+@pytest.mark.parametrize('error, outcome', [
+    (client_error('SlowDown', 503), THROTTLED),
+    (client_error('ThrottlingException', 400), THROTTLED),
+    (client_error('InternalError', 500), TRANSIENT),
+    (client_error('ServiceUnavailable', 503), TRANSIENT),
+    (client_error('NoSuchKey', 404), NOT_FOUND),
+    (client_error('AccessDenied', 403), FAILED),
+    (client_error('NotImplemented', 501), FAILED),
+    (ConnectionResetError(), TRANSIENT),
+    (ValueError(), FAILED),
+])
+def test_classify(error, outcome):
+    assert classify(error) == outcome
+
+
+def test_classify_statuses():
+    assert classify(status=429) == THROTTLED
+    assert classify(status=503) == TRANSIENT
+    assert classify(status=200) is None
+
+
+def test_rate_limiter_spaces_calls_at_the_rate():
+    limiter = AdaptiveRateLimiter(10, burst=1)
+
+    waits = [limiter.reserve() for _ in range(4)]
+
+    assert waits[0] == 0
+    assert waits[1:] == pytest.approx([0.1, 0.2, 0.3], abs=0.01)
+
+
+def test_rate_limiter_halves_once_per_throttle_burst_and_recovers():
+    limiter = AdaptiveRateLimiter(100)
+
+    limiter.throttled()
+    limiter.throttled()
+    assert limiter.rate == 50
+    limiter.succeeded()
+    assert limiter.rate == 51
+
+
+def test_retry_delay_is_jittered_and_bounded():
+    policy = RetryPolicy(attempts=5, backoff=1, max_delay=3)
+
+    first = [policy.delay(1) for _ in range(50)]
+    fourth = [policy.delay(4) for _ in range(50)]
+
+    assert all(0 <= delay <= 1 for delay in first)
+    assert all(0 <= delay <= 3 for delay in fourth)
+    assert len(set(first)) > 1
+
+
+@pytest.mark.parametrize('error', [client_error('SlowDown', 503), client_error('InternalError', 500),
+                                   ConnectionResetError()])
+def test_call_retries_throttled_and_transient_errors(error):
+    function = Flaky(error, error)
+
+    assert Resilience('test', retry=RetryPolicy(attempts=3)).call(function) == 'ok'
+    assert function.calls == 3
+
+
+def test_call_gives_up_after_the_last_attempt():
+    function = Flaky(*[client_error('SlowDown', 503)] * 3)
+
+    with pytest.raises(ClientError):
+        Resilience('test', retry=RetryPolicy(attempts=3)).call(function)
+    assert function.calls == 3
+
+
+def test_call_does_not_retry_not_found():
+    function = Flaky(client_error('NoSuchKey', 404))
+
+    with pytest.raises(ClientError):
+        Resilience('test', retry=RetryPolicy(attempts=3)).call(function)
+    assert function.calls == 1
+
+
+def test_circuit_breaker_opens_half_opens_and_closes():
+    breaker = CircuitBreaker('test', failure_threshold=2, reset_timeout=0.05)
+
+    breaker.failed()
+    assert breaker.state == 'closed'
+    breaker.failed()
+    assert breaker.state == 'open'
+    with pytest.raises(CircuitOpenError):
+        breaker.check()
+
+    time.sleep(0.06)
+    assert breaker.state == 'half_open'
+    breaker.check()
+    # A failed trial call opens it again at once
+    breaker.failed()
+    assert breaker.state == 'open'
+
+    time.sleep(0.06)
+    breaker.succeeded()
+    assert breaker.state == 'closed'
+    breaker.check()
+
+
+def test_open_circuit_fails_calls_without_running_them():
+    resilience = Resilience('test', retry=RetryPolicy(attempts=1),
+                            breaker=CircuitBreaker('test', failure_threshold=1, reset_timeout=60))
+    function = Flaky(client_error('InternalError', 500))
+    with pytest.raises(ClientError):
+        resilience.call(function)
+
+    with pytest.raises(CircuitOpenError):
+        resilience.call(function)
+    assert function.calls == 1
+
+
+@pytest.mark.parametrize('status', [429, 503])
+def test_http_session_retries_throttled_and_unavailable_responses(status):
+    with override(RESILIENCE_MAX_ATTEMPTS=3), FakeJiraServer(fault_rate=1.0, fault_status=status) as server:
+        response = client_pool.get_http_session(server.url, service='jira').get(server.url + '/rest/api/2/search')
+
+        # The last response comes back as is, for raise_for_status
+        assert response.status_code == status
+        assert server.requests == 3
+
+
+def test_http_session_honours_retry_after():
+    with override(RESILIENCE_MAX_ATTEMPTS=2, RESILIENCE_MAX_DELAY=1), \
+            FakeJiraServer(fault_rate=1.0, fault_status=429, retry_after=0.2) as server:
+        started_at = time.monotonic()
+        client_pool.get_http_session(server.url, service='jira').get(server.url + '/rest/api/2/search')
+
+        assert time.monotonic() - started_at >= 0.2
+
+
+def test_http_session_does_not_retry_not_found():
+    with override(RESILIENCE_MAX_ATTEMPTS=3), FakeJiraServer() as server:
+        response = client_pool.get_http_session(server.url, service='jira').get(server.url + '/rest/api/2/issue/1')
+
+        assert response.status_code == 404
+        assert server.requests == 0
+
+
+@pytest.fixture
+def conn_s3(monkeypatch):
+    for name in ('AWS_ACCESS_KEY_ID', 'AWS_SECRET_ACCESS_KEY'):
+        monkeypatch.setenv(name, 'testing')
+    with mock_aws(), override(RESILIENCE_MAX_ATTEMPTS=3):
+        boto3.client('s3', region_name='us-east-1').create_bucket(Bucket='bucket')
+        conn_s3 = ConnectorS3(bucket='bucket')
+        conn_s3.client.put_object(Bucket='bucket', Key='key', Body=b'content')
+        yield conn_s3
+
+
+def test_get_object_raises_on_slowdown(conn_s3):
+    faults = AWSFaultInjector(rate=1.0, kind='throttle', operations={'GetObject'}).attach(conn_s3.client)
+
+    with pytest.raises(ClientError) as error:
+        conn_s3.get_object('key')
+
+    assert error.value.response['Error']['Code'] == 'SlowDown'
+    assert faults.requests == 3
+
+
+def test_get_object_retries_through_slowdown(conn_s3):
+    faults = AWSFaultInjector(rate=0.5, kind='throttle', operations={'GetObject'}, seed=3).attach(conn_s3.client)
+
+    assert [conn_s3.get_object('key') for _ in range(10)] == ['content'] * 10
+    assert faults.faults > 0
+
+
+def test_get_object_returns_none_on_missing_key(conn_s3):
+    faults = AWSFaultInjector(rate=0.0, operations={'GetObject'}).attach(conn_s3.client)
+
+    assert conn_s3.get_object('missing') is None
+    assert faults.requests == 1
@@ -0,0 +1,98 @@
+import pytest
+
+from src.lib.pipelines.runner import LocalCheckpoints, Pipeline, RetryPolicy, Stage
+
+
+class Flaky:
+    """
+    A stage failing on its first calls, then passing its input through
+    """
+
+    def __init__(self, failures):
+        self.failures = failures
+        self.calls = 0
+
+    def __call__(self, data):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise ConnectionError('Injected fault {}'.format(self.calls))
+        return data
+
+
+def extract(data):
+    for i in range(5):
+        yield {'id': i}
+
+
+def test_a_stage_is_retried_following_its_own_policy():
+    flaky = Flaky(failures=2)
+    load = Flaky(failures=0)
+    pipeline = Pipeline('test', [Stage('extract', extract), Stage('transform', flaky, retry=RetryPolicy(5, 0)),
+                                 Stage('load', load)])
+
+    assert pipeline.run() == [{'id': i} for i in range(5)]
+    assert (flaky.calls, load.calls) == (3, 1)
+    assert [metrics.attempts for metrics in pipeline.metrics] == [3, 3, 3]
+
+
+def test_the_policy_of_another_stage_does_not_retry_an_error():
+    flaky = Flaky(failures=1)
+    pipeline = Pipeline('test', [Stage('extract', flaky), Stage('load', list, retry=RetryPolicy(5, 0))])
+
+    with pytest.raises(ConnectionError):
+        pipeline.run([1, 2])
+    assert flaky.calls == 1
+
+
+def test_an_error_pulled_through_a_later_stage_follows_the_policy_of_its_stage():
+    def failing_extract(data):
+        yield {'id': 0}
+        raise ConnectionError('Injected fault')
+
+    load = Flaky(failures=0)
+    pipeline = Pipeline('test', [Stage('extract', failing_extract), Stage('load', lambda rows: load(list(rows)),
+                                                                          retry=RetryPolicy(5, 0))])
+
+    with pytest.raises(ConnectionError):
+        pipeline.run()
+    assert pipeline.metrics[1].attempts == 1
+
+
+def test_a_failed_run_resumes_from_its_checkpoint(tmp_path):
+    checkpoints = LocalCheckpoints(str(tmp_path))
+    extracted = Flaky(failures=0)
+    load = Flaky(failures=1)
+
+    def stages():
+        return [Stage('extract', lambda data: extract(extracted(data)), checkpoint=True),
+                Stage('load', lambda rows: load(list(rows)))]
+
+    with pytest.raises(ConnectionError):
+        Pipeline('test', stages(), checkpoints=checkpoints).run(run_id='run')
+    assert checkpoints.exists('run', 'extract')
+
+    pipeline = Pipeline('test', stages(), checkpoints=checkpoints)
+    assert pipeline.run(run_id='run') == [{'id': i} for i in range(5)]
+    # Extract did not run again, its rows came from the checkpoint
+    assert (extracted.calls, load.calls) == (1, 2)
+    assert [metrics.resumed for metrics in pipeline.metrics] == [True, False]
+
+
+def test_checkpoints_are_cleared_after_a_run(tmp_path):
+    checkpoints = LocalCheckpoints(str(tmp_path))
+    pipeline = Pipeline('test', [Stage('extract', extract, checkpoint=True), Stage('load', list)],
+                        checkpoints=checkpoints)
+
+    assert pipeline.run(run_id='run') == [{'id': i} for i in range(5)]
+    assert not checkpoints.exists('run', 'extract')
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_a_run_without_resume_clears_the_previous_checkpoints(tmp_path):
+    checkpoints = LocalCheckpoints(str(tmp_path))
+    checkpoints.write('run', 'extract', [{'id': 'stale'}])
+    pipeline = Pipeline('test', [Stage('extract', extract, checkpoint=True), Stage('load', list)],
+                        checkpoints=checkpoints)
+
+    assert pipeline.run(run_id='run', resume=False) == [{'id': i} for i in range(5)]
+    assert not any(metrics.resumed for metrics in pipeline.metrics)
@@ -0,0 +1,87 @@
+import boto3
+import pytest
+from botocore.exceptions import ClientError, EndpointConnectionError
+
+from src.lib.connectors.connector_aws_s3 import ConnectorS3
+from src.lib.connectors.s3_select import SelectQuery, is_aws_endpoint, is_select_unsupported
+
+mock_aws = pytest.importorskip('moto').mock_aws
+
+CONTENT = b'id,status,points\n1,Done,3\n2,Open,5\n3,Done,8\n'
+
+
+def client_error(code, status):
+    return ClientError({'Error': {'Code': code}, 'ResponseMetadata': {'HTTPStatusCode': status}},
+                       'SelectObjectContent')
+
+
+@pytest.mark.parametrize('error, aws, unsupported', [
+    (client_error('NotImplemented', 501), True, True),
+    (client_error('MethodNotAllowed', 405), True, True),
+    (client_error('InternalError', 500), True, False),
+    (client_error('InternalError', 500), False, True),
+    (client_error('NoSuchKey', 404), False, False),
+    (client_error('AccessDenied', 403), False, False),
+    # Raised in process by moto's SQL parser
+    (ValueError('list.remove(x): x not in list'), True, True),
+    (EndpointConnectionError(endpoint_url='http://localhost'), False, False),
+])
+def test_is_select_unsupported(error, aws, unsupported):
+    assert is_select_unsupported(error, aws=aws) is unsupported
+
+
+def test_is_aws_endpoint():
+    assert is_aws_endpoint('https://s3.amazonaws.com')
+    assert is_aws_endpoint('https://s3.eu-west-1.amazonaws.com')
+    assert not is_aws_endpoint('http://localhost:5000')
+    assert not is_aws_endpoint('https://minio.example.com')
+
+
+def test_select_query_expression():
+    query = SelectQuery(['id'], where=[('status', '=', 'Done'), ('points', '>', 4)], limit=10)
+
+    assert query.expression('csv') == ('SELECT s."id" FROM S3Object s WHERE s."status" = \'Done\' '
+                                       'AND CAST(s."points" AS INT) > 4 LIMIT 10')
+
+
+@pytest.fixture
+def conn_s3(monkeypatch):
+    for name in ('AWS_ACCESS_KEY_ID', 'AWS_SECRET_ACCESS_KEY'):
+        monkeypatch.setenv(name, 'testing')
+    with mock_aws():
+        boto3.client('s3', region_name='us-east-1').create_bucket(Bucket='bucket')
+        conn_s3 = ConnectorS3(bucket='bucket')
+        conn_s3.client.put_object(Bucket='bucket', Key='s.csv', Body=CONTENT)
+        yield conn_s3
+
+
+def test_select_rows_falls_back_when_the_endpoint_can_not_run_the_query(conn_s3):
+    assert list(conn_s3.select_rows('s.csv', columns=['id'], where={'status': 'Done'})) == [{'id': '1'},
+                                                                                             {'id': '3'}]
+    assert conn_s3._select_supported is False
+
+
+def test_select_rows_with_pushdown_raises_the_endpoint_error(conn_s3):
+    with pytest.raises(ValueError):
+        list(conn_s3.select_rows('s.csv', columns=['id'], where={'status': 'Done'}, pushdown=True))
+
+
+def test_select_rows_without_pushdown_filters_locally(conn_s3, monkeypatch):
+    def select_object_content(**kwargs):
+        raise AssertionError('S3 Select called')
+
+    monkeypatch.setattr(conn_s3.client, 'select_object_content', select_object_content)
+
+    rows = conn_s3.select_rows('s.csv', where=[('points', '>', 4)], pushdown=False)
+
+    assert list(rows) == [{'id': '2', 'status': 'Open', 'points': '5'}, {'id': '3', 'status': 'Done', 'points': '8'}]
+
+
+def test_select_rows_checks_its_arguments_when_called(conn_s3):
+    # Raised by the call itself, not on the first next()
+    with pytest.raises(ValueError):
+        conn_s3.select_rows('s.csv.xz', pushdown=True)
+    with pytest.raises(ValueError):
+        conn_s3.select_rows('s.csv', pushdown='always')
+    with pytest.raises(ValueError):
+        conn_s3.select_rows('s.csv', where=[('id', '~', 1)])